@@ -1,17 +1,20 @@
 """Built-in modules"""
 import sys
 import os
+import time
+import importlib
+STARTUP_TIME = time.perf_counter() # Reference for the startup benchmark
 
 """External modules"""
 from PyQt6.QtCore import Qt, QSize, QTimer
 from PyQt6.QtWidgets import QMainWindow, QApplication, QWidget, QPushButton, QGridLayout, QLabel
-from PyQt6.QtGui import QIcon, QPixmap
 
 """Internal modules"""
 try:
-    from FunFit.Functions import Fit_selection, Load, Find_structs, Roughness_analysis, Step_line_correction, Plane_leveling, helpers, Bitmap_generator, Plot_lines
+    from FunFit.Functions import helpers
 except:
-    from Functions import Fit_selection, Load, Find_structs, Roughness_analysis, Step_line_correction, Plane_leveling, helpers, Bitmap_generator, Plot_lines
+    from Functions import helpers
+FUNCTIONS_PACKAGE = helpers.__name__.rsplit(".", 1)[0] # Package of the tool modules, imported on first use
 
 """Set QT_QPA_PLATFORM to xcb if running on Wayland"""
 if os.environ.get('XDG_SESSION_TYPE') == 'wayland':
@@ -19,16 +22,27 @@ if os.environ.get('XDG_SESSION_TYPE') == 'wayland':
 
 """Window position"""
 window_pos_x, window_pos_y = 100, 100
+STARTUP_BUDGET = 1.0 # Seconds from process start until the main window is painted, checked by --startup-time
+DEFERRED_MODULES = ("matplotlib", "scipy", "sklearn") # Imported by the tools on first use, never at startup
+
+"""Function of a tool module, the module and its dependencies are imported on the first call"""
+def tool(module_name, function_name):
+    def handler(self, *args):
+        module = importlib.import_module(f"{FUNCTIONS_PACKAGE}.{module_name}")
+        return getattr(module, function_name)(self, *args)
+    return handler
 
 BUTTONS = [
-    ("Load files", Load.load_data),
-    ("Find structured area", Find_structs.crop_data),
-    ("Step line correction", Step_line_correction.line_correction),
-    ("Plane levelling", Plane_leveling.fit_and_subtract_plane),
-    ("Plot line cuts", Plot_lines.crop_data),
-    ("Fit functions", Fit_selection.init_interface),
-    ("Roughness of flat area", Roughness_analysis.extract_roughness),
-    ("Bitmap generator", Bitmap_generator.bmp_generator)
+    ("Load files", tool("Load", "load_data")),
+    ("Find structured area", tool("Find_structs", "crop_data")),
+    ("Step line correction", tool("Step_line_correction", "line_correction")),
+    ("Plane levelling", tool("Plane_leveling", "fit_and_subtract_plane")),
+    ("Plot line cuts", tool("Plot_lines", "crop_data")),
+    ("Fit functions", tool("Fit_selection", "init_interface")),
+    ("Fit scan series", tool("Series_fit", "fit_series")),
+    ("Roughness of flat area", tool("Roughness_analysis", "extract_roughness")),
+    ("Power spectral density", tool("PSD", "psd_analysis")),
+    ("Bitmap generator", tool("Bitmap_generator", "bmp_generator"))
 ]
 
 class MainWindow(QMainWindow):
@@ -38,7 +52,7 @@ class MainWindow(QMainWindow):
         self.current_dir = os.path.dirname(os.path.abspath(__file__)) # Get the current directory
         if self.current_dir.endswith('Functions'): # If the current directory ends with 'Functions'
             self.current_dir = os.path.dirname(self.current_dir) # Set the current directory to the parent directory
-        self.setWindowIcon(QIcon(os.path.join(self.current_dir, "GUI", "icon.ico"))) # Set the window icon
+        self.setWindowIcon(helpers.gui_icon("icon.ico")) # Set the window icon
 
         self.setup_ui()
         self.setAcceptDrops(True)  # Enable drag-and-drop
@@ -57,8 +71,7 @@ class MainWindow(QMainWindow):
     """Set up the main window UI"""
     def setup_ui(self):
         # Main window setup
-        with open(self.current_dir + "/GUI/stylesheet.qss", "r") as f:
-            self.setStyleSheet(f.read())
+        helpers.setAppStyleSheet_from_file(self.current_dir + "/GUI/stylesheet.qss")
         self.setWindowTitle("Main Window")
         self.setGeometry(window_pos_x, window_pos_y, 0, 0)
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint)
@@ -94,7 +107,7 @@ class MainWindow(QMainWindow):
             button.setObjectName("main_button")
             button.clicked.connect(lambda _, func=function: func(self))
             icon_name = f"icon_{button_name.lower().replace(' ', '_')}"
-            button.setIcon(QIcon(QPixmap(os.path.join(self.current_dir, "GUI", icon_name + ".png"))))
+            button.setIcon(helpers.gui_icon(icon_name + ".png"))
             button.setIconSize(QSize(32, 32))
             button.setCursor(Qt.CursorShape.PointingHandCursor)
             if i == 0:  # Add margin to top and bottom
@@ -133,7 +146,7 @@ class MainWindow(QMainWindow):
     def handle_file_drop(self, file_path):
         try:
             # Load data from the dropped file
-            Load.load_data(self, file_path)
+            tool("Load", "load_data")(self, file_path)
         except:
             pass
 
@@ -197,9 +210,26 @@ class MainWindow(QMainWindow):
             self.show_corner_decorations()  # Recreate decorations on resize
         super().resizeEvent(event)
 
+"""Startup benchmark, prints the import and first paint latency and fails if it exceeds the budget or a deferred module was imported"""
+def startup_benchmark(app, budget=STARTUP_BUDGET):
+    imported = time.perf_counter()
+    window = MainWindow()
+    window.show()
+    app.processEvents() # Deliver the show and expose events
+    window.repaint() # Paint synchronously so the first frame is included
+    painted = time.perf_counter()
+    print(f"Import: {imported - STARTUP_TIME:.3f} s")
+    print(f"First paint: {painted - imported:.3f} s")
+    print(f"Startup: {painted - STARTUP_TIME:.3f} s (budget {budget:.3f} s)")
+    deferred = sorted(name for name in sys.modules if name.split(".")[0] in DEFERRED_MODULES)
+    print(f"Deferred modules imported: {', '.join(deferred) if deferred else 'none'}")
+    return 0 if painted - STARTUP_TIME <= budget and not deferred else 1
+
 """Main function to run the application"""   
 def main():
     app = QApplication(sys.argv)
+    if "--startup-time" in sys.argv:
+        sys.exit(startup_benchmark(app))
     window = MainWindow()
     window.show()
     sys.exit(app.exec())
@@ -6,26 +6,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 from PyQt6.QtWidgets import QWidget, QLabel, QPushButton, QFileDialog, QMessageBox, QGridLayout
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QIcon
 
 """Internal modules"""
 try:
     from FunFit.Functions.Fit_selection import FunctionSelectionWindow
     import FunFit.Functions.Fit_handling as Fit_handling
-    from FunFit.Functions.Fit_handling import model_function_builder
+    from FunFit.Functions.Fit_handling import model_function_builder, evaluate_surface
+    from FunFit.Functions.helpers import gui_icon
 except:
     from Functions.Fit_selection import FunctionSelectionWindow
     import Functions.Fit_handling as Fit_handling
-    from Functions.Fit_handling import model_function_builder
-
-BUTTONS = [
-    ("Polynomials", Fit_handling.Polynomials, "polynomial"),
-    ("Exponential", Fit_handling.Exponential, "exponential"),
-    ("Fourier series", Fit_handling.FourierSeries, "fourierseries"),
-    ("Quasicrystal", Fit_handling.Quasicrystal, "quasicrystal"),
-    ("Gaussian", Fit_handling.Gaussian, "gaussian"),
-    ("Custom function", Fit_handling.Custom, "custom")
-]
+    from Functions.Fit_handling import model_function_builder, evaluate_surface
+    from Functions.helpers import gui_icon
 
 class InputDialog_BMP(QWidget):
     """Window to input parameters for the bitmap generator."""
@@ -151,9 +143,8 @@ def on_apply(self):
     
     # Build the model function
     model_func = model_function_builder(self.function_name, param_values)
-    x_full, y_full = np.meshgrid(self.parent.Raw_x-np.mean(self.parent.Raw_x), self.parent.Raw_y-np.mean(self.parent.Raw_y))
     try:
-        Z_fit = model_func((x_full.flatten(), y_full.flatten()), *param_values.values()).reshape(len(self.parent.Raw_y), len(self.parent.Raw_x))
+        Z_fit = evaluate_surface(model_func, list(param_values.values()), self.parent.Raw_x-np.mean(self.parent.Raw_x), self.parent.Raw_y-np.mean(self.parent.Raw_y))
     except:
         return
     
@@ -162,7 +153,7 @@ def on_apply(self):
     Dialog_window.setWindowTitle(f"Export bitmap")
     Dialog_window.setFileMode(QFileDialog.FileMode.Directory)
     Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
-    Dialog_window.setWindowIcon(QIcon(os.path.join(self.parent.parent.current_dir, "GUI", "icon_window.png")))
+    Dialog_window.setWindowIcon(gui_icon("icon_window.png"))
     Dialog_window.setDirectory(os.path.dirname(self.parent.parent.current_dir) + "/tests")
     if Dialog_window.exec() == QFileDialog.DialogCode.Accepted:
         file_path = Dialog_window.selectedFiles()[0]
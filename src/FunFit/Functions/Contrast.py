@@ -0,0 +1,97 @@
+"""Built-in modules"""
+import weakref
+from collections import OrderedDict
+
+"""External modules"""
+import numpy as np
+
+"""Constants"""
+HISTOGRAM_BINS = 65535 # Bins over the data range, stored as uint16 with the last index marking NaN
+CONTRAST_CLIP = 0.5 # Percent of the values saturated at each end of the color scale
+CONTRAST_CLIP_STEPS = (0.0, 0.1, 0.5, 1.0, 2.0, 5.0) # Clip values stepped through when adjusting the contrast
+INCREMENTAL_FRACTION = 0.25 # Largest changed fraction of an array for which its histogram is updated instead of rebuilt
+HISTOGRAM_CACHE_SIZE = 8 # Arrays whose histograms are kept
+HISTOGRAM_SAMPLE = 2**20 # Largest number of values counted, larger arrays are sampled on a strided grid
+
+class Histogram:
+    """Histogram of 2D data over fixed bins, drives the contrast of the rendered images."""
+    def __init__(self, Z):
+        self.stride = max(1, int(np.ceil(np.sqrt(Z.size / HISTOGRAM_SAMPLE))))
+        Z = self.sample(Z)
+        self.low, self.high = (float(np.nanmin(Z)), float(np.nanmax(Z))) if np.isfinite(Z).any() else (0.0, 0.0)
+        self.scale = HISTOGRAM_BINS / (self.high - self.low) if self.high > self.low else 0.0
+        self.counts = np.bincount(self.bin(Z).ravel(), minlength=HISTOGRAM_BINS + 1)
+        self.cached_lut = None
+
+    def sample(self, Z): # Strided view of the values that are counted
+        return Z[::self.stride, ::self.stride]
+
+    def copy(self): # Independent copy, used as the start of an incremental update
+        histogram = Histogram.__new__(Histogram)
+        histogram.stride, histogram.low, histogram.high, histogram.scale = self.stride, self.low, self.high, self.scale
+        histogram.counts = self.counts.copy()
+        histogram.cached_lut = None
+        return histogram
+
+    def bin(self, Z): # Bin index of every value, NaN values get the last index
+        Z = np.asarray(Z)
+        nan_mask = np.isnan(Z)
+        levels = np.clip((Z - self.low) * self.scale, 0, HISTOGRAM_BINS - 1)
+        if nan_mask.any():
+            levels[nan_mask] = HISTOGRAM_BINS
+        return levels.astype(np.uint16)
+
+    def update(self, old_values, new_values): # Replace the values of a changed region, False if they leave the binned range
+        finite = new_values[np.isfinite(new_values)]
+        if finite.size and (finite.min() < self.low or finite.max() > self.high):
+            return False
+        self.counts -= np.bincount(self.bin(old_values), minlength=HISTOGRAM_BINS + 1)
+        self.counts += np.bincount(self.bin(new_values), minlength=HISTOGRAM_BINS + 1)
+        self.cached_lut = None
+        return True
+
+    def limits(self, clip=CONTRAST_CLIP): # Color scale limits saturating clip percent of the values at each end
+        cumulative = np.cumsum(self.counts[:HISTOGRAM_BINS])
+        if self.scale == 0 or cumulative[-1] == 0:
+            return self.low, self.high
+        lower = np.searchsorted(cumulative, cumulative[-1] * clip / 100, side='right')
+        upper = np.searchsorted(cumulative, cumulative[-1] * (100 - clip) / 100, side='left')
+        return self.low + lower / self.scale, self.low + min(upper + 1, HISTOGRAM_BINS) / self.scale
+
+    def lut(self, colors, vmin, vmax): # ARGB32 color of every bin for the given limits, NaN is transparent
+        key = (id(colors), vmin, vmax)
+        if self.cached_lut is not None and self.cached_lut[0] == key:
+            return self.cached_lut[1]
+        centers = self.low + (np.arange(HISTOGRAM_BINS) + 0.5) / self.scale if self.scale else np.full(HISTOGRAM_BINS, self.low)
+        scale = 255.999 / (vmax - vmin) if vmax > vmin else 0.0
+        lut = np.zeros(HISTOGRAM_BINS + 1, dtype=np.uint32)
+        lut[:HISTOGRAM_BINS] = colors[np.clip((centers - vmin) * scale, 0, 255).astype(np.uint8)]
+        self.cached_lut = (key, lut)
+        return lut
+
+"""Histograms of recently displayed arrays, keyed by array identity"""
+HISTOGRAMS = OrderedDict()
+
+"""Histogram of an array, computed once per array and updated from the previous version when only a region changed"""
+def histogram(Z, previous=None):
+    cached = HISTOGRAMS.get(id(Z))
+    if cached is not None and cached[0]() is Z:
+        HISTOGRAMS.move_to_end(id(Z))
+        return cached[1]
+
+    result = None
+    base = HISTOGRAMS.get(id(previous)) if previous is not None else None
+    if base is not None and base[0]() is previous and previous.shape == Z.shape:
+        new, old = base[1].sample(Z), base[1].sample(previous)
+        changed = (new != old) & ~(np.isnan(new) & np.isnan(old))
+        if np.count_nonzero(changed) <= changed.size * INCREMENTAL_FRACTION:
+            result = base[1].copy()
+            if not result.update(old[changed], new[changed]):
+                result = None
+    if result is None:
+        result = Histogram(Z)
+
+    HISTOGRAMS[id(Z)] = (weakref.ref(Z), result)
+    while len(HISTOGRAMS) > HISTOGRAM_CACHE_SIZE:
+        HISTOGRAMS.popitem(last=False)
+    return result
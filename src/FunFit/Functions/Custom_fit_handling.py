@@ -39,8 +39,7 @@ class CustomFunctionWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
-        with open(self.parent.current_dir + "/GUI/stylesheet.qss", "r") as f:
-            style = f.read()
+        style = helpers.read_stylesheet(self.parent.current_dir + "/GUI/stylesheet.qss")
         style += """* { color: white; } """
         self.setStyleSheet(style)
         self.init_ui()
@@ -247,7 +246,8 @@ class CustomFunctionWindow(QMainWindow):
             ax.text(0.05, 0.5, latex_str, ha='left', va='center', fontsize=14, color='white', usetex=False)
 
             buf = BytesIO()
-            fig.savefig(buf, format='png', transparent=True, bbox_inches='tight', pad_inches=0)
+            with helpers.RENDER_LOCK: # Result panels may be rendering in the background
+                fig.savefig(buf, format='png', transparent=True, bbox_inches='tight', pad_inches=0)
             pixmap = QPixmap()
             pixmap.loadFromData(buf.getvalue())
             self.equation_preview.setPixmap(pixmap)
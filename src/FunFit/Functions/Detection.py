@@ -0,0 +1,124 @@
+"""Built-in modules"""
+import math
+
+"""External modules"""
+import numpy as np
+from scipy import fft, ndimage
+from scipy.spatial import ConvexHull, QhullError
+
+"""Constants"""
+DETECTION_TILES = 32 # Tiles of the local spectra along the shorter side of the scan
+TILE_RANGE = (16, 128) # Smallest and largest tile edge in pixels, tiles are a power of two
+BAND_LOW = 1.5 # Lowest frequency of the band in cycles per tile, slower changes are tilt and steps
+BAND_HIGH = 0.8 # Highest frequency of the band as a fraction of the Nyquist frequency, faster changes are noise
+REFINE_STEPS = 4 # Cells of the local variance map per tile edge, the borders of the areas follow the cells
+VARIANCE_WINDOW = 3 # Edge in cells of the windows of the local variance
+MIN_SEPARABILITY = 0.75 # Separability of the tile energies below which the scan has no distinct structured area
+MIN_AREA_TILES = 4 # Fewest tiles of a structured area, smaller areas are dirt or noise
+HISTOGRAM_BINS = 256 # Bins of the histograms the thresholds are found from
+
+"""Edge in pixels of the tiles of the local spectra, a power of two giving about DETECTION_TILES tiles along the shorter side"""
+def tile_size(shape):
+    tile = 2 ** int(math.log2(max(1, min(shape) // DETECTION_TILES)))
+    return int(np.clip(tile, *TILE_RANGE))
+
+"""Mean power of every tile in the band between tilt and noise, all tiles are transformed in one batched FFT"""
+def band_energy(Z, tile):
+    n_rows, n_cols = Z.shape[0] // tile, Z.shape[1] // tile
+    tiles = Z[:n_rows * tile, :n_cols * tile].reshape(n_rows, tile, n_cols, tile).swapaxes(1, 2) # View of the tiles
+    tiles = tiles - tiles.mean(axis=(2, 3), keepdims=True)
+    window = np.hanning(tile).astype(np.float32)
+    tiles *= np.outer(window, window)
+    power = np.abs(fft.rfft2(tiles, workers=-1))**2
+
+    # Radial frequency of the bins of a tile spectrum in cycles per tile
+    radius = np.hypot(fft.fftfreq(tile, 1 / tile)[:, None], fft.rfftfreq(tile, 1 / tile)[None, :])
+    band = ((radius >= BAND_LOW) & (radius <= BAND_HIGH * tile / 2)).astype(np.float32)
+    band[:, 1:-1] *= 2 # Bins of negative x frequencies are not stored
+    return power.reshape(n_rows, n_cols, -1) @ band.ravel() / tile**4
+
+"""Variance of the data in windows of VARIANCE_WINDOW cells around every cell, from integral images of the cell sums of the data and its square"""
+def local_variance(Z, cell):
+    n_rows, n_cols = Z.shape[0] // cell, Z.shape[1] // cell
+    Z = Z[:n_rows * cell, :n_cols * cell] - np.mean(Z, dtype=np.float64) # Centered, the sums of squares keep their precision
+    Z = Z.astype(np.float32).reshape(n_rows, cell, n_cols, cell)
+    half = VARIANCE_WINDOW // 2
+    first_row, first_col = np.maximum(np.arange(n_rows) - half, 0), np.maximum(np.arange(n_cols) - half, 0)
+    last_row, last_col = np.minimum(np.arange(n_rows) + half + 1, n_rows), np.minimum(np.arange(n_cols) + half + 1, n_cols)
+    window_sums = []
+    for values in (Z, np.square(Z)):
+        integral = np.zeros((n_rows + 1, n_cols + 1))
+        integral[1:, 1:] = values.sum(axis=(1, 3), dtype=np.float64).cumsum(axis=0).cumsum(axis=1)
+        window_sums.append(integral[np.ix_(last_row, last_col)] - integral[np.ix_(first_row, last_col)]
+                           - integral[np.ix_(last_row, first_col)] + integral[np.ix_(first_row, first_col)])
+    pixels = np.outer(last_row - first_row, last_col - first_col) * cell**2
+    mean = window_sums[0] / pixels
+    return np.maximum(window_sums[1] / pixels - mean**2, 0)
+
+"""Otsu threshold of values, and the separability of the two classes (0 for one class, 1 for two distinct values)"""
+def otsu_threshold(values):
+    values = values[np.isfinite(values)]
+    if values.size == 0 or values.min() == values.max():
+        return np.inf, 0.0
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(counts)[:-1] / values.size # Fraction of the values below every threshold
+    mean_below = np.cumsum(counts * centers)[:-1] / np.maximum(np.cumsum(counts)[:-1], 1)
+    mean_above = (np.sum(counts * centers) - np.cumsum(counts * centers)[:-1]) / np.maximum(values.size - np.cumsum(counts)[:-1], 1)
+    between = weight * (1 - weight) * (mean_above - mean_below)**2
+    best = int(np.argmax(between))
+    return edges[best + 1], float(between[best] / np.var(values))
+
+"""Smallest rectangle enclosing points (x, y), from the edges of their convex hull.
+Returns the corners in the order of the selection: the side from the first to the second corner is the one closest to the x axis."""
+def minimum_rectangle(points):
+    try:
+        hull = points[ConvexHull(points).vertices]
+    except (QhullError, ValueError): # Points on a line
+        hull = points
+    edges = np.diff(np.vstack([hull, hull[:1]]), axis=0)
+    angles = np.unique(np.arctan2(edges[:, 1], edges[:, 0]) % (np.pi / 2))
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    u, v = hull[:, 0] * cos + hull[:, 1] * sin, hull[:, 1] * cos - hull[:, 0] * sin # Hull in the frame of every edge angle
+    areas = (u.max(axis=1) - u.min(axis=1)) * (v.max(axis=1) - v.min(axis=1))
+    best = int(np.argmin(areas))
+    angle = angles[best] if angles[best] <= np.pi / 4 else angles[best] - np.pi / 2
+    cos, sin = math.cos(angle), math.sin(angle)
+    u, v = hull[:, 0] * cos + hull[:, 1] * sin, hull[:, 1] * cos - hull[:, 0] * sin
+    frame = [(u.min(), v.min()), (u.max(), v.min()), (u.max(), v.max()), (u.min(), v.max())]
+    return np.array([(a * cos - b * sin, a * sin + b * cos) for a, b in frame]), angle
+
+"""Rotated rectangles around the structured areas of a scan, as corners (x, y) in data pixels and the angle in radians.
+Tiles whose band energy stands out from the rest of the scan form the areas, their borders are refined with the local variance."""
+def structured_areas(Z):
+    Z = np.asarray(Z, dtype=np.float32)
+    if not np.isfinite(Z).all():
+        Z = np.where(np.isfinite(Z), Z, np.nanmean(Z)).astype(np.float32)
+    tile = tile_size(Z.shape)
+    if min(Z.shape) < 2 * tile:
+        return []
+
+    # Tiles with structure in the band, the scan has no distinct area if the energies are not bimodal
+    energy = np.log10(band_energy(Z, tile) + np.finfo(np.float32).tiny)
+    threshold, separability = otsu_threshold(energy.ravel())
+    if separability < MIN_SEPARABILITY:
+        return []
+    areas, count = ndimage.label(ndimage.binary_fill_holes(energy > threshold))
+
+    # Cells of high variance near every area give its border at a quarter of the tile size
+    cell = tile // REFINE_STEPS
+    variance = np.log10(local_variance(Z, cell) + np.finfo(np.float64).tiny)
+    variance_threshold, _ = otsu_threshold(variance.ravel())
+    blocks = np.ones((REFINE_STEPS, REFINE_STEPS), dtype=bool)
+    rectangles = []
+    for label in range(1, count + 1):
+        area = np.kron(areas == label, blocks) # Tiles of the area as cells
+        if area.sum() < MIN_AREA_TILES * REFINE_STEPS**2:
+            continue
+        near = ndimage.binary_dilation(area, iterations=REFINE_STEPS)
+        cells = ndimage.binary_opening(near & (variance[:near.shape[0], :near.shape[1]] > variance_threshold)) # Single cells are noise
+        rows, cols = np.nonzero(cells if cells.any() else area)
+        # Corners of the cells in data pixels
+        points = np.unique(np.concatenate([np.column_stack((cols + dx, rows + dy)) for dx in (0, 1) for dy in (0, 1)]), axis=0) * cell
+        rectangles.append(minimum_rectangle(points.astype(float)))
+    return sorted(rectangles, key=lambda rectangle: tuple(rectangle[0].mean(axis=0)[::-1]))
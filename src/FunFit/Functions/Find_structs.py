@@ -3,16 +3,19 @@ import math
 
 """External modules"""
 import numpy as np
-from matplotlib.path import Path
 from PyQt6.QtWidgets import QMainWindow, QWidget, QGridLayout, QMessageBox, QPushButton, QLabel, QHBoxLayout
-from PyQt6.QtCore import Qt, QPoint, QPointF, QSize, QPropertyAnimation, pyqtProperty
-from PyQt6.QtGui import QRegion, QIcon, QPixmap, QPainter, QPen, QColor, QPolygonF, QTransform, QBrush, QLinearGradient, QPainterPath, QCursor
+from PyQt6.QtCore import Qt, QPoint, QPointF, QRectF, QSize, QPropertyAnimation, pyqtProperty
+from PyQt6.QtGui import QRegion, QIcon, QPixmap, QPainter, QPen, QColor, QPolygonF, QTransform, QBrush, QLinearGradient, QPainterPath, QCursor, QFont
 
 """Internal modules"""
 try:
-    from FunFit.Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from FunFit.Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file, gui_icon, gui_pixmap
+    from FunFit.Functions.Selection import inscribed_rectangle, pixel_box, label_map, RegionLabels, RotatedFrame
+    from FunFit.Functions.Detection import structured_areas
 except ImportError:
-    from Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file, gui_icon, gui_pixmap
+    from Functions.Selection import inscribed_rectangle, pixel_box, label_map, RegionLabels, RotatedFrame
+    from Functions.Detection import structured_areas
 
 """Constants"""
 RH_SIZE = 50
@@ -22,6 +25,7 @@ SELECTION_BORDER_WIDTH = 5
 SELECTION_BORDER_COLOR_START = QColor(128, 83, 255)
 SELECTION_BORDER_COLOR_END = QColor(194, 59, 255)
 OPACITY_ANIMATION_DURATION = 200
+REGION_LABEL_SIZE = 14 # Point size of the numbers of the regions
 
 class OverlayWidget(QWidget): # Visualize selections
     """Overlay widget for showing an area of interest."""
@@ -29,6 +33,7 @@ class OverlayWidget(QWidget): # Visualize selections
         super().__init__(parent)
         self.parent = parent
         self.selection_polygon = QPolygonF()
+        self.regions = [] # Added regions, drawn with their numbers
         self._current_opacity = 0.0
         self.animation = QPropertyAnimation(self, b"current_opacity")
         self.animation.setDuration(OPACITY_ANIMATION_DURATION)
@@ -45,11 +50,21 @@ class OverlayWidget(QWidget): # Visualize selections
     """Set the selection polygon and animate the overlay"""
     def set_selection_polygon(self, polygon): # Show selection polygon and animate overlay
         # Check if state changed between empty/non-empty
-        was_empty = self.selection_polygon.isEmpty()
-        now_empty = polygon.isEmpty()
-        
+        was_empty = self.is_empty()
         self.selection_polygon = polygon
-        
+        self.animate(was_empty)
+
+    def set_regions(self, regions): # Show the added regions
+        was_empty = self.is_empty()
+        self.regions = list(regions)
+        self.animate(was_empty)
+
+    def is_empty(self): # Neither a selection polygon nor added regions
+        return self.selection_polygon.isEmpty() and not self.regions
+
+    def animate(self, was_empty): # Fade the overlay in or out when it changed between empty and non-empty
+        now_empty = self.is_empty()
+
         if was_empty != now_empty:  # Only animate on state changes
             target_opacity = 1.0 if not now_empty else 0.0
             if self.animation.state() == QPropertyAnimation.State.Running:
@@ -65,24 +80,46 @@ class OverlayWidget(QWidget): # Visualize selections
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         alpha = int(self._current_opacity * 140)  # Convert 0-1 range to 0-140 alpha
         
-        if not self.selection_polygon.isEmpty():
+        if not self.is_empty():
             # Draw dark overlay with animated opacity
             painter.fillRect(self.rect(), QColor(0, 0, 0, alpha))
             
-            # Draw selection border (existing code)
-            gradient = QLinearGradient(self.selection_polygon.boundingRect().topLeft(),
-                                      self.selection_polygon.boundingRect().bottomRight())
-            gradient.setColorAt(0, SELECTION_BORDER_COLOR_START)
-            gradient.setColorAt(1, SELECTION_BORDER_COLOR_END)
-            painter.setPen(QPen(QBrush(gradient), SELECTION_BORDER_WIDTH))
-            painter.drawPolygon(self.selection_polygon)
+            # Draw selection borders, the added regions are numbered
+            polygons = self.regions + ([self.selection_polygon] if not self.selection_polygon.isEmpty() else [])
+            for polygon in polygons:
+                draw_selection_border(painter, polygon)
+            if self.regions:
+                draw_region_labels(painter, polygons)
 
             # Update mask
             mask = QRegion(self.rect())
-            mask -= QRegion(self.selection_polygon.toPolygon())
+            for polygon in polygons:
+                mask -= QRegion(polygon.toPolygon())
             self.setMask(mask)
         painter.end()
 
+"""Draw the gradient border of a selection polygon, a cosmetic border keeps its width when the painter is scaled"""
+def draw_selection_border(painter, polygon, cosmetic=False):
+    gradient = QLinearGradient(polygon.boundingRect().topLeft(), polygon.boundingRect().bottomRight())
+    gradient.setColorAt(0, SELECTION_BORDER_COLOR_START)
+    gradient.setColorAt(1, SELECTION_BORDER_COLOR_END)
+    pen = QPen(QBrush(gradient), SELECTION_BORDER_WIDTH)
+    pen.setCosmetic(cosmetic)
+    painter.setPen(pen)
+    painter.drawPolygon(polygon)
+
+"""Draw the number of every region at its center, in device pixels so the numbers keep their size when the painter is scaled"""
+def draw_region_labels(painter, polygons):
+    painter.save()
+    transform = painter.transform()
+    painter.resetTransform()
+    painter.setFont(QFont("Verdana", REGION_LABEL_SIZE, QFont.Weight.Bold))
+    painter.setPen(QColor("white"))
+    for label, polygon in enumerate(polygons, start=1):
+        center = transform.map(polygon.boundingRect().center())
+        painter.drawText(QRectF(center.x() - 50, center.y() - 50, 100, 100), Qt.AlignmentFlag.AlignCenter, str(label))
+    painter.restore()
+
 class RotatableHandle(QLabel): # Enables rotation handle movement
     """Rotatable handle for rotating the selection polygon."""
     def __init__(self, parent, update_callback):
@@ -91,11 +128,11 @@ class RotatableHandle(QLabel): # Enables rotation handle movement
         self.update_callback = update_callback
         self.drag_offset = None
         self.angle_rad = 0
-        self.handle_pixmap = QPixmap(self.parent.parent.current_dir + "/GUI/rotationhandle.png")
+        self.handle_pixmap = gui_pixmap("rotationhandle.png")
         self.setFixedSize(RH_SIZE, RH_SIZE)
         self.setPixmap(self.handle_pixmap.scaled(int(RH_SIZE / np.sqrt(2)), int(RH_SIZE / np.sqrt(2)), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
         self.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.cursor_pixmap = QPixmap(self.parent.parent.current_dir + "/GUI/rotation_cursor.png")
+        self.cursor_pixmap = gui_pixmap("rotation_cursor.png")
         self.cursor_icon = QIcon(self.cursor_pixmap)
         cursor = QCursor(self.cursor_icon.pixmap(QSize(25, 25)), 0, 0)
         self.setCursor(cursor)
@@ -205,6 +242,7 @@ class FindStructWindow(QMainWindow):
         self.x_scale, self.y_scale = parent.x_scale, parent.y_scale
         self.angle = 0
         self.selection_polygon = QPolygonF()
+        self.regions = [] # Polygons of the added regions in image pixels
         setStyleSheet_from_file(self, self.parent.current_dir + "/GUI/stylesheet.qss")
         self.init_ui(parent)
 
@@ -248,10 +286,15 @@ class FindStructWindow(QMainWindow):
         self.reset_button = QPushButton("", self)
         self.reset_button.clicked.connect(self.reset_selection)
         self.reset_button.setObjectName("reset_button")
-        self.reset_button.setIcon(QIcon(self.parent.current_dir + "/GUI/reset.png"))
+        self.reset_button.setIcon(gui_icon("reset.png"))
         self.reset_button.setIconSize(QSize(25, 25))
         button_layout.addWidget(self.reset_button)
 
+        self.add_region_button = QPushButton("Add region", self)
+        self.add_region_button.clicked.connect(self.add_region)
+        self.add_region_button.setObjectName("main_button")
+        button_layout.addWidget(self.add_region_button)
+
         self.apply_button = QPushButton("Apply", self)
         self.apply_button.clicked.connect(self.apply_selection)
         self.apply_button.setObjectName("main_button")
@@ -521,8 +564,10 @@ class FindStructWindow(QMainWindow):
 
     """Overlay update"""
     def update_overlay(self): # Update the overlay with the selection polygon
-        if not self.selection_polygon.isEmpty():
-            mask = QRegion(self.image_label.rect()) - QRegion(self.selection_polygon.toPolygon())
+        if not self.selection_polygon.isEmpty() or self.regions:
+            mask = QRegion(self.image_label.rect())
+            for polygon in self.regions + [self.selection_polygon]:
+                mask -= QRegion(polygon.toPolygon())
             self.overlay.setMask(mask)
             self.overlay.set_selection_polygon(self.selection_polygon)
             self.overlay.update()
@@ -532,14 +577,50 @@ class FindStructWindow(QMainWindow):
             self.overlay.update()
         self.translate_corner_handles()  # Update draggable points when overlay is updated
 
-    def apply_selection(self): # Apply the selection whent the apply button is clicked
+    """Regions"""
+    def add_region(self): # Keep the current polygon as a numbered region, the next polygon starts a new region
         if self.selection_polygon.isEmpty():
+            return
+        self.regions.append(QPolygonF([QPointF(round(p.x()), round(p.y())) for p in self.corners]))
+        self.remove_existing_handles()
+        self.overlay.set_regions(self.regions)
+        self.selection_polygon = QPolygonF()
+        self.update_overlay()
+
+    def propose_areas(self): # Pre-populate the selection with the detected structured areas, the last one can be edited
+        areas = structured_areas(self.Raw_Z)
+        if not areas:
+            return
+        to_image = self.data_transform().inverted()[0]
+        polygons = [to_image.map(QPolygonF([QPointF(x, y) for x, y in corners])) for corners, _ in areas]
+        self.remove_existing_handles()
+        self.regions = polygons[:-1]
+        self.overlay.set_regions(self.regions)
+        self.corners = [QPointF(point) for point in polygons[-1]]
+        self.angle = math.atan2(self.corners[1].y() - self.corners[0].y(), self.corners[1].x() - self.corners[0].x())
+        self.selection_polygon = QPolygonF(self.corners)
+        self.overlay.set_selection_polygon(self.selection_polygon)
+        self.update_overlay()
+        self.add_rotation_handle()
+        self.add_corner_handles()
+        width = math.hypot(self.corners[1].x() - self.corners[0].x(), self.corners[1].y() - self.corners[0].y())
+        height = math.hypot(self.corners[3].x() - self.corners[0].x(), self.corners[3].y() - self.corners[0].y())
+        self.selection_size.setText("Selection size: {:.2f} x {:.2f} µm²".format(width/self.parent.img_scale_x*self.parent.x_scale, height/self.parent.img_scale_x*self.parent.y_scale))
+
+    def selected_polygons(self): # Polygons of the added regions and the current selection in image pixels
+        return self.regions + ([self.selection_polygon] if not self.selection_polygon.isEmpty() else [])
+
+    def data_transform(self): # Map from image pixels to data pixels
+        return QTransform.fromScale(self.Raw_Z.shape[1] / self.parent.img_scale_x, self.Raw_Z.shape[0] / self.parent.img_scale_y)
+
+    def apply_selection(self): # Apply the selection whent the apply button is clicked
+        if self.selection_polygon.isEmpty() and not self.regions:
             self.corners = [QPointF(0, 0), QPointF(self.parent.img_scale_x, 0), QPointF(self.parent.img_scale_x, self.parent.img_scale_y), QPointF(0, self.parent.img_scale_y)]
             if hasattr(self.parent, 'overlay'): 
                 try: self.parent.overlay.deleteLater() 
                 except: pass
             self.close()
-            for attr in ['inside_data', 'outside_data', 'inside_image', 'outside_image']:
+            for attr in ['inside_data', 'outside_data', 'selection', 'regions', 'inscribed_box', 'rotated_frame']:
                 if hasattr(self.parent, attr):
                     delattr(self.parent, attr)
             return
@@ -548,61 +629,65 @@ class FindStructWindow(QMainWindow):
             self.widget.deleteLater()
             del self.widget
 
-        # Snap the current polygon to integer values
-        self.overlay.set_selection_polygon(self.selection_polygon)
-        self.corners = [QPointF(int(round(p.x())), int(round(p.y()))) for p in self.corners]
-        self.selection_polygon = QPolygonF(self.corners)
-        self.translate_corner_handles()  # Update draggable points when polygon is snapped to integer values
-        # Set all points back to float
-        self.corners = [QPointF(p) for p in self.corners]
-        self.selection_polygon = QPolygonF(self.corners)
-        self.update_overlay()
+        if not self.selection_polygon.isEmpty():
+            # Snap the current polygon to integer values
+            self.overlay.set_selection_polygon(self.selection_polygon)
+            self.corners = [QPointF(int(round(p.x())), int(round(p.y()))) for p in self.corners]
+            self.selection_polygon = QPolygonF(self.corners)
+            self.translate_corner_handles()  # Update draggable points when polygon is snapped to integer values
+            # Set all points back to float
+            self.corners = [QPointF(p) for p in self.corners]
+            self.selection_polygon = QPolygonF(self.corners)
+            self.update_overlay()
         
         if hasattr(self.parent, 'overlay'): 
             try: self.parent.overlay.deleteLater() 
             except: pass
-        self.parent.overlay = OverlayWidget(self.parent.image)
-        self.parent.overlay.setGeometry(self.image_label.geometry())
-        self.parent.overlay.set_selection_polygon(self.selection_polygon)
-        self.parent.overlay.move(QPoint(0,int(self.parent.image.height()/2-self.parent.img_scale_y/2)))
-        self.parent.overlay.show()
-        self.parent.overlay.stackUnder(self.parent.export_button)
+        # Map the polygons from image pixels to data pixels, the main window view zooms in data coordinates
+        polygons = self.selected_polygons()
+        to_data = self.data_transform()
+        data_polygons = [to_data.map(polygon) for polygon in polygons]
+        self.parent.overlay = self.parent.image.show_selection(data_polygons)
         
-        self.parent.selection_polygon = self.selection_polygon
-
-        # Create a mask for the selection polygon
-        mask = np.zeros(self.Raw_Z.shape, dtype=bool)
-        x_coords, y_coords = np.meshgrid(np.arange(self.Raw_Z.shape[1]), np.arange(self.Raw_Z.shape[0]))
-        points = np.vstack((x_coords.flatten(), y_coords.flatten())).T
-        # Create a Path object from the selection polygon
-        polygon_path = Path([(point.x() * self.Raw_Z.shape[1] / self.parent.img_scale_x, point.y() * self.Raw_Z.shape[0] / self.parent.img_scale_y) for point in self.selection_polygon])
-
-        # Create a mask for the selection polygon
-        x_coords, y_coords = np.meshgrid(np.arange(self.Raw_Z.shape[1]), np.arange(self.Raw_Z.shape[0]))
-        points = np.vstack((x_coords.flatten(), y_coords.flatten())).T
-        mask = polygon_path.contains_points(points).reshape(self.Raw_Z.shape)
+        self.parent.selection_polygon = polygons[-1]
+        if len(polygons) == 1:
+            # Largest axis-aligned box inside the rotated selection, found in image pixels where the selection is a rectangle
+            x0, y0, x1, y1 = inscribed_rectangle([(p.x(), p.y()) for p in polygons[0]])
+            inscribed = to_data.mapRect(QRectF(QPointF(x0, y0), QPointF(x1, y1)))
+            self.parent.inscribed_box = pixel_box(inscribed.left(), inscribed.top(), inscribed.right(), inscribed.bottom(), self.Raw_Z.shape)
+            # A rotated rectangle is resampled in its own frame by the fits and spectra, nothing is cropped from its corners
+            frame = RotatedFrame([(point.x(), point.y()) for point in data_polygons[0]][:4], self.parent.Raw_x, self.parent.Raw_y)
+            if frame.rotated():
+                self.parent.rotated_frame = frame
+            elif hasattr(self.parent, 'rotated_frame'):
+                del self.parent.rotated_frame
+        else:
+            for attr in ['inscribed_box', 'rotated_frame']:
+                if hasattr(self.parent, attr):
+                    delattr(self.parent, attr)
 
-        # Create images with NaNs for outside points
-        self.parent.inside_image = np.where(mask, self.original_Raw_Z, np.nan)
-        self.parent.outside_image = np.where(~mask, self.original_Raw_Z, np.nan)
+        # Rasterize the polygons once into a label map, the tools read the data inside and outside through the selection of all regions
+        self.parent.regions = RegionLabels(label_map([[(point.x(), point.y()) for point in polygon] for polygon in data_polygons], self.Raw_Z.shape))
+        self.parent.selection = self.parent.regions.selection
 
         self.close()
         
-    def reset_selection(self): # Reset the selection when the reset button is clicked
-        if not hasattr(self, 'selection_polygon') or self.selection_polygon.isEmpty():
+    def reset_selection(self): # Reset the selection and the added regions when the reset button is clicked
+        if self.selection_polygon.isEmpty() and not self.regions:
             return
+        self.regions = []
+        self.overlay.set_regions(self.regions)
         self.selection_polygon = QPolygonF()
         self.overlay.set_selection_polygon(self.selection_polygon)
         self.update_overlay()
-        self.remove_corner_handles()
-        self.rotation_handle.deleteLater()
-        del self.rotation_handle
+        self.remove_existing_handles()
         self.update()
 
 """Function called from main window."""
 def crop_data(self=None):
     try: 
         self.w = FindStructWindow(self)
+        self.w.propose_areas()
     except Exception as e:
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Icon.Critical)
@@ -10,8 +10,8 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from scipy.optimize import curve_fit
 from PyQt6.QtCore import QThread, QObject, pyqtSignal, Qt, QTimer, QRect
-from PyQt6.QtGui import QIntValidator, QPixmap, QPainter, QPen, QColor
-from PyQt6.QtWidgets import QMainWindow, QWidget, QGridLayout, QMessageBox, QLabel, QLineEdit, QScrollArea, QPushButton
+from PyQt6.QtGui import QIntValidator, QPixmap, QImage, QPainter, QPen, QColor
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, QMessageBox, QLabel, QLineEdit, QScrollArea, QPushButton
 
 
 """Internal modules"""
@@ -20,11 +20,17 @@ try:
     from FunFit.Functions.Fit_plotting import PlotWindow, ResultsWindow
     from FunFit.Functions.Custom_fit_handling import CustomFunctionWindow
     from FunFit.Functions.Fit_config import FIT_PRESETS, FIT_EQUATIONS
+    from FunFit.Functions.Fit_models import MODELS
+    from FunFit.Functions.Symmetry import spectral_structure
+    from FunFit.Functions.Selection import largest_box
 except:
     from Functions import helpers
     from Functions.Fit_plotting import PlotWindow, ResultsWindow
     from Functions.Custom_fit_handling import CustomFunctionWindow
     from Functions.Fit_config import FIT_PRESETS, FIT_EQUATIONS
+    from Functions.Fit_models import MODELS
+    from Functions.Symmetry import spectral_structure
+    from Functions.Selection import largest_box
 
 """Set fitting parameters for chosen function"""
 def set_fitting_params(parent, func_name, parameters=None):
@@ -37,63 +43,57 @@ def set_fitting_params(parent, func_name, parameters=None):
 
 """Create fitting function based on selected model and parameters"""
 def model_function_builder(func_name, param_edits):
-    def polynomial_model(X, *params):
-        x, y = X
-        N = int(param_edits["N"].text().strip() or 1)
-        coeffs, c = params[:N], params[-1] if len(params) > N else 0.0
-        try:
-            c = float(c.text().strip())
-        except:
-            pass
-        return c + np.sum([coeffs[i] * (x ** (i + 1)) for i in range(N)], axis=0)
-    def exponential_model(X, *params):
-        x, y = X
-        A, b, c = params
-        return A * np.exp(b * x) + c
-    def gaussian_model(X, *params):
-        x, y = X
-        A, mu_x, mu_y, sigma_x, sigma_y, c = params
-        return A * np.exp(-((x - mu_x)**2 / (2 * sigma_x**2) + (y - mu_y)**2 / (2 * sigma_y**2))) + c
-    def quasicrystal_model(X, *params):
-        x, y = X
-        N = int(param_edits["N"].text().strip() or 1)
-        if len(params) < 3*N + 4:
-            theta, x0, y0, c = params[3*N] * np.pi / 180, 0.0, 0.0, params[3*N + 1]
-        else:
-            theta, x0, y0, c = params[3*N] * np.pi / 180, params[3*N + 1], params[3*N + 2], params[3*N + 3]
-        result = sum(params[i*3] * np.cos(2 * np.pi / params[i*3 + 1] * ((x - x0) * np.cos((theta + i * 180 / N) * np.pi / 180) + (y - y0) * np.sin((theta + i * 180 / N) * np.pi / 180)) + params[i*3 + 2]) for i in range(N))
-        return result + c
-    def fourier_model(X, *params):
-        x, y = X
-        N = int(param_edits["N"].text().strip() or 1)
-        theta, c = params[3*N] * np.pi / 180, params[3*N + 1]
-        result = sum(params[i*3] * np.cos(2 * np.pi / params[i*3 + 1] * (x * np.cos(theta) + y * np.sin(theta)) + params[i*3 + 2]) for i in range(N))
-        return result + c
-    models = {
-        "Polynomials": polynomial_model,
-        "Exponential": exponential_model,
-        "Gaussian": gaussian_model,
-        "Quasicrystal": quasicrystal_model,
-        "Fourier series": fourier_model,
-        "Custom": CUSTOM_MODEL
-    }
-    return models.get(func_name)
+    if func_name == "Custom":
+        return CUSTOM_MODEL
+    model = MODELS.get(func_name)
+    if model is None:
+        return None
+    def model_func(X, *params):
+        return model.evaluate(X, *params, N=component_count(model, param_edits))
+    return model_func
+
+"""Analytic Jacobian of the selected model, None if the model does not provide one"""
+def jacobian_builder(func_name, param_edits):
+    model = MODELS.get(func_name)
+    if model is None or model.jacobian is None:
+        return None
+    def jacobian(X, *params):
+        return model.jacobian(X, *params, N=component_count(model, param_edits))
+    return jacobian
+
+"""Number of components of a model, read from the N parameter widget or a value"""
+def component_count(model, param_edits):
+    if "N" not in model.parameters:
+        return None
+    N = param_edits["N"]
+    return int(N.text().strip() or 1) if isinstance(N, QLineEdit) else int(N)
 
 CUSTOM_MODEL = None
+FIT_SAMPLE_SIZE = int(1e5) # Maximum number of data points used in a fit
+SURFACE_BLOCK_SIZE = int(2**20) # Number of grid points evaluated at once
+PREVIEW_DELAY = 150 # Milliseconds without edits before the preview is updated
+
+"""Evaluate a model on the grid spanned by the axis vectors x and y, streamed in row blocks into the output"""
+def evaluate_surface(model_func, params, x, y, out=None):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if out is None:
+        out = np.empty((y.size, x.size))
+    rows = max(1, SURFACE_BLOCK_SIZE // max(1, x.size))
+    for start in range(0, y.size, rows):
+        stop = min(start + rows, y.size)
+        # The axis vectors broadcast against each other, so no meshgrid is needed
+        block = np.asarray(model_func((x[np.newaxis, :], y[start:stop, np.newaxis]), *params))
+        if block.ndim == 2 and block.shape[0] == 1 and stop - start > 1: # Model does not depend on y
+            out[:] = block
+            break
+        out[start:stop] = block
+    return out
 
 """Called from Function_selection_window.py"""
 def Auto(parent): # Auto - pending
     print("Auto")
-def Polynomials(parent): # Polynomials
-    set_fitting_params(parent, "Polynomials")
-def Exponential(parent): # Exponential
-    set_fitting_params(parent, "Exponential")
-def Quasicrystal(parent): # Quasicrystal
-    set_fitting_params(parent, "Quasicrystal")
-def FourierSeries(parent): # Fourier series
-    set_fitting_params(parent, "Fourier series")
-def Gaussian(parent): # Gaussian function
-    set_fitting_params(parent, "Gaussian")
+def select_model(func_name): # Registered models
+    return lambda parent: set_fitting_params(parent, func_name)
 def Custom(parent): # Custom function
     def handle_custom_accepted(model_func, parameters, func_str, latex_str):
         global CUSTOM_MODEL, FIT_EQUATIONS
@@ -114,138 +114,127 @@ def parse_input(text):
     except:
         return 0.0
 
+"""Read the initial guesses typed in the parameter widgets"""
+def read_initial_guesses(fitting_parameters, param_edits):
+    initial_guesses = {}
+    for param in fitting_parameters:
+        if param not in ['x0', 'y0']:
+            text_val = param_edits[param].text().strip() or "0.0"
+            initial_guesses[param] = parse_input(text_val)
+    return initial_guesses
+
+"""Selection mask cropped to its bounding box, and the box as (row, column) slices"""
+def selection_box(shape, selection=None):
+    if selection is not None:
+        if selection.shape == shape:
+            return selection.box(), selection.rows, selection.cols
+        # Log mismatch and ignore the mask
+        print("Mask shape does not match data shape. Ignoring mask.")
+    return np.ones(shape, dtype=bool), slice(None), slice(None)
+
+"""Flatten the data points inside the selection mask"""
+def masked_samples(Raw_x, Raw_y, Z_data, selection=None):
+    mask, rows, cols = selection_box(Z_data.shape, selection)
+    r, c = np.nonzero(mask) # Only the bounding box of the selection is visited
+    return Raw_x[cols][c], Raw_y[rows][r], Z_data[rows, cols][r, c]
+
+"""Data points of the selection, a rotated selection is resampled densely in its frame at the coordinates of the samples on the scan.
+Samples of a frame reaching past the scan are left out, like the pixels outside the scan are not part of the selection mask."""
+def selected_samples(Raw_x, Raw_y, Z_data, selection=None, frame=None):
+    if frame is not None and frame.scan_shape == Z_data.shape:
+        x_flat, y_flat = frame.coordinates()
+        Z = frame.resample(Z_data)
+        inside = np.isfinite(Z)
+        return x_flat[inside], y_flat[inside], Z[inside]
+    return masked_samples(Raw_x, Raw_y, Z_data, selection)
+
+"""Largest valid box of the selection in data of the given shape as (row, column) slices, the whole data without a selection.
+The FFT guess and the data panel of the results transform this view of the data, so its spectrum is computed once."""
+def spectrum_box(parent, shape):
+    selection = getattr(parent, 'selection', None)
+    if selection is None or selection.shape != shape:
+        return slice(0, shape[0]), slice(0, shape[1])
+    return largest_box(selection.full(), getattr(parent, 'inscribed_box', None))
+
+"""Rotated frame of the selection for data of the given shape, None for axis-aligned selections and several regions"""
+def selection_frame(parent, shape):
+    frame = getattr(parent, 'rotated_frame', None)
+    return frame if frame is not None and frame.scan_shape == shape else None
+
+"""Randomly subsample the data points to keep the fit fast"""
+def subsample(x_flat, y_flat, Z, size=FIT_SAMPLE_SIZE):
+    if x_flat.size > size:
+        sample_idx = np.random.choice(x_flat.size, size=int(size), replace=False)
+        x_flat = np.ascontiguousarray(x_flat[sample_idx])
+        y_flat = np.ascontiguousarray(y_flat[sample_idx])
+        Z = np.ascontiguousarray(Z[sample_idx])
+    return x_flat, y_flat, Z
+
+"""Determine initial guesses based on function type"""
+def estimate_initial_guesses(func_name, fitting_parameters, param_edits, initial_guesses, Raw_x, Raw_y, Z_data, x_flat, y_flat, Z):
+    model = MODELS.get(func_name)
+    if model is not None and model.guess is not None:
+        initial_guesses = model.guess(initial_guesses, fitting_parameters, component_count(model, param_edits),
+                                      Raw_x, Raw_y, Z_data, x_flat, y_flat, Z)
+
+    # Rest of the fitting process remains the same
+    if "c" in fitting_parameters:
+        initial_guesses["c"] = np.mean(Z)
+    return initial_guesses
+
 class FitWorker(QObject):
     """Worker class for fitting process."""
     finished = pyqtSignal(object, object, object) # (popt, perr, Z_fit)
     error = pyqtSignal(Exception)
 
-    def __init__(self, parent, inside_image, params):
+    def __init__(self, parent, selection, params):
         super().__init__()
         self.parent = parent
         self.params = params
-        self.inside_image = inside_image
+        self.selection = selection
 
     def run(self): # Run the fitting process
         try:
             # Load and prepare data
             Z_data = self.parent.corrected_data if hasattr(self.parent, 'corrected_data') else self.parent.Raw_Z
-            initial_guesses = {}
-            for param in self.params['FITTINGPARAMETERS']:
-                if param not in ['x0', 'y0']:
-                    text_val = self.params['param_edits'][param].text().strip() or "0.0"
-                    initial_guesses[param] = parse_input(text_val)
-            if self.inside_image is not None:
-                if self.inside_image.shape == Z_data.shape:
-                    mask = ~np.isnan(self.inside_image)
-                else:
-                    # Log mismatch and ignore the mask
-                    print("Mask shape does not match data shape. Ignoring mask.")
-                    mask = np.ones_like(Z_data, dtype=bool)
-            else:
-                mask = np.ones_like(Z_data, dtype=bool)
-
-            x_flat, y_flat = np.meshgrid(self.parent.Raw_x, self.parent.Raw_y)
-            x_flat, y_flat, Z = x_flat.flatten(), y_flat.flatten(), Z_data.flatten()
-            x_flat, y_flat, Z = x_flat[mask.flatten()], y_flat[mask.flatten()], Z[mask.flatten()]
+            initial_guesses = read_initial_guesses(self.params['FITTINGPARAMETERS'], self.params['param_edits'])
+            x_flat, y_flat, Z = selected_samples(self.parent.Raw_x, self.parent.Raw_y, Z_data, self.selection, self.params.get('frame'))
 
             # Determine initial guesses based on function type
             func_name = self.params['function_name']
-            if func_name == "Gaussian":
-                # Find max in MASKED data
-                if len(Z) > 0:
-                    max_idx = np.nanargmax(Z)
-                    initial_guesses['µ_x'] = x_flat[max_idx]
-                    initial_guesses['µ_y'] = y_flat[max_idx]
-                else:  # Fallback if no data
-                    initial_guesses['µ_x'] = 0.0
-                    initial_guesses['µ_y'] = 0.0
-                # Safeguard sigma values
-                initial_guesses['σ_x'] = max(1.0, 1e-6)
-                initial_guesses['σ_y'] = max(1.0, 1e-6)
-                
-            elif func_name in ["Quasicrystal", "Fourier series"]:
-                # FFT-based translation detection with multiple peaks
-                Z_data_2d = np.nan_to_num(Z_data) if np.isnan(Z_data).any() else Z_data
-                fft_shift = np.fft.fftshift(np.fft.fft2(Z_data_2d - np.mean(Z_data_2d)))
-                phase = np.angle(fft_shift)
-                magnitude = np.abs(fft_shift)
-                crow, ccol = magnitude.shape[0]//2, magnitude.shape[1]//2
-                magnitude_work = magnitude.copy()
-                magnitude_work[crow-10:crow+11, ccol-10:ccol+11] = 0  # Mask DC component
-
-                n_components = int(self.params['param_edits']["N"].text().strip() or 1)
-                peaks_info = []
-                auto_lambdas = []  # Store detected wavelengths
-                
-                # Calculate pixel sizes
-                dx = self.parent.Raw_x[1] - self.parent.Raw_x[0] if len(self.parent.Raw_x) > 1 else 1.0
-                dy = self.parent.Raw_y[1] - self.parent.Raw_y[0] if len(self.parent.Raw_y) > 1 else 1.0
-
-                for _ in range(n_components):
-                    peak_idx = np.argmax(magnitude_work)
-                    if magnitude_work.flat[peak_idx] == 0:
-                        break
-                    prow, pcol = np.unravel_index(peak_idx, magnitude_work.shape)
-                    
-                    # Calculate frequency components
-                    freq_x = (pcol - ccol)/(magnitude_work.shape[1]*dx)
-                    freq_y = (prow - crow)/(magnitude_work.shape[0]*dy)
-                    
-                    freq_magnitude = np.sqrt(freq_x**2 + freq_y**2)
-                    wavelength = 1.0/freq_magnitude if freq_magnitude != 0 else 0.0
-                    auto_lambdas.append(max(wavelength, 1e-6))  # Prevent zero wavelengths
-                    phi = phase[prow, pcol]
-                    peaks_info.append((freq_x, freq_y, phi))
-    
-                    # Mask detected peak
-                    magnitude_work[max(0,prow-10):prow+11, max(0,pcol-10):pcol+11] = 0
-
-                # Assign detected wavelengths to parameters
-                lambda_params = [p for p in FITTINGPARAMETERS if p.startswith("λ<sub>")]
-                for i, param in enumerate(lambda_params):
-                    if i < len(auto_lambdas):
-                        initial_guesses[param] = auto_lambdas[i]
-                    else:
-                        initial_guesses[param] = 1e-6  # Default safe value
-
-                # Solve linear system for x0, y0 using all detected peaks
-                if len(peaks_info) > 0:
-                    A = []
-                    b = []
-                    for fx, fy, ph in peaks_info:
-                        A.append([fx, fy])
-                        b.append(-ph/(2*np.pi))
-                    A = np.array(A)
-                    b = np.array(b)
-                    try:
-                        x0_initial, y0_initial = np.linalg.lstsq(A, b, rcond=None)[0]
-                    except np.linalg.LinAlgError:
-                        # Fallback to strongest peak if matrix is singular
-                        fx, fy, ph = peaks_info[0]
-                        x0_initial = -ph/(2*np.pi*fx) if fx !=0 else 0
-                        y0_initial = -ph/(2*np.pi*fy) if fy !=0 else 0
-                    initial_guesses.update({'x0': x0_initial, 'y0': y0_initial})
-
-            # Rest of the fitting process remains the same
-            if "c" in FITTINGPARAMETERS:
-                initial_guesses["c"] = np.mean(Z)
+            rows, cols = spectrum_box(self.params['parent'], Z_data.shape)
+            initial_guesses = estimate_initial_guesses(func_name, FITTINGPARAMETERS, self.params['param_edits'], initial_guesses,
+                                                       self.parent.Raw_x[cols], self.parent.Raw_y[rows], Z_data[rows, cols], x_flat, y_flat, Z)
             p0 = [initial_guesses[p] for p in FITTINGPARAMETERS if p != "N"]
             model_func = model_function_builder(self.params['function_name'], self.params['param_edits'])
+            jacobian = jacobian_builder(self.params['function_name'], self.params['param_edits'])
 
-            if x_flat.size > 1e5:
-                sample_idx = np.random.choice(x_flat.size, size=int(1e5), replace=False)
-                x_flat = np.ascontiguousarray(x_flat[sample_idx])
-                y_flat = np.ascontiguousarray(y_flat[sample_idx])
-                Z = np.ascontiguousarray(Z[sample_idx])
+            x_flat, y_flat, Z = subsample(x_flat, y_flat, Z)
 
-            popt, pcov = curve_fit(model_func, (x_flat, y_flat), Z, p0=p0)
-            x_full, y_full = np.meshgrid(self.parent.Raw_x, self.parent.Raw_y)
-            Z_fit = model_func((x_full.flatten(), y_full.flatten()), *popt).reshape(len(self.parent.Raw_y), len(self.parent.Raw_x))
+            popt, pcov = curve_fit(model_func, (x_flat, y_flat), Z, p0=p0, jac=jacobian)
+            _, rows, cols = selection_box(Z_data.shape, self.selection)
+            Z_fit = evaluate_surface(model_func, popt, self.parent.Raw_x[cols], self.parent.Raw_y[rows]) # Bounding box of the selection
             perr = np.sqrt(np.diag(pcov)) if pcov is not None else np.full_like(popt, np.nan)
             self.finished.emit(popt, perr, Z_fit)
         except Exception as e:
             self.error.emit(e)
             
+class PreviewWorker(QObject):
+    """Worker class for evaluating the parameter preview."""
+    finished = pyqtSignal(object) # Z_preview, None if the parameters are incomplete
+
+    def __init__(self, model_func, params, x, y):
+        super().__init__()
+        self.model_func, self.params = model_func, params
+        self.x, self.y = x, y
+
+    def run(self): # Evaluate the model on the preview grid
+        try:
+            Z_preview = evaluate_surface(self.model_func, self.params, self.x, self.y)
+        except Exception:
+            Z_preview = None
+        self.finished.emit(Z_preview)
+
 class ParameterSelectionWindow(QMainWindow):
     """Parameter selection window for fitting functions."""
     def __init__(self, parent, parameters, function_name):
@@ -270,6 +259,12 @@ class ParameterSelectionWindow(QMainWindow):
                     self.static_params.append(param)
 
         self.fit_thread, self.fit_worker = None, None
+        self.preview_thread, self.preview_worker, self.pending_preview = None, None, None
+        self.preview_image = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self.render_preview)
         helpers.setStyleSheet_from_file(self, self.parent.current_dir + "/GUI/stylesheet.qss")
         self.init_ui(parent)
 
@@ -308,27 +303,45 @@ class ParameterSelectionWindow(QMainWindow):
         main_layout.addWidget(self.preview_label, 1, 1)
 
         self.add_parameter_widgets()
+        self.prefill_parameters()
         self.initial_bitmap()
-        self.update_bitmap()
+        self.render_preview()
         
+    def prefill_parameters(self): # Fill N and initial guesses detected from the spectrum of the data, shared with the FFT guess
+        model = MODELS.get(self.function_name)
+        if model is None or model.prefill is None:
+            return
+        try:
+            Z, x, y = self.Raw_Z, self.Raw_x, self.Raw_y
+            selection = getattr(self.parent, 'selection', None)
+            frame = selection_frame(self.parent, Z.shape)
+            if frame is not None: # Rotated selection resampled in its frame, the angles are turned back to the scan axes
+                structure = spectral_structure(*frame.resample_valid(Z), rotation=np.degrees(frame.angle))
+            else:
+                if selection is not None and selection.shape == Z.shape: # Largest box inside the selection, without its outline
+                    rows, cols = largest_box(selection.full(), getattr(self.parent, 'inscribed_box', None))
+                    Z, x, y = Z[rows, cols], x[cols], y[rows]
+                structure = spectral_structure(Z, x, y)
+            values = model.prefill(structure)
+        except Exception as e:
+            print(f"Spectral structure not detected: {e}")
+            return
+        if "N" in values and "N" in self.param_edits: # Rebuilds the widgets of the components
+            self.param_edits["N"].setText(str(values.pop("N")))
+        for param, value in values.items():
+            if param in self.param_edits:
+                self.param_edits[param].setText(f"{value:.4g}")
+
     def initial_bitmap(self): # Set an initial bitmap for the preview label
         if hasattr(self.parent, 'x_scale') and hasattr(self.parent, 'y_scale'):
             self.ratio = self.parent.x_scale / self.parent.y_scale
         else:
             self.ratio = self.parent.Raw_x[-1] / self.parent.Raw_y[-1]
         self.img_scale = 300
-        self.figure = Figure(facecolor='none', edgecolor='none', frameon=False, figsize=(5/self.ratio, 5), dpi=int(self.img_scale/5))
-        self.canvas = FigureCanvasQTAgg(self.figure)
         self.preview_label.setFixedSize(self.img_scale, self.img_scale)
-        self.ax = self.figure.add_axes([0, 0, 1, 1], frameon=False)
-        self.ax.set_xticks([]), self.ax.set_yticks([])
-        x_full, y_full = np.meshgrid(self.parent.Raw_x, self.parent.Raw_y)
-        scan_ratio = len(self.parent.Raw_x) / len(self.parent.Raw_y)
-        Z_fit = np.zeros_like(x_full)
-        
-        self.ax.imshow(Z_fit, cmap='gray', origin='upper', aspect=1)
-        self.canvas.draw()
-        self.preview_label.setPixmap(QPixmap(self.canvas.grab()).scaled(int(self.preview_label.size().width() / np.sqrt(2)), int(self.preview_label.size().height() / np.sqrt(2)), 
+        Z_fit = np.zeros((self.img_scale, int(self.img_scale/self.ratio)))
+        image = helpers.render_image(Z_fit, Z_fit.shape[1], Z_fit.shape[0])
+        self.preview_label.setPixmap(QPixmap.fromImage(image).scaled(int(self.preview_label.size().width() / np.sqrt(2)), int(self.preview_label.size().height() / np.sqrt(2)), 
                                                                            Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
         self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
@@ -342,7 +355,8 @@ class ParameterSelectionWindow(QMainWindow):
         ax.text(0.05, 0.5, eq_str, ha='left', va='center', fontsize=14, color='white', usetex=False)
 
         buf = BytesIO()
-        fig.savefig(buf, format='png', transparent=True, bbox_inches='tight')
+        with helpers.RENDER_LOCK: # Result panels may be rendering in the background
+            fig.savefig(buf, format='png', transparent=True, bbox_inches='tight')
         pixmap = QPixmap()
         pixmap.loadFromData(buf.getvalue())
         return pixmap
@@ -419,7 +433,10 @@ class ParameterSelectionWindow(QMainWindow):
 
         self.scroll_layout.addWidget(apply_button, row_index, 0, 1, 2)
 
-    def update_bitmap(self): # Update the dynamic bitmap based on the current parameters
+    def update_bitmap(self): # Update the preview once the parameters stop changing
+        self.preview_timer.start()
+
+    def render_preview(self): # Evaluate the model for the current parameters on the preview grid
         # Extract parameters and build the equation
         param_values = {param: self.param_edits[param].text().strip() for param in self.param_edits if param != "N"}
 
@@ -439,21 +456,21 @@ class ParameterSelectionWindow(QMainWindow):
                     except ValueError: y_size = 1
         param_values = {param: param_values[param] for param in param_values if param not in skip_params}
         
-        # Calculate the number of pixels based on the scale
+        # Axes of the bitmap to generate, the selected area or the whole scan
         try:
             no_x = int(np.ceil(x_size/nm_px))
             no_y = int(np.ceil(y_size/nm_px))
-            self.parent.Raw_x = np.linspace(-x_size/2, x_size/2, no_x)
-            self.parent.Raw_y = np.linspace(-y_size/2, y_size/2, no_y)
-            self.parent.Raw_Z = np.zeros((no_x, no_y))
+            x_axis = np.linspace(-x_size/2, x_size/2, no_x)
+            y_axis = np.linspace(-y_size/2, y_size/2, no_y)
             self.ratio = x_size / y_size
-        except: pass
+        except:
+            x_axis, y_axis = self.preview_axes()
+            if hasattr(self.parent, 'selection'):
+                self.ratio = x_axis[-1] / y_axis[-1]
 
-        # Get values for the parameters
+        # Read the number of components here, the model is evaluated off the GUI thread
         try:
-            param_values["N"] = self.param_edits["N"]
-            if param_values["N"] == "":
-                param_values["N"] = 1
+            param_values["N"] = int(self.param_edits["N"].text().strip() or 1)
         except: pass
 
         # Convert parameters to float
@@ -468,83 +485,88 @@ class ParameterSelectionWindow(QMainWindow):
         
         # Build the model function
         model_func = model_function_builder(self.function_name, param_values)
-        x_full, y_full = np.meshgrid(self.parent.Raw_x-np.mean(self.parent.Raw_x), self.parent.Raw_y-np.mean(self.parent.Raw_y))
-        
-        if hasattr(self.parent, 'inside_image') and not nm_px:
-            self.mask1 = ~np.isnan(self.parent.inside_image)
-            self.x_masked = self.parent.Raw_x[self.mask1.any(axis=0)]
-            self.y_masked = self.parent.Raw_y[self.mask1.any(axis=1)]
-            self.ratio = self.x_masked[-1] / self.y_masked[-1]
-            x_full, y_full = np.meshgrid(self.x_masked-np.mean(self.x_masked), self.y_masked-np.mean(self.y_masked))
 
-        try:
-            if hasattr(self, 'x_masked'):
-                Z_fit = model_func((x_full.flatten(), y_full.flatten()), *param_values.values()).reshape(len(self.y_masked), len(self.x_masked))
-            else:
-                Z_fit = model_func((x_full.flatten(), y_full.flatten()), *param_values.values()).reshape(len(self.parent.Raw_y), len(self.parent.Raw_x))
-        except:
-            return
-
-        # Plot the bitmap
-        self.ax.clear()
+        # Size of the bitmap with the aspect ratio of the scan
         self.img_scale = 300
         self.preview_label.setFixedSize(self.img_scale, self.img_scale)
-        self.figure = Figure(facecolor='none', edgecolor='none', frameon=False, figsize=(5, 5), dpi=int(self.img_scale/5.5))
-        if self.ratio > 1:
-            self.figure.set_size_inches(5, 5/self.ratio)
-        elif self.ratio < 1:
-            self.figure.set_size_inches(5*self.ratio, 5)
-        else:
-            self.figure.set_size_inches(5, 5)
-
-        self.canvas = FigureCanvasQTAgg(self.figure)
-        self.ax = self.figure.add_axes([0, 0, 1, 1], frameon=False)
-        self.ax.set_xticks([])
-        self.ax.set_yticks([])
-        
-        if hasattr(self, 'x_masked'):
-            x_full, y_full = np.meshgrid(self.x_masked, self.y_masked)
-        else:
-            x_full, y_full = np.meshgrid(self.parent.Raw_x, self.parent.Raw_y)
+        size = 5*int(self.img_scale/5.5)
+        width, height = (size, int(size/self.ratio)) if self.ratio > 1 else (int(size*self.ratio), size)
+
+        # Sample the axes on a grid no finer than the bitmap
+        x_grid = np.linspace(x_axis[0], x_axis[-1], min(len(x_axis), width)) - np.mean(x_axis)
+        y_grid = np.linspace(y_axis[0], y_axis[-1], min(len(y_axis), height)) - np.mean(y_axis)
+
+        # Only the latest request is kept while a preview is being evaluated
+        self.pending_preview = (model_func, list(param_values.values()), x_grid, y_grid, (width, height))
+        if self.preview_thread is None:
+            self.start_preview()
+
+    def preview_axes(self): # Axes of the scan, cropped to the bounding box of the selection
+        selection = getattr(self.parent, 'selection', None)
+        if selection is None:
+            return self.parent.Raw_x, self.parent.Raw_y
+        return self.parent.Raw_x[selection.cols], self.parent.Raw_y[selection.rows]
+
+    def start_preview(self): # Evaluate the pending preview in a worker thread
+        request, self.pending_preview = self.pending_preview, None
+        model_func, params, x_grid, y_grid, self.preview_size = request
+
+        # The thread belongs to the application so a closed window does not destroy it while running
+        self.preview_thread = QThread(QApplication.instance())
+        self.preview_worker = PreviewWorker(model_func, params, x_grid, y_grid)
+        self.preview_thread.worker = self.preview_worker
+        self.preview_worker.moveToThread(self.preview_thread)
+        self.preview_thread.started.connect(self.preview_worker.run)
+        self.preview_worker.finished.connect(self.on_preview_ready)
+        self.preview_worker.finished.connect(self.preview_thread.quit)
+        self.preview_thread.finished.connect(self.on_preview_thread_finished)
+        self.preview_thread.finished.connect(self.preview_thread.deleteLater)
+        QApplication.instance().aboutToQuit.connect(self.preview_thread.wait)
+        self.preview_thread.start()
+
+    def on_preview_thread_finished(self): # Continue with a request made during the evaluation
+        self.preview_thread.wait()
+        self.preview_thread, self.preview_worker = None, None
+        if self.pending_preview is not None:
+            self.start_preview()
+
+    def on_preview_ready(self, Z_preview): # Draw the preview into the reused image
+        if Z_preview is None:
+            return
+        width, height = self.preview_size
+        if self.preview_image is None or (self.preview_image.width(), self.preview_image.height()) != (width, height):
+            self.preview_image = QImage(width, height, QImage.Format.Format_ARGB32)
+        self.preview_image.fill(Qt.GlobalColor.transparent)
 
-        x_extent = (x_full[-1, -1] - x_full[0, 0])/2
-        y_extent = (y_full[-1, -1] - y_full[0, 0])/2
-        self.ax.imshow(Z_fit, cmap='gray', origin='upper', aspect=1, extent=(-x_extent, x_extent, -y_extent, y_extent))
-        self.canvas.draw()
-        
-        # Set the pixmap for the preview label
-        pixelmap = QPixmap(self.canvas.grab())
-        painter = QPainter(pixelmap)
+        painter = QPainter(self.preview_image)
+        painter.drawImage(0, 0, helpers.render_image(Z_preview, width, height))
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         pen = QPen(QColor("#000000"), 8)
         painter.setPen(pen)
         painter.setBrush(Qt.BrushStyle.NoBrush)
-        r1 = pixelmap.rect().getCoords()
+        r1 = self.preview_image.rect().getCoords()
         painter.drawRect(QRect(r1[0], r1[1], r1[2], r1[3]))
         painter.end()
-        self.preview_label.setPixmap(pixelmap)
+        self.preview_label.setPixmap(QPixmap.fromImage(self.preview_image))
 
     def on_apply(self): # Apply the fitting parameters
-        if hasattr(self, 'plot_window') and self.plot_window is not None:
-            self.plot_window.close()
-            self.plot_window = None
-
         # Disable UI during fitting
         self.scroll_area.setEnabled(False)
         self.show_loading_overlay()
 
         # Prepare parameters for worker
-        inside_image = getattr(self.parent, 'inside_image', None)
+        selection = getattr(self.parent, 'selection', None)
         params = {
             'parent': self.parent,
             'param_edits': self.param_edits,
             'FITTINGPARAMETERS': FITTINGPARAMETERS,
-            'function_name': self.function_name
+            'function_name': self.function_name,
+            'frame': selection_frame(self.parent, self.Raw_Z.shape)
         }
 
         # Setup thread and worker
         self.fit_thread = QThread()
-        self.fit_worker = FitWorker(self, inside_image, params)
+        self.fit_worker = FitWorker(self, selection, params)
         self.fit_worker.moveToThread(self.fit_thread)
         
         # Connect signals
@@ -590,25 +612,7 @@ class ParameterSelectionWindow(QMainWindow):
         # Process results in main thread
         self.hide_loading_overlay()
         self.scroll_area.setEnabled(True)
-        
-        if hasattr(self.parent, 'corrected_data'): Raw_Z = self.parent.corrected_data  
-        else: Raw_Z = self.parent.Raw_Z
-        Z_fit_flipped = np.flip(Z_fit, axis=0) # Use np.flip instead of np.flipud for faster flipping
-        
-        # Flip the data if inside_image is present
-        if hasattr(self.parent, 'inside_image'):
-            mask_2d = np.isfinite(self.parent.inside_image)
-            Z_data_inside = np.full_like(Raw_Z, np.nan)
-            Z_data_inside[mask_2d] = Raw_Z[mask_2d]
-            Z_data_flipped = np.flip(Z_data_inside, axis=0)
-        else:
-            Z_data_flipped = np.flip(Raw_Z, axis=0)
-
-        # Show the plot window and results window
-        self.plot_window = PlotWindow(self, self.parent.Raw_x, self.parent.Raw_y, 
-                                    Z_data_flipped, Z_fit_flipped,
-                                    popt, perr, self.function_name, FITTINGPARAMETERS)
-        self.plot_window.show()
+        self.show_fit_plots(np.flip(Z_fit, axis=0), popt, perr) # Use np.flip instead of np.flipud for faster flipping
         filtered_params = [p for p in FITTINGPARAMETERS if p != "N"]
         
         if self.function_name == "Gaussian": # No idea why, but this is necessary
@@ -618,6 +622,34 @@ class ParameterSelectionWindow(QMainWindow):
         self.results_window.show()
         self.close()
 
+    def show_fit_plots(self, Z_fit_flipped, popt=None, perr=None): # Show the data, fit and residual of the bounding box of the selection
+        if hasattr(self.parent, 'corrected_data'): Raw_Z = self.parent.corrected_data  
+        else: Raw_Z = self.parent.Raw_Z
+
+        # Crop the data to the bounding box of the selection (Z_fit only covers the box) and flip it
+        mask, rows, cols = selection_box(Raw_Z.shape, getattr(self.parent, 'selection', None))
+        Z_data_box = np.where(mask, Raw_Z[rows, cols], np.nan) if hasattr(self.parent, 'selection') else Raw_Z
+        Z_data_flipped = np.flip(Z_data_box, axis=0)
+        start, stop, _ = rows.indices(len(self.parent.Raw_y))
+        y_box = self.parent.Raw_y[len(self.parent.Raw_y) - stop:len(self.parent.Raw_y) - start] # Rows of the box in the flipped data
+        # Valid box of the FFT guess in the flipped data, the data panel transforms the same view of the scan
+        box_rows, box_cols = spectrum_box(self.parent, Raw_Z.shape)
+        data_view = Raw_Z[box_rows, box_cols]
+        col_start = cols.indices(len(self.parent.Raw_x))[0]
+        valid_box = (slice(stop - box_rows.stop, stop - box_rows.start), slice(box_cols.start - col_start, box_cols.stop - col_start))
+        if min(valid_box[0].start, valid_box[1].start) < 0: # Box outside the selected data
+            valid_box, data_view = None, None
+
+        # Show the plot window, the plot window of the main window is reused for later fits
+        if getattr(self.parent, 'plot_window', None) is None:
+            self.parent.plot_window = PlotWindow(self.parent, self.parent.Raw_x[cols], y_box,
+                                        Z_data_flipped, Z_fit_flipped,
+                                        popt, perr, self.function_name, FITTINGPARAMETERS, valid_box, data_view)
+        else:
+            self.parent.plot_window.set_results(self.parent.Raw_x[cols], y_box, Z_data_flipped, Z_fit_flipped, valid_box, data_view)
+        self.plot_window = self.parent.plot_window
+        self.plot_window.show()
+
     def on_fit_error(self, error): # Handle fitting errors
         self.hide_loading_overlay()
         self.scroll_area.setEnabled(True)
@@ -698,26 +730,23 @@ def add_parameter_widgets(self):
 
 """Fit_handling.on_apply - Used when fitting functions"""
 def on_apply(self):
-        if hasattr(self, 'plot_window') and self.plot_window is not None:
-            self.plot_window.close()
-            self.plot_window = None
-
         # Disable UI during fitting
         self.scroll_area.setEnabled(False)
         self.show_loading_overlay()
 
         # Prepare parameters for worker
-        inside_image = getattr(self.parent, 'inside_image', None)
+        selection = getattr(self.parent, 'selection', None)
         params = {
             'parent': self.parent,
             'param_edits': self.param_edits,
             'FITTINGPARAMETERS': FITTINGPARAMETERS,
-            'function_name': self.function_name
+            'function_name': self.function_name,
+            'frame': selection_frame(self.parent, self.Raw_Z.shape)
         }
 
         # Setup thread and worker
         self.fit_thread = QThread()
-        self.fit_worker = FitWorker(self, inside_image, params)
+        self.fit_worker = FitWorker(self, selection, params)
         self.fit_worker.moveToThread(self.fit_thread)
         
         # Connect signals
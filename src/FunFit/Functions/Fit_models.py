@@ -0,0 +1,257 @@
+"""External modules"""
+import numpy as np
+
+"""Internal modules"""
+try:
+    from FunFit.Functions.Symmetry import spectral_structure
+except:
+    from Functions.Symmetry import spectral_structure
+
+MODELS = {} # Registered fit models by name
+FIT_PRESETS = {} # Parameters of every model, "N" marks a model with N repeated components
+FIT_EQUATIONS = {} # LaTeX equation of every model
+
+class FitModel:
+    """Fit model with its parameters, evaluator and optional Jacobian, initial guess and preview."""
+    def __init__(self, name, parameters, equation, evaluate, jacobian=None, guess=None, preview=None, prefill=None):
+        self.name = name
+        self.parameters = parameters
+        self.equation = equation
+        self.evaluate = evaluate # evaluate((x, y), *params, N=N), vectorized over broadcastable x and y
+        self.jacobian = jacobian # jacobian((x, y), *params, N=N), derivatives stacked along the last axis
+        self.guess = guess # guess(initial_guesses, parameters, N, Raw_x, Raw_y, Z_data, x_flat, y_flat, Z)
+        self.preview = preview # preview(x, y, size), gray values of the hover preview for broadcastable column x and row y arrays
+        self.prefill = prefill # prefill(structure), values of N and parameters detected from the spectrum (Symmetry.SpectralStructure)
+
+"""Add a model to the registry, making it available in the fit and bitmap generator windows"""
+def register_model(model):
+    MODELS[model.name] = model
+    FIT_PRESETS[model.name] = model.parameters
+    FIT_EQUATIONS[model.name] = model.equation
+    return model
+
+"""Stack the derivatives of a Jacobian as columns"""
+def stack_columns(columns, shape):
+    return np.stack([np.broadcast_to(column, shape) for column in columns], axis=-1)
+
+"""Evaluators and Jacobians"""
+def polynomial_model(X, *params, N=1):
+    x, y = X
+    coeffs, c = params[:N], params[-1] if len(params) > N else 0.0
+    try:
+        c = float(c.text().strip())
+    except:
+        pass
+    return c + np.sum([coeffs[i] * (x ** (i + 1)) for i in range(N)], axis=0)
+
+def polynomial_jacobian(X, *params, N=1):
+    x, y = X
+    columns = [x ** (i + 1) for i in range(N)]
+    if len(params) > N:
+        columns += [0.0] * (len(params) - N - 1) + [1.0]
+    return stack_columns(columns, np.broadcast(x, y).shape)
+
+def exponential_model(X, *params, N=None):
+    x, y = X
+    A, b, c = params
+    return A * np.exp(b * x) + c
+
+def exponential_jacobian(X, *params, N=None):
+    x, y = X
+    A, b, c = params
+    e = np.exp(b * x)
+    return stack_columns([e, A * x * e, 1.0], np.broadcast(x, y).shape)
+
+def gaussian_model(X, *params, N=None):
+    x, y = X
+    A, mu_x, mu_y, sigma_x, sigma_y, c = params
+    return A * np.exp(-((x - mu_x)**2 / (2 * sigma_x**2) + (y - mu_y)**2 / (2 * sigma_y**2))) + c
+
+def gaussian_jacobian(X, *params, N=None):
+    x, y = X
+    A, mu_x, mu_y, sigma_x, sigma_y, c = params
+    g = np.exp(-((x - mu_x)**2 / (2 * sigma_x**2) + (y - mu_y)**2 / (2 * sigma_y**2)))
+    e = A * g
+    columns = [g, e * (x - mu_x) / sigma_x**2, e * (y - mu_y) / sigma_y**2,
+               e * (x - mu_x)**2 / sigma_x**3, e * (y - mu_y)**2 / sigma_y**3, 1.0]
+    return stack_columns(columns, np.broadcast(x, y).shape)
+
+def quasicrystal_model(X, *params, N=1):
+    x, y = X
+    if len(params) < 3*N + 4:
+        theta, x0, y0, c = params[3*N] * np.pi / 180, 0.0, 0.0, params[3*N + 1]
+    else:
+        theta, x0, y0, c = params[3*N] * np.pi / 180, params[3*N + 1], params[3*N + 2], params[3*N + 3]
+    result = sum(params[i*3] * np.cos(2 * np.pi / params[i*3 + 1] * ((x - x0) * np.cos((theta + i * 180 / N) * np.pi / 180) + (y - y0) * np.sin((theta + i * 180 / N) * np.pi / 180)) + params[i*3 + 2]) for i in range(N))
+    return result + c
+
+def quasicrystal_jacobian(X, *params, N=1):
+    x, y = X
+    shifted = len(params) >= 3*N + 4
+    theta = params[3*N] * np.pi / 180
+    x0, y0 = (params[3*N + 1], params[3*N + 2]) if shifted else (0.0, 0.0)
+    columns, d_theta, d_x0, d_y0 = [], 0.0, 0.0, 0.0
+    for i in range(N):
+        A, lam, phi = params[i*3:i*3 + 3]
+        angle = (theta + i * 180 / N) * np.pi / 180 # Same angle convention as quasicrystal_model
+        k = 2 * np.pi / lam
+        u = (x - x0) * np.cos(angle) + (y - y0) * np.sin(angle)
+        arg = k * u + phi
+        s = A * np.sin(arg)
+        columns += [np.cos(arg), s * k * u / lam, -s]
+        d_theta = d_theta - s * k * (-(x - x0) * np.sin(angle) + (y - y0) * np.cos(angle)) * (np.pi / 180)**2
+        d_x0, d_y0 = d_x0 + s * k * np.cos(angle), d_y0 + s * k * np.sin(angle)
+    columns += [d_theta] + ([d_x0, d_y0] if shifted else []) + [1.0]
+    return stack_columns(columns, np.broadcast(x, y).shape)
+
+def fourier_model(X, *params, N=1):
+    x, y = X
+    theta, c = params[3*N] * np.pi / 180, params[3*N + 1]
+    result = sum(params[i*3] * np.cos(2 * np.pi / params[i*3 + 1] * (x * np.cos(theta) + y * np.sin(theta)) + params[i*3 + 2]) for i in range(N))
+    return result + c
+
+def fourier_jacobian(X, *params, N=1):
+    x, y = X
+    theta = params[3*N] * np.pi / 180
+    u = x * np.cos(theta) + y * np.sin(theta)
+    du = (-x * np.sin(theta) + y * np.cos(theta)) * np.pi / 180
+    columns, d_theta = [], 0.0
+    for i in range(N):
+        A, lam, phi = params[i*3:i*3 + 3]
+        k = 2 * np.pi / lam
+        arg = k * u + phi
+        s = A * np.sin(arg)
+        columns += [np.cos(arg), s * k * u / lam, -s]
+        d_theta = d_theta - s * k * du
+    columns += [d_theta, 1.0]
+    return stack_columns(columns, np.broadcast(x, y).shape)
+
+"""Initial guesses"""
+def gaussian_guess(initial_guesses, fitting_parameters, N, Raw_x, Raw_y, Z_data, x_flat, y_flat, Z):
+    # Find max in MASKED data
+    if len(Z) > 0:
+        max_idx = np.nanargmax(Z)
+        initial_guesses['µ_x'] = x_flat[max_idx]
+        initial_guesses['µ_y'] = y_flat[max_idx]
+    else:  # Fallback if no data
+        initial_guesses['µ_x'] = 0.0
+        initial_guesses['µ_y'] = 0.0
+    # Safeguard sigma values
+    initial_guesses['σ_x'] = max(1.0, 1e-6)
+    initial_guesses['σ_y'] = max(1.0, 1e-6)
+    return initial_guesses
+
+def fft_guess(initial_guesses, fitting_parameters, N, Raw_x, Raw_y, Z_data, x_flat, y_flat, Z):
+    # FFT-based translation detection from the spectral peaks of the largest valid box of the selection (Z_data on the axes Raw_x, Raw_y).
+    # The data panel of the results transforms the same view of the scan, so the spectrum is taken from the cache there
+    structure = spectral_structure(Z_data, Raw_x, Raw_y)
+    phase = np.angle(structure.spectrum.shifted())
+
+    # One peak per wave direction for quasicrystals, the harmonics of the strongest direction for Fourier series,
+    # then the strongest remaining peaks when more components are fitted than detected
+    peaks = structure.direction_peaks() if 'x0' in fitting_parameters else structure.component_peaks()
+    peaks = (peaks + [i for i in range(len(structure.wavelengths)) if i not in peaks])[:N]
+    peaks_info = [(structure.freq_x[i], structure.freq_y[i], phase[structure.rows[i], structure.cols[i]]) for i in peaks]
+
+    # Assign detected wavelengths to the parameters left empty, typed or prefilled wavelengths are kept
+    lambda_params = [p for p in fitting_parameters if p.startswith("λ<sub>")]
+    for i, param in enumerate(lambda_params):
+        if initial_guesses.get(param, 0) > 0:
+            continue
+        if i < len(peaks):
+            initial_guesses[param] = max(structure.wavelengths[peaks[i]], 1e-6)  # Prevent zero wavelengths
+        else:
+            initial_guesses[param] = 1e-6  # Default safe value
+
+    # Solve linear system for x0, y0 using all detected peaks
+    if len(peaks_info) > 0:
+        A = []
+        b = []
+        for fx, fy, ph in peaks_info:
+            A.append([fx, fy])
+            b.append(-ph/(2*np.pi))
+        A = np.array(A)
+        b = np.array(b)
+        try:
+            x0_initial, y0_initial = np.linalg.lstsq(A, b, rcond=None)[0]
+        except np.linalg.LinAlgError:
+            # Fallback to strongest peak if matrix is singular
+            fx, fy, ph = peaks_info[0]
+            x0_initial = -ph/(2*np.pi*fx) if fx !=0 else 0
+            y0_initial = -ph/(2*np.pi*fy) if fy !=0 else 0
+        initial_guesses.update({'x0': x0_initial + Raw_x[0], 'y0': y0_initial + Raw_y[0]}) # Phases count from the corner of the box
+    return initial_guesses
+
+"""Values filled into the parameter window from the spectral structure of the data"""
+def component_values(structure, peaks): # Amplitudes and wavelengths of the components at the given peaks
+    values = {}
+    for i, peak in enumerate(peaks, start=1):
+        values[f"A<sub>{i}</sub>"], values[f"λ<sub>{i}</sub>"] = structure.amplitudes[peak], structure.wavelengths[peak]
+    return values
+
+def fourier_prefill(structure):
+    peaks = structure.component_peaks()
+    if not peaks:
+        return {}
+    return {'N': len(peaks), 'θ': structure.angle, **component_values(structure, peaks)}
+
+def quasicrystal_prefill(structure):
+    peaks = structure.direction_peaks()
+    if not peaks or len(peaks) != structure.order:
+        return {}
+    # quasicrystal_model converts θ to radians before adding the spacing in degrees, the direction of the first wave is θ·π/180 degrees
+    return {'N': structure.order, 'θ': structure.angle * 180 / np.pi, **component_values(structure, peaks)}
+
+"""Previews shown when hovering the preset buttons"""
+def polynomial_preview(x, y, size):
+    return 0.0005*(x-size/2)**2 * 2*size + 10
+
+def exponential_preview(x, y, size):
+    return np.exp(0.06*x) + 10
+
+def fourier_preview(x, y, size):
+    N = 2
+    return (100 * np.sin(N * x / size * 2 * np.pi - np.pi/2) + 50 * np.sin(2 * N * x / size * 2 * np.pi + np.pi/2)) + 120
+
+def quasicrystal_preview(x, y, size):
+    N = 6
+    return sum(50*np.cos(2 * np.pi / 7 * ((x - size/2) * np.cos((i * 180 / N) * np.pi / 180) +
+                                          (y - size/2) * np.sin((i * 180 / N) * np.pi / 180))) + 10
+               for i in range(N))
+
+def gaussian_preview(x, y, size):
+    return (np.exp(-((x - size / 2) ** 2 + (y - size / 2) ** 2) / (2 * (size / 5) ** 2))) * 255
+
+def custom_preview(x, y, size): # Mandelbrot set
+    c = (x * 3.0 / size - 2.0) + 1j * (y * 3.0 / size - 1.5)
+    z = np.zeros_like(c)
+    escape = np.full(c.shape, 255) # Iteration at which each point escapes
+    active = np.ones(c.shape, dtype=bool)
+    for i in range(256):
+        escaped = active & (np.abs(z) > 2.0)
+        escape[escaped] = i
+        active &= ~escaped
+        if not active.any(): break
+        z[active] = z[active] * z[active] + c[active]
+    return 240 - escape * 240 // 256
+
+"""Built-in models, in the order they are shown"""
+register_model(FitModel("Polynomials", ["N", "A<sub>1</sub>", "c"],
+                        r"$Z = c + \sum_{n=1}^N A_n x^{n}$",
+                        polynomial_model, polynomial_jacobian, preview=polynomial_preview))
+register_model(FitModel("Exponential", ["A", "b", "c"],
+                        r"$Z = A e^{bx} + c$",
+                        exponential_model, exponential_jacobian, preview=exponential_preview))
+register_model(FitModel("Fourier series", ["N", "A<sub>1</sub>", "λ<sub>1</sub>", "φ<sub>1</sub>", "θ", "c"],
+                        r"$Z = \sum_{n=1}^N A_n \cos\left(\frac{2\pi}{\lambda_n}x + \phi_n\right) + c$",
+                        fourier_model, fourier_jacobian, fft_guess, fourier_preview, fourier_prefill))
+register_model(FitModel("Quasicrystal", ["N", "A<sub>1</sub>", "λ<sub>1</sub>", "φ<sub>1</sub>", "θ", "x0", "y0", "c"],
+                        r"$Z = \sum_{n=1}^N A_n \cos\left(\frac{2\pi}{\lambda_n}\left[x\cos\theta_n + y\sin\theta_n\right] + \phi_n\right) + c$",
+                        quasicrystal_model, quasicrystal_jacobian, fft_guess, quasicrystal_preview, quasicrystal_prefill))
+register_model(FitModel("Gaussian", ["A", "µ_x", "µ_y", "σ_x", "σ_y", "c"],
+                        r"$Z = A e^{-\left(\frac{(x-\mu_x)^2}{2\sigma_x^2} + \frac{(y-\mu_y)^2}{2\sigma_y^2}\right)} + c$",
+                        gaussian_model, gaussian_jacobian, gaussian_guess, gaussian_preview))
+
+# Custom functions are defined by the user in CustomFunctionWindow
+FIT_PRESETS["Custom"] = []
+FIT_EQUATIONS["Custom"] = ""
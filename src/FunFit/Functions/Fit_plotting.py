@@ -1,31 +1,63 @@
 """Built-in modules"""
 from io import BytesIO
+import copy
 
 """External modules"""
 import numpy as np
 import matplotlib
-import matplotlib.pyplot as plt
 matplotlib.use("Agg")
 import matplotlib.colors
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap, QTextDocument, QIcon
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal
+from PyQt6.QtGui import QPixmap, QImage, QTextDocument
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem,
-    QHeaderView, QStyledItemDelegate, QGridLayout, QPushButton
+    QHeaderView, QStyledItemDelegate, QGridLayout, QPushButton, QApplication, QComboBox
 )
 
 """Internal modules"""
 try:
     from FunFit.Functions import helpers, Fit_config
+    from FunFit.Functions.Selection import bounding_box, largest_box
+    from FunFit.Functions import Spectrum
+    from FunFit.Functions.Spectrum import spectrum, SPECTRUM_WINDOWS
 except:
     from Functions import helpers, Fit_config
+    from Functions.Selection import bounding_box, largest_box
+    from Functions import Spectrum
+    from Functions.Spectrum import spectrum, SPECTRUM_WINDOWS
 
 FIT_EQUATIONS = Fit_config.FIT_EQUATIONS
 LINE_CUT_FACE_COLOR = "#FFFFFF"
 PLOT_TEXT_COLOR = "#000000"
+PLOT_STYLE = {
+    'font.size': 14,
+    'figure.facecolor': LINE_CUT_FACE_COLOR,
+    'figure.edgecolor': PLOT_TEXT_COLOR,
+    'axes.facecolor': LINE_CUT_FACE_COLOR,
+    'axes.edgecolor': PLOT_TEXT_COLOR,
+    'axes.labelcolor': PLOT_TEXT_COLOR,
+    'xtick.color': PLOT_TEXT_COLOR,
+    'ytick.color': PLOT_TEXT_COLOR,
+    'text.color': PLOT_TEXT_COLOR,
+    'axes.titlesize': 16,
+    'xtick.labelsize': 14,
+    'ytick.labelsize': 14,
+}
+PANEL_SIZE = (14/3, 7/2) # Size in inches of one panel of the result figure, used for exports
+PANEL_PAD = 0.2 # Padding in font sizes around a rendered panel
+FFT_CMAP = LinearSegmentedColormap.from_list('FFT_colormap', [(0/256, 0/256, 0/256), (197/256, 114/256, 255/256), (219/256, 1, 255/256), (1, 1, 1)], N=100) # Black to purple to magenta
+PANELS = [ # Title, colormap and colorbar label of the result panels, in export order
+    ('Fit', 'Purples_r', 'Height, $Z$ (nm)'),
+    ('Data', 'Purples_r', 'Height, $Z$ (nm)'),
+    ('Residual', 'RdBu_r', 'Residual, $ΔZ$ (nm)'),
+    ('FFT of Fit', FFT_CMAP, None),
+    ('FFT of Data', FFT_CMAP, None),
+    ('FFT of Residual', FFT_CMAP, None),
+]
 
 class ResultsWindow(QMainWindow):
     """Window to display fitting results."""
@@ -136,7 +168,8 @@ class ResultsWindow(QMainWindow):
                 ha='center', va='center', fontsize=14, color='white', usetex=False)
         
         buf = BytesIO()
-        fig.savefig(buf, format='png', transparent=True, bbox_inches='tight')
+        with helpers.RENDER_LOCK: # Result panels may be rendering in the background
+            fig.savefig(buf, format='png', transparent=True, bbox_inches='tight')
         pixmap = QPixmap()
         pixmap.loadFromData(buf.getvalue())
         return pixmap
@@ -152,28 +185,160 @@ class HTMLDelegate(QStyledItemDelegate):
         document.drawContents(painter)
         painter.restore()
 
+class FitResults:
+    """Processed data of the six result panels, independent of any window."""
+    def __init__(self, x, y, Z_data, Z_fit, flipped=True, valid_box=None, window=None, data_view=None):
+        self.x, self.y, self.Z_data, self.Z_fit = x, y, Z_data, Z_fit
+        self.Z_residual = Z_data - Z_fit
+        self.flipped = flipped # Rows are stored bottom-up, as plotted with origin='lower'
+        self.valid_box = valid_box # Box known to be valid from the selection geometry, as (row, column) slices
+        self.data_view = data_view # Data of the valid box as a view of the scan, the FFT guess transformed the same view
+        self.window = window or Spectrum.SPECTRUM_WINDOW # Window applied before the FFTs
+        self.data_processing()
+
+    def data_processing(self): # Process the data for plotting
+        mask = ~np.isnan(self.Z_data)
+        rows, cols = bounding_box(mask) # Crop with views instead of copies
+        self.x_masked = self.x[cols]
+        self.y_masked = self.y[rows]
+        self.Z_data_masked = self.Z_data[rows, cols]
+        self.Z_fit_cropped = self.Z_fit[rows, cols]
+        self.Z_fit_masked = np.ma.masked_where(np.isnan(self.Z_fit_cropped), self.Z_fit_cropped)
+        self.Z_data_masked = np.ma.masked_where(np.isnan(self.Z_data_masked), self.Z_data_masked)
+        self.Z_residual_masked = self.Z_residual[rows, cols]
+        self.max_abs = max(abs(np.nanmax(self.Z_residual_masked)), abs(np.nanmin(self.Z_residual_masked)))
+        self.rmse = np.sqrt(np.nanmean(self.Z_residual_masked**2))
+
+        # Save data for export
+        self.Z_fit_export = np.nan_to_num(self.Z_fit_masked, nan=np.nan)
+        self.Z_data_export = np.nan_to_num(self.Z_data_masked, nan=np.nan)
+        self.Z_residual_export = np.nan_to_num(self.Z_residual_masked, nan=np.nan)
+
+    def data_processing_FFT(self): # Process the data for FFT plotting, only done when an FFT panel is needed
+        # Crop data to the largest valid box for FFT, shared by arrays with the same NaN mask
+        Z_fit_cropped = self.crop_to_valid_box(self.Z_fit)
+        Z_data_cropped = self.crop_to_valid_box(self.Z_data)
+        Z_residual_cropped = self.crop_to_valid_box(self.Z_residual)
+
+        # Spectra of the cropped data with the DC component removed, each computed once and cached.
+        # Flipped data is transformed in scan orientation, so the data spectrum is shared with the FFT guess.
+        if self.data_view is not None and self.data_view.shape == Z_data_cropped.shape: # Same values, cached as the scan view
+            Z_data_cropped = np.flipud(self.data_view) if self.flipped else self.data_view
+        spectra = [spectrum(np.flipud(Z) if self.flipped else Z, self.window) for Z in (Z_fit_cropped, Z_data_cropped, Z_residual_cropped)]
+
+        # Assign normalized FFT magnitudes to instance attributes for export use
+        self.fft_fit_norm, self.fft_data_norm, self.fft_residual_norm = [s.magnitude(self.flipped) for s in spectra]
+        self.fft_cmap = FFT_CMAP
+
+        # Calculate frequency axes (1/µm) of every spectrum
+        self.fft_frequencies = [s.frequencies(self.x[1] - self.x[0], self.y[1] - self.y[0]) for s in spectra]
+        self.smallestaxis = min(min(freq_x[-1], freq_y[-1]) for freq_x, freq_y in self.fft_frequencies)
+
+    def with_window(self, window): # Copy sharing the processed data, with the FFTs of another window computed when needed
+        results = copy.copy(self)
+        results.window = window
+        for attribute in ('fft_fit_norm', 'fft_data_norm', 'fft_residual_norm', 'fft_frequencies', 'smallestaxis'):
+            results.__dict__.pop(attribute, None)
+        return results
+
+    def crop_to_valid_box(self, data): # Crop the data to the largest box without NaN values for FFT
+        mask = ~np.isnan(data)
+        if not np.any(mask):
+            return data
+        rows, cols = largest_box(mask, self.valid_box)
+        return data[rows, cols]
+
+    def panel(self, index): # Image, extent, color limits and axis limits of a panel
+        if index < 3:
+            data = (self.Z_fit_masked, self.Z_data_masked, np.ma.masked_where(np.isnan(self.Z_residual_masked), self.Z_residual_masked))[index]
+            extent = [self.x_masked[0], self.x_masked[-1], self.y_masked[0], self.y_masked[-1]]
+            vmin, vmax = (-self.max_abs, self.max_abs) if index == 2 else (np.nanmin(data), np.nanmax(data))
+            return data, extent, (vmin, vmax), (extent[:2], extent[2:])
+        if not hasattr(self, 'fft_fit_norm'):
+            self.data_processing_FFT()
+        data = (self.fft_fit_norm, self.fft_data_norm, self.fft_residual_norm)[index - 3]
+        freq_x, freq_y = self.fft_frequencies[index - 3]
+        extent = [freq_x[0], freq_x[-1], freq_y[0], freq_y[-1]]
+        limits = (-self.smallestaxis, self.smallestaxis)
+        return data, extent, (np.nanmin(data), np.nanmax(data)), (limits, limits)
+
+    def title(self, index): # Title of a panel
+        if index == 2:
+            return f'Residual [RMSE: {self.rmse:.4f} nm]'
+        return PANELS[index][0]
+
+    def save_panel(self, index, file_path): # Render a single panel offscreen and save it
+        with matplotlib.rc_context(PLOT_STYLE):
+            figure = Figure(figsize=PANEL_SIZE)
+            ax = figure.add_subplot(111)
+            update_panel(ax, create_panel(figure, ax, index), self, index)
+            with helpers.RENDER_LOCK:
+                figure.savefig(file_path, bbox_inches='tight', pad_inches=0.05)
+
+"""Create the axes content of a result panel, returns its image artist"""
+def create_panel(figure, ax, index):
+    _, cmap, label = PANELS[index]
+    image = ax.imshow(np.zeros((2, 2)), origin='lower' if index < 3 else 'upper', cmap=cmap, vmin=0, vmax=1, aspect='auto')
+    colorbar = figure.colorbar(image, ax=ax, fraction=0.05, pad=0.05)
+    if label:
+        colorbar.set_label(label, labelpad=14, rotation=270, fontsize=12)
+    axis_label = 'x (µm)' if index < 3 else 'Frequency (1/µm)'
+    ax.set_xlabel(axis_label, fontsize=12)
+    ax.set_ylabel(axis_label.replace('x', 'y') if index < 3 else axis_label, fontsize=12)
+    ax.set_box_aspect(1)
+    return image
+
+"""Show the results in an existing panel, the artists are updated in place"""
+def update_panel(ax, image, results, index):
+    data, extent, clim, (xlim, ylim) = results.panel(index)
+    image.set_data(data)
+    image.set_extent(extent)
+    image.set_clim(*clim)
+    ax.set_xlim(*xlim)
+    ax.set_ylim(*ylim)
+    ax.set_title(results.title(index))
+
+"""Render a figure with the Agg backend into an image, safe to call outside the GUI thread"""
+def render_figure(figure, pixel_ratio=1.0):
+    figure.canvas.draw()
+    width, height = figure.canvas.get_width_height(physical=True)
+    image = QImage(bytes(figure.canvas.buffer_rgba()), width, height, QImage.Format.Format_RGBA8888).copy()
+    image.setDevicePixelRatio(pixel_ratio)
+    return image
+
+class PanelWorker(QObject):
+    """Worker class for rendering the result panels offscreen."""
+    panel = pyqtSignal(int, object) # Panel index and rendered QImage
+    finished = pyqtSignal()
+    error = pyqtSignal(Exception)
+
+    def __init__(self, results, figures, pixel_ratio):
+        super().__init__()
+        self.results, self.figures, self.pixel_ratio = results, figures, pixel_ratio
+
+    def run(self): # Render the data panels first, the FFTs are computed on the way to the FFT panels
+        try:
+            for index, figure in enumerate(self.figures):
+                ax = figure.axes[0]
+                update_panel(ax, ax.images[0], self.results, index)
+                with helpers.RENDER_LOCK: # Held per panel, the GUI thread only waits for one panel at most
+                    figure.tight_layout(pad=PANEL_PAD)
+                    image = render_figure(figure, self.pixel_ratio)
+                self.panel.emit(index, image)
+        except Exception as e:
+            self.error.emit(e)
+        finally:
+            self.finished.emit()
+
 class PlotWindow(QMainWindow):
-    """Window to display the fitted results as plots."""
-    def __init__(self, parent, x, y, Z_data, Z_fit, popt, perr, func_name, param_names):
+    """Window to display the fitted results as plots. The panels are kept and rendered in the background for new results."""
+    def __init__(self, parent, x, y, Z_data, Z_fit, popt, perr, func_name, param_names, valid_box=None, data_view=None):
         super().__init__(parent)
         self.parent = parent
-        self.x, self.y, self.Z_data, self.Z_fit = x, y, Z_data, Z_fit
-        self.Z_residual = Z_data - Z_fit
-        plt.rcParams.update({
-                    'font.size': 14,
-                    'figure.facecolor': LINE_CUT_FACE_COLOR,
-                    'figure.edgecolor': PLOT_TEXT_COLOR,
-                    'axes.facecolor': LINE_CUT_FACE_COLOR,
-                    'axes.edgecolor': PLOT_TEXT_COLOR,
-                    'axes.labelcolor': PLOT_TEXT_COLOR,
-                    'xtick.color': PLOT_TEXT_COLOR,
-                    'ytick.color': PLOT_TEXT_COLOR,
-                    'text.color': PLOT_TEXT_COLOR,
-                    'axes.titlesize': 16,
-                    'xtick.labelsize': 14,
-                    'ytick.labelsize': 14,
-                    })
+        self.render_thread, self.pending_results = None, None
+        matplotlib.rcParams.update(PLOT_STYLE)
         self.init_ui()
+        self.set_results(x, y, Z_data, Z_fit, valid_box, data_view)
 
     def init_ui(self): # Set up the PlotWindow UI
         # Set window properties
@@ -191,205 +356,110 @@ class PlotWindow(QMainWindow):
         title_bar = helpers.create_title_bar(self, "Fit Preview", "child")
         main_layout.addWidget(title_bar, 0, 0, 1, -1, Qt.AlignmentFlag.AlignTop)
 
-        # Create figure and canvas
-        figure_container = QWidget()
-        figure_layout = QVBoxLayout(figure_container)
-        figure_layout.setContentsMargins(0, 0, 0, 0)
-        figure_layout.setSpacing(0)
-        
-        self.figure = Figure(figsize=(14, 7))
-        self.canvas = FigureCanvasQTAgg(self.figure)
-        figure_layout.addWidget(self.canvas)
-        main_layout.addWidget(figure_container, 1, 0)
+        # Create the panel grid, each panel shows an image rendered offscreen
+        panel_container = QWidget()
+        panel_container.setStyleSheet(f"background-color: {LINE_CUT_FACE_COLOR};")
+        panel_layout = QGridLayout(panel_container)
+        panel_layout.setContentsMargins(0, 0, 0, 0)
+        panel_layout.setSpacing(0)
+        self.panel_width, self.panel_height = self.width() // 3, (self.height() - title_bar.height()) // 2
+        self.panel_labels = []
+        for index in range(6):
+            label = QLabel()
+            label.setFixedSize(self.panel_width, self.panel_height)
+            panel_layout.addWidget(label, index // 3, index % 3)
+            self.panel_labels.append(label)
+        main_layout.addWidget(panel_container, 1, 0)
         main_layout.setRowStretch(1, 1)
         
-        self.plot_results()
-
-    def plot_results(self): # Plot the fitting results
-        matplotlib.rcParams.update({
-                            'font.size': 14,
-                            'figure.facecolor': 'white',
-                            'figure.edgecolor': 'black',
-                            'axes.facecolor': 'white',
-                            'axes.edgecolor': 'black',
-                            'axes.labelcolor': 'black',
-                            'xtick.color': 'black',
-                            'ytick.color': 'black',
-                            'text.color': 'black',
-                            'axes.titlesize': 16,
-                            'xtick.labelsize': 14,
-                            'ytick.labelsize': 14,
-                            })
-
-        # Create subplots
-        self.ax1 = self.figure.add_subplot(231)
-        self.ax2 = self.figure.add_subplot(232)
-        self.ax3 = self.figure.add_subplot(233)
-        self.ax4 = self.figure.add_subplot(234)
-        self.ax5 = self.figure.add_subplot(235)
-        self.ax6 = self.figure.add_subplot(236)
-        for ax in [self.ax1, self.ax2, self.ax3, self.ax4, self.ax5, self.ax6]:
-            ax.set_box_aspect(1)
-
-        self.data_processing()
-
-        self.plot_fit()
-        self.plot_data()
-        self.plot_residual()
-        
-        self.data_processing_FFT()
-        
-        self.plot_fit_FFT()
-        self.plot_data_FFT()
-        self.plot_residual_FFT()
-
-        for ax in [self.ax1, self.ax2, self.ax3]:
-            ax.set_xlabel('x (µm)', fontsize=12)
-            ax.set_ylabel('y (µm)', fontsize=12)
-
-        # B O X   A S P E C T   R A T I O
-        for ax in [self.ax4, self.ax5, self.ax6]:
-            ax.set_xlabel('Frequency (1/µm)', fontsize=12)
-            ax.set_ylabel('Frequency (1/µm)', fontsize=12)
-            ax.set_xlim(-self.smallestaxis, self.smallestaxis)
-            ax.set_ylim(-self.smallestaxis, self.smallestaxis)
-            ax.set_box_aspect(1)
+        self.create_panels()
+
+    def create_panels(self): # Create the six panel figures once, new results only update their artists
+        self.pixel_ratio = self.devicePixelRatioF()
+        dpi = 100 * self.pixel_ratio
+        self.figures, self.axes = [], []
+        for index in range(6):
+            figure = Figure(figsize=(self.panel_width / 100, self.panel_height / 100), dpi=dpi)
+            FigureCanvasAgg(figure)
+            ax = figure.add_subplot(111)
+            create_panel(figure, ax, index)
+            self.figures.append(figure)
+            self.axes.append(ax)
+        self.ax1, self.ax2, self.ax3, self.ax4, self.ax5, self.ax6 = self.axes
 
         try:
             self.add_export_buttons()
-            # Update button positions when the canvas is drawn
-            self.canvas.mpl_connect('draw_event', self.update_button_positions)
         except: pass
-
-        self.figure.tight_layout(pad=0.0)
-        self.canvas.draw()
-
-    def data_processing(self): # Process the data for plotting
-        self.mask1 = ~np.isnan(self.Z_data)
-        self.x_masked = self.x[self.mask1.any(axis=0)]
-        self.y_masked = self.y[self.mask1.any(axis=1)]
-        self.Z_data_masked = self.Z_data[np.ix_(self.mask1.any(axis=1), self.mask1.any(axis=0))]
-        self.Z_fit_cropped = self.Z_fit[np.ix_(self.mask1.any(axis=1), self.mask1.any(axis=0))]
-        self.Z_fit_masked = np.ma.masked_where(np.isnan(self.Z_fit_cropped), self.Z_fit_cropped)
-        self.Z_data_masked = np.ma.masked_where(np.isnan(self.Z_data_masked), self.Z_data_masked)
-        self.Z_residual_masked = self.Z_residual[np.ix_(self.mask1.any(axis=1), self.mask1.any(axis=0))]
-
-        # Save data for export
-        self.Z_fit_export = np.nan_to_num(self.Z_fit_masked, nan=np.nan)
-        self.Z_data_export = np.nan_to_num(self.Z_data_masked, nan=np.nan)
-        self.Z_residual_export = np.nan_to_num(self.Z_residual_masked, nan=np.nan)
-
-    def data_processing_FFT(self): # Process the data for FFT plotting
-        # Crop data to mask for FFT (has to be square). Elaborate for angled polygons, fast for rectangles.
-        self.Z_fit_cropped = self.crop_to_valid_box(self.Z_fit)
-        self.Z_data_cropped = self.crop_to_valid_box(self.Z_data)
-        self.Z_residual_cropped = self.crop_to_valid_box(self.Z_residual)
-
-        # Calculate FFT of cropped data, remove DC component, and normalize
-        fft_fit_norm = np.abs(np.fft.fftshift(np.fft.fft2(self.Z_fit_cropped - np.mean(self.Z_fit_cropped)))) / np.max(np.abs(np.fft.fftshift(np.fft.fft2(self.Z_fit_cropped - np.mean(self.Z_fit_cropped)))))
-        fft_data_norm = np.abs(np.fft.fftshift(np.fft.fft2(self.Z_data_cropped - np.mean(self.Z_data_cropped)))) / np.max(np.abs(np.fft.fftshift(np.fft.fft2(self.Z_data_cropped - np.mean(self.Z_data_cropped)))))
-        fft_residual_norm = np.abs(np.fft.fftshift(np.fft.fft2(self.Z_residual_cropped - np.mean(self.Z_residual_cropped)))) / np.max(np.abs(np.fft.fftshift(np.fft.fft2(self.Z_residual_cropped - np.mean(self.Z_residual_cropped)))))
-        
-        # Assign FFT arrays to instance attributes for export use
-        self.fft_fit_norm = fft_fit_norm
-        self.fft_data_norm = fft_data_norm
-        self.fft_residual_norm = fft_residual_norm
-        
-        # Define a custom colormap with multiple colors
-        colors = [(0/256, 0/256, 0/256), (197/256, 114/256, 255/256), (219/256, 1, 255/256), (1, 1, 1)]  # Black to purple to magenta
-        n_bins = 100
-        cmap_name = 'FFT_colormap'
-        self.fft_cmap = LinearSegmentedColormap.from_list(cmap_name, colors, N=n_bins)
-
-        # Calculate frequency axes (1/µm)
-        self.freq_x = 2*np.pi*np.fft.fftshift(np.fft.fftfreq(self.Z_data.shape[1], d=(self.x[1] - self.x[0])))
-        self.freq_y = 2*np.pi*np.fft.fftshift(np.fft.fftfreq(self.Z_data.shape[0], d=(self.y[1] - self.y[0])))
-        self.smallestaxis = min(self.freq_x[-1], self.freq_y[-1])
-
-    def plot_fit(self): # Plot the fit and its FFT
-        Z_fit_masked = np.ma.masked_where(np.isnan(self.Z_fit_cropped), self.Z_fit_cropped)
-        c1 = self.ax1.imshow(Z_fit_masked, extent=[self.x_masked[0], self.x_masked[-1], self.y_masked[0], self.y_masked[-1]],
-                origin='lower', cmap='Purples_r', aspect='auto')
-        self.cbar1 = self.figure.colorbar(c1, ax=self.ax1, fraction=0.05, pad=0.05)
-        self.cbar1.set_label('Height, $Z$ (nm)', labelpad=14, rotation=270, fontsize=12)
-        self.ax1.set_title('Fit')
-
-    def plot_fit_FFT(self):
-        c4 = self.ax4.imshow(self.fft_fit_norm, cmap=self.fft_cmap, extent=[self.freq_x[0], self.freq_x[-1], self.freq_y[0], self.freq_y[-1]], aspect='auto')
-        self.cbar4 = self.figure.colorbar(c4, ax=self.ax4, fraction=0.05, pad=0.05)
-        self.ax4.set_title('FFT of Fit')
-
-    def plot_data(self): # Plot the data and its FFT
-        Z_data_masked = np.ma.masked_where(np.isnan(self.Z_data_masked), self.Z_data_masked)
-        c2 = self.ax2.imshow(Z_data_masked, extent=[self.x_masked[0], self.x_masked[-1], self.y_masked[0], self.y_masked[-1]],
-            origin='lower', cmap='Purples_r', aspect='auto')
-        self.cbar2 = self.figure.colorbar(c2, ax=self.ax2, fraction=0.05, pad=0.05)
-        self.cbar2.set_label('Height, $Z$ (nm)', labelpad=14, rotation=270, fontsize=12)
-        self.ax2.set_title('Data')
-
-    def plot_data_FFT(self):
-        c5 = self.ax5.imshow(self.fft_data_norm, cmap=self.fft_cmap, extent=[self.freq_x[0], self.freq_x[-1], self.freq_y[0], self.freq_y[-1]], aspect='auto')
-        self.cbar5 = self.figure.colorbar(c5, ax=self.ax5, fraction=0.05, pad=0.05)
-        self.ax5.set_title('FFT of Data')
-
-    def plot_residual(self): # Plot the residual data from the fit and its FFT
-        Z_residual_masked = self.Z_residual[np.ix_(self.mask1.any(axis=1), self.mask1.any(axis=0))]
-        Z_residual_masked = np.ma.masked_where(np.isnan(Z_residual_masked), Z_residual_masked)
-        max_abs = max(abs(np.nanmax(Z_residual_masked)), abs(np.nanmin(Z_residual_masked)))
-        c3 = self.ax3.imshow(Z_residual_masked, extent=[self.x_masked[0], self.x_masked[-1], self.y_masked[0], self.y_masked[-1]],
-            origin='lower', cmap='RdBu_r', vmin=-max_abs, vmax=max_abs, aspect='auto')
-        self.cbar3 = self.figure.colorbar(c3, ax=self.ax3, fraction=0.05, pad=0.05)
-        self.cbar3.set_label('Residual, $ΔZ$ (nm)', labelpad=14, rotation=270, fontsize=12)
-        rmse = np.sqrt(np.nanmean(Z_residual_masked**2))
-        self.rmse = rmse
-        self.ax3.set_title(f'Residual [RMSE: {rmse:.4f} nm]')
-
-    def plot_residual_FFT(self):
-        c6 = self.ax6.imshow(self.fft_residual_norm, cmap=self.fft_cmap, extent=[self.freq_x[0], self.freq_x[-1], self.freq_y[0], self.freq_y[-1]], aspect='auto')
-        self.cbar6 = self.figure.colorbar(c6, ax=self.ax6, fraction=0.05, pad=0.05)
-        self.ax6.set_title('FFT of Residual')
+        self.add_window_selector()
+
+    def set_results(self, x, y, Z_data, Z_fit, valid_box=None, data_view=None): # Show new fitting results, the panels follow as they are rendered
+        self.results = FitResults(x, y, Z_data, Z_fit, valid_box=valid_box, data_view=data_view)
+        self.rmse = self.results.rmse
+        # Only the latest results are kept while panels are being rendered
+        self.pending_results = self.results
+        if self.render_thread is None:
+            self.start_render()
+
+    def start_render(self): # Render the pending results in a worker thread
+        results, self.pending_results = self.pending_results, None
+
+        # The thread belongs to the application so a closed window does not destroy it while running
+        self.render_thread = QThread(QApplication.instance())
+        self.render_worker = PanelWorker(results, self.figures, self.pixel_ratio)
+        self.render_thread.worker = self.render_worker
+        self.render_worker.moveToThread(self.render_thread)
+        self.render_thread.started.connect(self.render_worker.run)
+        self.render_worker.panel.connect(self.on_panel_ready)
+        self.render_worker.error.connect(self.on_render_error)
+        self.render_worker.finished.connect(self.render_thread.quit)
+        self.render_thread.finished.connect(self.on_render_thread_finished)
+        self.render_thread.finished.connect(self.render_thread.deleteLater)
+        QApplication.instance().aboutToQuit.connect(self.render_thread.wait)
+        self.render_thread.start()
+
+    def on_render_thread_finished(self): # Continue with results that arrived during rendering
+        self.render_thread.wait()
+        self.render_thread, self.render_worker = None, None
+        if self.pending_results is not None:
+            self.start_render()
+
+    def on_render_error(self, error): # Show an error raised while rendering the panels
+        helpers.error_message(f"Plotting error: {str(error)}")
+
+    def on_panel_ready(self, index, image): # Show a rendered panel
+        self.panel_labels[index].setPixmap(QPixmap.fromImage(image))
+        self.update_button_position(index)
 
     def add_export_buttons(self): # Plot the FFT of the fit, data, and residual
         # Export buttons
         self.export_buttons = []
         for i in range(6):
-            btn = QPushButton(self.canvas)
+            btn = QPushButton(self.panel_labels[i])
             btn.setFixedSize(30, 30)
-            btn.setIcon(QIcon(self.parent.parent.current_dir + "/GUI/icon_export.png"))
+            btn.setIcon(helpers.gui_icon("icon_export.png"))
             btn.setObjectName("export_button")
-            btn.clicked.connect(lambda _, idx=i: helpers.export_plot(self, idx))
+            btn.clicked.connect(lambda _, idx=i: helpers.export_plot(self.results, idx))
             self.export_buttons.append(btn)
             btn.hide()
-        
-    def crop_to_valid_box(self, data): # Crop the data to a valid box for FFT
-        self.mask1 = ~np.isnan(data)
-        if not np.any(self.mask1):
-            return data
-        rows, cols = self.mask1.shape
-        max_area, max_coords = 0, (0, 0, 0, 0)
-        heights = np.zeros(cols, dtype=int)
-        for i in range(rows):
-            heights = np.where(self.mask1[i], heights + 1, 0)
-            stack = []
-            for j in range(cols + 1):
-                current_h = heights[j] if j < cols else 0
-                while stack and heights[stack[-1]] > current_h:
-                    h = heights[stack.pop()]
-                    w = j if not stack else j - stack[-1] - 1
-                    area = h * w
-                    if area > max_area:
-                        left_idx = stack[-1] + 1 if stack else 0
-                        max_area, max_coords = area, (i - h + 1, left_idx, i, j - 1)
-                stack.append(j)
-            top, left, bottom, right = max_coords
-        return data[max(0, top):min(rows, bottom + 1), max(0, left):min(cols, right + 1)] if max_area else data
-
-    def update_button_positions(self, event=None): # Update the position of the export buttons
-        for i, ax in enumerate([self.ax1, self.ax2, self.ax3, self.ax4, self.ax5, self.ax6]):
-            pos = ax.get_position()
-            canvas_width = self.canvas.width()
-            canvas_height = self.canvas.height()
-            btn_x = int(pos.x1 * canvas_width) - 35  # 60px width + 5px padding
-            btn_y = int((1 - pos.y1) * canvas_height) + 5
-            self.export_buttons[i].move(btn_x, btn_y)
-            self.export_buttons[i].show()
\ No newline at end of file
+
+    def add_window_selector(self): # Window of the spectra, selected in the corner of the first FFT panel
+        self.window_selector = QComboBox(self.panel_labels[3])
+        self.window_selector.addItems(SPECTRUM_WINDOWS)
+        self.window_selector.setCurrentText(Spectrum.SPECTRUM_WINDOW)
+        self.window_selector.setToolTip("Window applied before the FFT, used for the plots and the FFT guesses of later fits")
+        self.window_selector.move(5, 5)
+        self.window_selector.currentTextChanged.connect(self.set_window)
+
+    def set_window(self, window): # Show the FFTs with another window, later fits use it for their guesses
+        Spectrum.SPECTRUM_WINDOW = window
+        self.results = self.results.with_window(window)
+        self.pending_results = self.results
+        if self.render_thread is None:
+            self.start_render()
+
+    def update_button_position(self, index): # Place the export button in the top right corner of the panel axes
+        pos = self.axes[index].get_position()
+        btn_x = int(pos.x1 * self.panel_width) - 35
+        btn_y = int((1 - pos.y1) * self.panel_height) + 5
+        self.export_buttons[index].move(btn_x, btn_y)
+        self.export_buttons[index].show()
@@ -5,41 +5,40 @@ from PyQt6.QtGui import QPixmap, QCursor
 
 """Internal modules"""
 try:
-    from FunFit.Functions import Fit_handling, helpers
+    from FunFit.Functions import Fit_handling, Fit_models, Regions, helpers
 except:
-    from Functions import Fit_handling, helpers
+    from Functions import Fit_handling, Fit_models, Regions, helpers
 
-BUTTONS = [
-    ("Polynomials", Fit_handling.Polynomials, "polynomial"),
-    ("Exponential", Fit_handling.Exponential, "exponential"),
-    ("Fourier series", Fit_handling.FourierSeries, "fourierseries"),
-    ("Quasicrystal", Fit_handling.Quasicrystal, "quasicrystal"),
-    ("Gaussian", Fit_handling.Gaussian, "gaussian"),
-    ("Custom function", Fit_handling.Custom, "custom")
-]
+"""Buttons of the registered models as (name, handler, preview)"""
+def fit_buttons():
+    buttons = [(name, Fit_handling.select_model(name), model.preview) for name, model in Fit_models.MODELS.items()]
+    return buttons + [("Custom function", Fit_handling.Custom, Fit_models.custom_preview)]
 
 class HoverButton(QPushButton):
     """Button that displays a bitmap when hovered."""
     hovered = pyqtSignal(QPoint, QPixmap)
     unhovered = pyqtSignal()
-    def __init__(self, text, equation_type): # Set up the button
+    def __init__(self, text, preview): # Set up the button
         super().__init__(text)
-        self.bitmap_pixmap = helpers.generate_bitmap_from_equation(equation_type) if equation_type not in ["auto"] else None
+        self.preview = preview
         self.setMouseTracking(True)
 
+    def bitmap_pixmap(self): # Bitmap of the preview, generated on the first hover and cached afterwards
+        return helpers.generate_bitmap_from_equation(self.preview) if self.preview is not None else None
+
     def enterEvent(self, event): # Show the bitmap when the mouse enters the button
-        if self.bitmap_pixmap:
-            self.hovered.emit(event.globalPosition().toPoint(), self.bitmap_pixmap)
+        if self.preview is not None:
+            self.hovered.emit(event.globalPosition().toPoint(), self.bitmap_pixmap())
         super().enterEvent(event)
 
     def leaveEvent(self, event): # Hide the bitmap when the mouse leaves the button
-        if self.bitmap_pixmap:
+        if self.preview is not None:
             self.unhovered.emit()
         super().leaveEvent(event)
 
     def mouseMoveEvent(self, event): # Update the bitmap position when the mouse moves
-        if self.bitmap_pixmap:
-            self.hovered.emit(event.globalPosition().toPoint(), self.bitmap_pixmap)
+        if self.preview is not None:
+            self.hovered.emit(event.globalPosition().toPoint(), self.bitmap_pixmap())
         super().mouseMoveEvent(event)
 
 class ToolTipWindow(QLabel):
@@ -85,8 +84,8 @@ class FunctionSelectionWindow(QMainWindow):
         layout.addWidget(title_bar, 0, 0, 1, -1, Qt.AlignmentFlag.AlignTop)
 
         # Add buttons to the window with tooltips
-        for i, (name, function, equation_type) in enumerate(BUTTONS):
-            button = HoverButton(name, equation_type)
+        for i, (name, function, preview) in enumerate(fit_buttons()):
+            button = HoverButton(name, preview)
             button.setObjectName("main_button")
             button.clicked.connect(self.create_button_handler(function))
             button.setCursor(Qt.CursorShape.PointingHandCursor)
@@ -110,7 +109,8 @@ class FunctionSelectionWindow(QMainWindow):
 """Function called from main window."""
 def init_interface(self=None):
     try:
-        Fit_handling.ParameterSelectionWindow.on_apply = Fit_handling.on_apply
+        regions = getattr(self, 'regions', None) # Every region of a selection of several regions is fitted on its own
+        Fit_handling.ParameterSelectionWindow.on_apply = Regions.on_apply if regions is not None and regions.count > 1 else Fit_handling.on_apply
         Fit_handling.ParameterSelectionWindow.add_parameter_widgets = Fit_handling.add_parameter_widgets
         FunctionSelectionWindow.create_button_handler = create_button_handler
         self.w = FunctionSelectionWindow(self)
@@ -4,16 +4,34 @@ import os
 """External modules"""
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QFileDialog, QApplication
-from PyQt6.QtGui import QIcon
 
 """Internal modules"""
 try:
-    from FunFit.Functions.helpers import display_data, error_message, add_export_button
+    from FunFit.Functions.helpers import error_message, add_export_button, gui_icon
+    from FunFit.Functions.Scan_view import display_scan
     import FunFit.Functions.Load_dataformats as read
 except:
-    from Functions.helpers import display_data, error_message, add_export_button
+    from Functions.helpers import error_message, add_export_button, gui_icon
+    from Functions.Scan_view import display_scan
     import Functions.Load_dataformats as read
 
+"""Read a data file without touching any window"""
+def read_file(FileName): # Returns (x, y, Z, x_scale, y_scale), raises ValueError for unknown file types
+    with open(FileName, 'r', errors="ignore") as file:
+        first_lines = [file.readline().strip() for _ in range(20)]  # Read the first 20 lines and remove newline characters
+
+    # Checks for both SxM Image file and NanoFrazor in the first lines of the file (for nanofrazor .top files)
+    if any('SxM Image file' in line for line in first_lines) and any('NanoFrazor' in line for line in first_lines) and any('Version: 1.0' in line for line in first_lines):
+        return read.nanofrazorTOP(FileName)
+    # Checks for the version of the file (for NanoScope .spm files)
+    elif '\\Version: 0x09400202' in first_lines:
+        return read.nanoscopeSPM(FileName)
+    elif 'ISO/TC 201 SPM data transfer format' in first_lines:
+        return read.gwyddionSPM(FileName)
+    elif '# Channel: ZSensor' in first_lines:
+        return read.funfitTXT(FileName)
+    raise ValueError("Unknown file type")
+
 def load_data(self=None, file_path=None):
     # Open a file dialog to select the file to plot
     if not file_path:
@@ -22,55 +40,34 @@ def load_data(self=None, file_path=None):
         Dialog_window.setFileMode(QFileDialog.FileMode.ExistingFile)
         Dialog_window.setNameFilter("All Files (*);;NanoFrazor Files (*.top);;NanoScope Files (*.spm)")
         Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
-        Dialog_window.setWindowIcon(QIcon(os.path.join(self.current_dir, "GUI", "icon_window.png")))
+        Dialog_window.setWindowIcon(gui_icon("icon_window.png"))
         Dialog_window.setDirectory(os.path.dirname(self.current_dir) + "/tests")
         if Dialog_window.exec() == QFileDialog.DialogCode.Accepted:
             FileName = Dialog_window.selectedFiles()[0]
     else: 
         FileName = file_path
     try:
-        with open(FileName, 'r') as file:
-            first_lines = [file.readline().strip() for _ in range(20)]  # Read the first 20 lines and remove newline characters
+        Raw_x, Raw_y, Raw_Z, x_scale, y_scale = read_file(FileName)
+    except ValueError as e:
+        error_message(str(e))
+        return
     except: return
     
     # Delete all attributes related to the previous data
-    for attr in ['Raw_x', 'Raw_y', 'Raw_Z', 'corrected_data', 'inside_image', 'outside_image', 'selection_polygon', 'overlay', 'image']:
+    for attr in ['Raw_x', 'Raw_y', 'Raw_Z', 'corrected_data', 'selection', 'regions', 'inscribed_box', 'rotated_frame', 'selection_polygon', 'overlay', 'image']:
         if hasattr(self, attr):
             try: getattr(self, attr).deleteLater() if attr in ['overlay', 'image'] else delattr(self, attr)
             except: pass
-
-    # Checks for both SxM Image file and NanoFrazor in the first lines of the file (for nanofrazor .top files)
-    if any('SxM Image file' in line for line in first_lines) and any('NanoFrazor' in line for line in first_lines) and any('Version: 1.0' in line for line in first_lines):
-        FileType = 'NanoFrazor.top'
-    # Checks for the version of the file (for NanoScope .spm files)
-    elif '\\Version: 0x09400202' in first_lines:
-        FileType = 'NanoScope.spm'
-    elif 'ISO/TC 201 SPM data transfer format' in first_lines:
-        FileType = 'Gwyddion.spm'
-    elif '# Channel: ZSensor' in first_lines:
-        FileType = 'FunFit.txt'
-    else:
-        error_message("Unknown file type")
-        return
-    # check if the file is a .top file or a .spm file
-    if FileType == 'NanoFrazor.top':
-        self.Raw_x, self.Raw_y, self.Raw_Z, self.x_scale, self.y_scale = read.nanofrazorTOP(FileName)
-    elif FileType == 'NanoScope.spm':
-        self.Raw_x, self.Raw_y, self.Raw_Z, self.x_scale, self.y_scale = read.nanoscopeSPM(FileName)
-    elif FileType == 'Gwyddion.spm':
-        self.Raw_x, self.Raw_y, self.Raw_Z, self.x_scale, self.y_scale = read.gwyddionSPM(FileName)
-    elif FileType == 'FunFit.txt':
-        self.Raw_x, self.Raw_y, self.Raw_Z, self.x_scale, self.y_scale = read.funfitTXT(FileName)
+    self.Raw_x, self.Raw_y, self.Raw_Z, self.x_scale, self.y_scale = Raw_x, Raw_y, Raw_Z, x_scale, y_scale
 
     # Display the data in main window
     self.image.deleteLater() if hasattr(self, 'image') else None
-    self.image = display_data(self)
-    self.centralWidget().layout().addWidget(self.image, 1, 1, -1, Qt.AlignmentFlag.AlignTop)
+    self.image = display_scan(self)
+    self.centralWidget().layout().addWidget(self.image, 1, 1, -1, Qt.AlignmentFlag.AlignCenter)
     add_export_button(self) # Add export button to main window
     
     # Wayland update delays
     QApplication.processEvents()  # Ensure UI updates immediately
-    # self.resize(self.image.pixmap().size())  # Explicitly resize to the image size
 
     try: del self.corrected_data
     except AttributeError: pass
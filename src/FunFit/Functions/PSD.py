@@ -0,0 +1,225 @@
+"""Built-in modules"""
+import functools
+
+"""External modules"""
+import numpy as np
+import scipy.fft
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPixmap
+from PyQt6.QtWidgets import QMainWindow, QWidget, QGridLayout, QLabel, QPushButton
+
+"""Internal modules"""
+try:
+    from FunFit.Functions import helpers
+    from FunFit.Functions.Selection import largest_box
+    from FunFit.Functions.Spectrum import window_coefficients
+    from FunFit.Functions.Fit_plotting import PLOT_STYLE, LINE_CUT_FACE_COLOR, render_figure
+except:
+    from Functions import helpers
+    from Functions.Selection import largest_box
+    from Functions.Spectrum import window_coefficients
+    from Functions.Fit_plotting import PLOT_STYLE, LINE_CUT_FACE_COLOR, render_figure
+
+"""Constants"""
+PSD_WINDOW = "Hann" # Window of the tiles
+PSD_TILE_MIN = 64 # Smallest tile side in pixels, smaller data is transformed as a single tile
+PSD_BATCH_BYTES = 64 * 2**20 # Memory of the tiles transformed together by the multithreaded FFT
+ANGLE_BINS = 180 # Bins of the angular distribution over 0-180°, the spectrum of real data is point symmetric
+PSD_PANEL_SIZE = (600, 480) # Size in pixels of a panel of the PSD window
+PSD_CURVES = [ # Title, axis labels and export header of the curves, in export order
+    ('Radial PSD', 'Wavenumber, $k$ (1/µm)', 'PSD, $C(k)$ (nm²·µm²)', "# X units: 1/µm (wavenumber 2π/λ)\n# Value units: nm²·µm²\n"),
+    ('Angular power', 'Angle, $θ$ (°)', 'Power (nm²/°)', "# X units: ° (counterclockwise from x)\n# Value units: nm²/°\n"),
+]
+
+"""Tile side of the Welch average, tiles of half the data size overlapping by half"""
+def tile_size(shape):
+    side = min(shape)
+    return side if side < 2 * PSD_TILE_MIN else side // 2
+
+"""Radial and angular bin of every wavenumber of a half-plane spectrum, and the number of spectrum values per bin"""
+@functools.lru_cache(maxsize=8)
+def spectrum_bins(tile, dx, dy):
+    kx = 2 * np.pi * np.fft.rfftfreq(tile, d=dx)
+    ky = 2 * np.pi * np.fft.fftfreq(tile, d=dy)
+    KX, KY = np.meshgrid(kx, ky)
+    # The half plane stands for both halves, except for the columns without a mirrored counterpart
+    weights = np.full(KX.shape, 2.0)
+    weights[:, 0] = 1
+    if tile % 2 == 0:
+        weights[:, -1] = 1
+
+    dk = max(kx[1], abs(ky[1])) if tile > 1 else 1.0
+    n_radial = int(min(kx[-1], np.max(np.abs(ky))) / dk) + 1 # Up to the lower Nyquist wavenumber
+    radial = np.rint(np.hypot(KX, KY) / dk).astype(np.intp)
+    angular = (np.degrees(np.arctan2(KY, KX)) % 180 * ANGLE_BINS / 180).astype(np.intp) % ANGLE_BINS
+    index = np.where(radial < n_radial, radial * ANGLE_BINS + angular, n_radial * ANGLE_BINS).ravel() # Beyond Nyquist in the last bin
+    counts = np.bincount(index, weights=weights.ravel(), minlength=(n_radial + 1) * ANGLE_BINS)
+    return index, weights, counts[:-ANGLE_BINS].reshape(n_radial, ANGLE_BINS), dk
+
+class PSD:
+    """Welch averaged power spectral density of height data (nm) on a grid with spacing dx, dy (µm).
+    The tiles overlap by half, are windowed and transformed in batches by the multithreaded FFT.
+    The angles of data resampled in a rotated frame are turned by its rotation (degrees) back to the scan axes."""
+    def __init__(self, Z, dx, dy, rotation=0.0):
+        Z = np.nan_to_num(Z) if np.isnan(Z).any() else Z
+        self.dx, self.dy = abs(float(dx)), abs(float(dy))
+        self.rotation = rotation
+        self.tile = tile = tile_size(Z.shape)
+        step = max(1, tile // 2)
+        corners = [(i, j) for i in range(0, Z.shape[0] - tile + 1, step) for j in range(0, Z.shape[1] - tile + 1, step)]
+        window = np.outer(window_coefficients(PSD_WINDOW, tile), window_coefficients(PSD_WINDOW, tile))
+
+        power = np.zeros((tile, tile // 2 + 1))
+        batch = max(1, PSD_BATCH_BYTES // (tile * tile * 16))
+        for start in range(0, len(corners), batch):
+            tiles = np.stack([Z[i:i + tile, j:j + tile] for i, j in corners[start:start + batch]])
+            tiles = (tiles - tiles.mean(axis=(1, 2), keepdims=True)) * window
+            spectra = scipy.fft.rfft2(tiles, workers=-1)
+            power += np.sum(spectra.real**2 + spectra.imag**2, axis=0)
+
+        # Density over the wavenumbers kx, ky (1/µm), the sum over all wavenumbers times dk² is the height variance
+        self.power = power * self.dx * self.dy / (len(corners) * tile * tile * np.mean(window**2) * (2 * np.pi)**2)
+        self.dk_area = (2 * np.pi)**2 / (tile * tile * self.dx * self.dy)
+        self.tiles = len(corners)
+        self.binned = self.bin()
+
+    def bin(self): # Power per radial and angular bin, in one pass over the spectrum
+        index, weights, self.counts, self.dk = spectrum_bins(self.tile, self.dx, self.dy)
+        sums = np.bincount(index, weights=(weights * self.power).ravel(), minlength=self.counts.size + ANGLE_BINS)
+        return sums[:-ANGLE_BINS].reshape(self.counts.shape)
+
+    def radial(self): # Radially averaged PSD C(k) in nm²·µm², without the zero wavenumber and empty bins
+        counts = self.counts.sum(axis=1)
+        valid = counts > 0
+        valid[0] = False
+        k = np.arange(len(counts)) * self.dk
+        return k[valid], self.binned.sum(axis=1)[valid] / counts[valid]
+
+    def angular(self): # Power per degree over the orientations of the wavevector, without the zero wavenumber
+        angles = ((np.arange(ANGLE_BINS) + 0.5) * 180 / ANGLE_BINS + self.rotation) % 180
+        order = np.argsort(angles)
+        return angles[order], (self.binned[1:].sum(axis=0) * self.dk_area * ANGLE_BINS / 180)[order]
+
+    def rms(self): # Root mean square roughness (nm) from the PSD integrated over all wavenumbers
+        weights = spectrum_bins(self.tile, self.dx, self.dy)[1]
+        return float(np.sqrt(np.sum(weights * self.power) * self.dk_area))
+
+"""Data of the main window for the PSD with its pixel spacing and rotation against the scan axes (degrees).
+A rotated selection is resampled in its frame, other selections are cropped to their largest valid box"""
+def selected_data(parent):
+    Z = parent.corrected_data if hasattr(parent, 'corrected_data') else parent.Raw_Z
+    frame = getattr(parent, 'rotated_frame', None)
+    if frame is not None and frame.scan_shape == Z.shape: # Flipped like the scan, so the frame angle counts clockwise
+        return np.flipud(frame.resample_valid(Z)[0]), frame.step, frame.step, -np.degrees(frame.angle)
+    if hasattr(parent, 'selection') and parent.selection.shape == Z.shape:
+        rows, cols = largest_box(parent.selection.full(), getattr(parent, 'inscribed_box', None))
+        Z = Z[rows, cols]
+    return np.flipud(Z), parent.Raw_x[1] - parent.Raw_x[0], parent.Raw_y[1] - parent.Raw_y[0], 0.0 # Rows bottom-up, so angles count counterclockwise from the x axis
+
+class PSDWindow(QMainWindow):
+    """Window showing the radial PSD and the angular power distribution of the data."""
+    def __init__(self, parent, psd):
+        super().__init__(parent)
+        self.parent, self.psd = parent, psd
+        self.curves = [psd.radial(), psd.angular()]
+        self.init_ui()
+
+    def init_ui(self): # Set up the PSDWindow UI
+        # Set window properties
+        width, height = PSD_PANEL_SIZE
+        self.setGeometry(self.parent.geometry().x(), self.parent.geometry().y(), 2 * width, height)
+        self.setWindowFlags(Qt.WindowType.Window | Qt.WindowType.FramelessWindowHint)
+
+        # Create the main layout
+        central_widget = QWidget()
+        main_layout = QGridLayout(central_widget)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.setSpacing(0)
+        self.setCentralWidget(central_widget)
+
+        # Add title bar
+        title_bar = helpers.create_title_bar(self, "Power Spectral Density", "child")
+        main_layout.addWidget(title_bar, 0, 0, 1, -1, Qt.AlignmentFlag.AlignTop)
+
+        # Create the panels, each shows a figure rendered offscreen
+        panel_container = QWidget()
+        panel_container.setStyleSheet(f"background-color: {LINE_CUT_FACE_COLOR};")
+        panel_layout = QGridLayout(panel_container)
+        panel_layout.setContentsMargins(0, 0, 0, 0)
+        panel_layout.setSpacing(0)
+        self.figures, self.panel_labels, self.export_buttons = [], [], []
+        pixel_ratio = self.devicePixelRatioF()
+        for index in range(len(PSD_CURVES)):
+            label = QLabel()
+            label.setFixedSize(width, height)
+            figure = self.create_figure(index, pixel_ratio)
+            with helpers.RENDER_LOCK:
+                label.setPixmap(QPixmap.fromImage(render_figure(figure, pixel_ratio)))
+            panel_layout.addWidget(label, 0, index)
+            self.figures.append(figure)
+            self.panel_labels.append(label)
+            self.add_export_button(index)
+        main_layout.addWidget(panel_container, 1, 0)
+        main_layout.setRowStretch(1, 1)
+
+    def create_figure(self, index, pixel_ratio=1.0): # Plot a curve in a figure of the panel size
+        title, xlabel, ylabel, _ = PSD_CURVES[index]
+        x, y = self.curves[index]
+        with matplotlib.rc_context(PLOT_STYLE):
+            figure = Figure(figsize=(PSD_PANEL_SIZE[0] / 100, PSD_PANEL_SIZE[1] / 100), dpi=100 * pixel_ratio)
+            FigureCanvasAgg(figure)
+            ax = figure.add_subplot(111)
+            ax.plot(x, y, color='#8053FF')
+            if index == 0:
+                ax.set_xscale('log')
+                ax.set_yscale('log')
+                ax.set_title(f'{title} [RMS: {self.psd.rms():.4f} nm]')
+            else:
+                ax.set_xlim(0, 180)
+                ax.set_xticks(range(0, 181, 30))
+                ax.set_title(title)
+            ax.set_xlabel(xlabel, fontsize=12)
+            ax.set_ylabel(ylabel, fontsize=12)
+            with helpers.RENDER_LOCK:
+                figure.tight_layout()
+        return figure
+
+    def add_export_button(self, index): # Export button in the top right corner of the panel axes
+        btn = QPushButton(self.panel_labels[index])
+        btn.setFixedSize(30, 30)
+        btn.setIcon(helpers.gui_icon("icon_export.png"))
+        btn.setObjectName("export_button")
+        btn.clicked.connect(lambda _, idx=index: self.export_curve(idx))
+        pos = self.figures[index].axes[0].get_position()
+        btn.move(int(pos.x1 * PSD_PANEL_SIZE[0]) - 35, int((1 - pos.y1) * PSD_PANEL_SIZE[1]) + 5)
+        self.export_buttons.append(btn)
+
+    def export_curve(self, index): # Export a curve as columns of a text file or its plot as an image
+        title, _, _, header = PSD_CURVES[index]
+        selection = helpers.export_dialog(title)
+        if selection is None:
+            return
+        file_path, selected_filter = selection
+        extension = selected_filter.split('*')[-1].rstrip(')')
+        if not file_path.endswith(extension):
+            file_path += extension
+        if extension == '.txt':
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.writelines([f"# Channel: {title}\n", header, f"# Tiles: {self.psd.tiles} of {self.psd.tile} px, {PSD_WINDOW} window\n"])
+                np.savetxt(f, np.column_stack(self.curves[index]), fmt='%.6e', delimiter='\t')
+        else:
+            figure = self.create_figure(index)
+            with helpers.RENDER_LOCK:
+                figure.savefig(file_path, bbox_inches='tight', pad_inches=0.05)
+
+"""Function called from main window."""
+def psd_analysis(self=None):
+    if not hasattr(self, 'Raw_Z'):
+        helpers.error_message("Data not loaded.")
+        return
+    psd = PSD(*selected_data(self))
+    self.psd_window = PSDWindow(self, psd)
+    self.psd_window.show()
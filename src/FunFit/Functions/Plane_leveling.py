@@ -7,9 +7,9 @@ from PyQt6.QtWidgets import QMainWindow, QMessageBox, QWidget, QVBoxLayout, QGri
 
 """Internal modules"""
 try:
-    from FunFit.Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from FunFit.Functions.helpers import create_title_bar, setStyleSheet_from_file
 except:
-    from Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from Functions.helpers import create_title_bar, setStyleSheet_from_file
 
 """Constants"""
 POINT_COLOR = '#3B2070'
@@ -21,11 +21,8 @@ class PlaneLevelingWindow(QMainWindow):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        if hasattr(parent, "outside_image"):
-            self.outside_image = np.copy(parent.outside_image)
-            if hasattr(parent, "corrected_data"):
-                idx = np.where(np.isfinite(self.outside_image))
-                self.outside_image[idx] = parent.corrected_data[idx]
+        if hasattr(parent, "selection"):
+            self.selection = parent.selection
         if hasattr(parent, "corrected_data"):
             self.Raw_Z = np.copy(parent.corrected_data)
         else:
@@ -76,28 +73,29 @@ class PlaneLevelingWindow(QMainWindow):
     def apply_correction(self): # Apply the correction to the data in the main window
         self.parent.corrected_data = self.parent.leveled_data
         self.Raw_Z = self.parent.leveled_data
-        image = display_data(self)
-        self.parent.image.setPixmap(image.pixmap())
+        self.parent.image.set_data(self.Raw_Z)
         self.close()
 
     def display_fit_plane(self): # Display the fit plane on the image
-        if hasattr(self, 'outside_image'):
-            Z = self.outside_image
+        # The plane is fitted to the data outside the selection
+        if hasattr(self, 'selection'):
+            Z = self.selection.outside(self.Raw_Z)
         else:
-            Z = self.Raw_Z
+            Z = np.ma.masked_array(self.Raw_Z)
         # Use scaled coordinates for the x and y axes
         X_vals, Y_vals = np.linspace(0, self.x_scale, Z.shape[1]), np.linspace(0, self.y_scale, Z.shape[0])
         X, Y = np.meshgrid(X_vals, Y_vals)
 
         # Fit a plane to the data
-        XX, YY, ZZ = X[np.isfinite(Z)], Y[np.isfinite(Z)], Z[np.isfinite(Z)]
+        valid = ~np.ma.getmaskarray(Z) & np.isfinite(Z.data)
+        XX, YY, ZZ = X[valid], Y[valid], Z.data[valid]
         A = np.c_[XX.ravel(), YY.ravel(), np.ones(XX.size)]
         C, _, _, _ = np.linalg.lstsq(A, ZZ.ravel(), rcond=None)
         plane = (C[0] * X + C[1] * Y + C[2]).reshape(Z.shape)
 
         # Subtract the plane from the original data
         self.parent.leveled_data = self.Raw_Z - plane
-        data = np.vstack((X[0::1].flatten(), Y[0::1].flatten(), Z[0::1].flatten())).T
+        data = np.vstack((X[0::1].flatten(), Y[0::1].flatten(), Z.filled(np.nan)[0::1].flatten())).T
         X_data = np.vstack([X[0::1].flatten(), Y[0::1].flatten()]).T
 
         plt.rcParams.update({
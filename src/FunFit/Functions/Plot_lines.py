@@ -7,13 +7,15 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 from PyQt6.QtWidgets import QMainWindow, QWidget, QGridLayout, QMessageBox, QPushButton, QLabel, QHBoxLayout, QVBoxLayout
 from PyQt6.QtCore import Qt, QPoint, QPointF, QSize, QLineF, QRectF
-from PyQt6.QtGui import QRegion, QIcon, QPixmap, QPainter, QPen, QColor, QTransform, QBrush, QLinearGradient
+from PyQt6.QtGui import QRegion, QPixmap, QPainter, QPen, QColor, QTransform, QBrush, QLinearGradient
 
 """Internal modules"""
 try:
-    from FunFit.Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from FunFit.Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file, gui_icon
+    from FunFit.Functions.Regions import REGION_COLORS, label_runs, region_statistics, statistics_table
 except:
-    from Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file
+    from Functions.helpers import display_data, create_title_bar, setStyleSheet_from_file, gui_icon
+    from Functions.Regions import REGION_COLORS, label_runs, region_statistics, statistics_table
 
 """Constants"""
 CORNER_HANDLE_SIZE = 30
@@ -167,7 +169,7 @@ class FindStructWindow(QMainWindow):
         self.reset_button = QPushButton("", self)
         self.reset_button.clicked.connect(self.reset_selection)
         self.reset_button.setObjectName("reset_button")
-        reset_icon = QIcon(self.parent.current_dir + "/GUI/reset.png")
+        reset_icon = gui_icon("reset.png")
         self.reset_button.setIcon(reset_icon)
         self.reset_button.setIconSize(QSize(25, 25))
         button_layout.addWidget(self.reset_button)
@@ -182,6 +184,11 @@ class FindStructWindow(QMainWindow):
         self.preview_label.setStyleSheet("background-color: transparent;")
         fig_layout.addWidget(self.preview_label)
         layout.addLayout(fig_layout, 1, 3, 1, -1, Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignRight)
+
+        # Add the statistics of the line cut in every region of the selection
+        self.region_table = QLabel(self)
+        self.region_table.setStyleSheet("color: white; padding: 10px; font-size: 13px; margin: 2px 10px; font-family: Verdana;")
+        layout.addWidget(self.region_table, 2, 3, 1, -1, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
         
         # Enable mouse tracking for the overlay
         self.overlay.setMouseTracking(True)  # Enable mouse tracking for the overlay
@@ -400,6 +407,7 @@ class FindStructWindow(QMainWindow):
         length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
         x_axis = np.linspace(0, length, len(plotting_line))
         self.ax.plot(x_axis,plotting_line, color=LINE_CUT_COLOR, linewidth=2)
+        self.show_region_statistics(y_indices, x_indices, plotting_line, x_axis)
         self.ax.set_facecolor(LINE_CUT_FACE_COLOR)
         self.ax.set_xlim(0, length)
         self.ax.set_xlabel("Distance (µm)", color=PLOT_TEXT_COLOR, fontsize=12)
@@ -417,6 +425,22 @@ class FindStructWindow(QMainWindow):
         self.preview_label.setPixmap(pixelmap)
         self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
+    def show_region_statistics(self, y_indices, x_indices, plotting_line, x_axis): # Shade the regions along the cut and tabulate their statistics
+        regions = getattr(self.parent, 'regions', None)
+        if regions is None or regions.count < 2:
+            self.region_table.setText("")
+            return
+        cut_labels = regions.label_at(y_indices, x_indices)
+        for label, first, last in label_runs(cut_labels):
+            self.ax.axvspan(x_axis[first], x_axis[last], color=REGION_COLORS[(label - 1) % len(REGION_COLORS)], alpha=0.25, linewidth=0)
+        stats = region_statistics(cut_labels, plotting_line, regions.count)
+        present = np.flatnonzero(stats["pixels"] > 0)
+        step = x_axis[1] - x_axis[0] if len(x_axis) > 1 else 0.0 # Length of the cut per sample
+        self.region_table.setText(statistics_table(present + 1, [("Mean (nm)", stats["mean"][present], ".3f"),
+                                                                 ("Rq (nm)", stats["Rq"][present], ".3f"),
+                                                                 ("Rz (nm)", stats["Rz"][present], ".3f"),
+                                                                 ("Length (µm)", stats["pixels"][present] * step, ".3f")]))
+
 """Function called from main window."""
 def crop_data(self=None):
     try: 
@@ -0,0 +1,225 @@
+"""External modules"""
+import numpy as np
+from scipy.ndimage import find_objects, maximum, minimum
+from PyQt6.QtCore import QThread, QObject, pyqtSignal, Qt
+from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView
+
+"""Internal modules"""
+try:
+    from FunFit.Functions import helpers, Fit_handling, Series_fit
+    from FunFit.Functions.Fit_plotting import HTMLDelegate
+    from FunFit.Functions.Selection import largest_box
+except:
+    from Functions import helpers, Fit_handling, Series_fit
+    from Functions.Fit_plotting import HTMLDelegate
+    from Functions.Selection import largest_box
+
+"""Constants"""
+REGION_COLORS = ["#EB7194", "#71C5EB", "#9AEB71", "#EBC571", "#C571EB", "#71EBC5"] # Colors of the regions in plots, repeated
+
+"""Statistics of data in every labelled region, one bincount pass per moment. NaN values are ignored.
+Returns arrays over the labels 1 to count: pixels, mean, Rq (RMS deviation from the mean), Ra (mean absolute deviation) and Rz (peak to valley)."""
+def region_statistics(labels, Z, count):
+    valid = (labels > 0) & np.isfinite(Z)
+    label, z = labels[valid].astype(np.intp), Z[valid]
+    moment = lambda weights: np.bincount(label, weights=weights, minlength=count + 1)[1:]
+    pixels = moment(None)
+    index = np.arange(1, count + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = moment(z) / pixels
+        deviation = z - np.concatenate([[np.nan], mean])[label]
+        Rq = np.sqrt(moment(deviation**2) / pixels)
+        Ra = moment(np.abs(deviation)) / pixels
+    Rz = np.full(count, np.nan)
+    if z.size:
+        Rz = np.where(pixels > 0, np.asarray(maximum(z, label, index)) - np.asarray(minimum(z, label, index)), np.nan)
+    return {"pixels": pixels.astype(int), "mean": mean, "Rq": Rq, "Ra": Ra, "Rz": Rz}
+
+"""Least-squares plane of every labelled region, solved together from the bincount moments of the pixel coordinates.
+Returns the planes on the grid of the labels, NaN outside the regions and where the data is NaN."""
+def region_planes(labels, Z, count):
+    rows, cols = np.nonzero((labels > 0) & np.isfinite(Z))
+    label = labels[rows, cols].astype(np.intp)
+    moment = lambda weights: np.bincount(label, weights=weights, minlength=count + 1)[1:]
+    pixels = np.maximum(moment(None), 1)
+    # Coordinates relative to the centroid of their region keep the normal equations well conditioned
+    center_x, center_y = np.concatenate([[0], moment(cols) / pixels]), np.concatenate([[0], moment(rows) / pixels])
+    x, y, z = cols - center_x[label], rows - center_y[label], Z[rows, cols]
+    normal = np.empty((count, 3, 3))
+    normal[:, 0, 0], normal[:, 1, 1], normal[:, 2, 2] = moment(x * x), moment(y * y), moment(None)
+    normal[:, 0, 1] = normal[:, 1, 0] = moment(x * y)
+    normal[:, 0, 2] = normal[:, 2, 0] = moment(x)
+    normal[:, 1, 2] = normal[:, 2, 1] = moment(y)
+    rhs = np.stack([moment(x * z), moment(y * z), moment(z)], axis=1)
+    coefficients = np.concatenate([np.zeros((1, 3)), (np.linalg.pinv(normal) @ rhs[..., None])[..., 0]]) # Degenerate regions get a flat plane
+
+    plane = np.full(labels.shape, np.nan)
+    plane[rows, cols] = coefficients[label, 0] * x + coefficients[label, 1] * y + coefficients[label, 2]
+    return plane
+
+"""Contiguous runs of equal labels along a line as (label, first index, last index), runs outside the regions are skipped"""
+def label_runs(labels):
+    if labels.size == 0:
+        return []
+    starts = np.flatnonzero(np.diff(labels.astype(np.intp), prepend=-1))
+    stops = np.append(starts[1:], labels.size) - 1
+    return [(int(labels[start]), int(start), int(stop)) for start, stop in zip(starts, stops) if labels[start] > 0]
+
+"""HTML table of region statistics for labels, columns given as (header, values, format)"""
+def statistics_table(labels, columns):
+    header = "".join(f"<th style='padding: 0 8px;'>{name}</th>" for name, _, _ in columns)
+    rows = "".join("<tr><td style='padding: 0 8px;'>{}</td>{}</tr>".format(
+        label, "".join(f"<td style='padding: 0 8px;'>{format(values[i], spec)}</td>" for _, values, spec in columns))
+        for i, label in enumerate(labels))
+    return f"<table><tr><th style='padding: 0 8px;'>Region</th>{header}</tr>{rows}</table>"
+
+class RegionFitWorker(QObject):
+    """Worker class for fitting every region of a selection with its own parameters."""
+    finished = pyqtSignal(object) # Results dictionary
+    error = pyqtSignal(Exception)
+
+    def __init__(self, parent, regions, params):
+        super().__init__()
+        self.parent = parent
+        self.regions = regions
+        self.params = params
+
+    def run(self): # Fit all regions in one least-squares problem, no parameters are shared between the regions
+        try:
+            Raw_x, Raw_y = self.parent.Raw_x, self.parent.Raw_y
+            Z_data = self.parent.corrected_data if hasattr(self.parent, 'corrected_data') else self.parent.Raw_Z
+            param_names = [p for p in self.params['FITTINGPARAMETERS'] if p != "N"]
+            model_func = Fit_handling.model_function_builder(self.params['function_name'], self.params['param_edits'])
+            jacobian = Fit_handling.jacobian_builder(self.params['function_name'], self.params['param_edits'])
+
+            labels, datasets, p0_regions = [], [], []
+            for label in range(1, self.regions.count + 1):
+                if self.regions.sizes[label - 1] == 0: # Covered by later regions
+                    continue
+                selection = self.regions.region(label)
+                samples = Fit_handling.masked_samples(Raw_x, Raw_y, Z_data, selection)
+                # The spectrum of the guess is taken from the largest box inside the region only
+                rows, cols = largest_box(selection.full())
+                p0_regions.append(Series_fit.initial_guess((Raw_x[cols], Raw_y[rows], Z_data[rows, cols]), samples, self.params))
+                datasets.append(Fit_handling.subsample(*samples))
+                labels.append(label)
+            popt, perr, info = Series_fit.global_fit(model_func, datasets, param_names, [], p0_regions, jacobian)
+
+            # Fitted surface of every region on the bounding box of all regions, NaN outside the regions
+            box = self.regions.labels
+            x_box, y_box = Raw_x[self.regions.cols], Raw_y[self.regions.rows]
+            Z_fit = np.full(box.shape, np.nan)
+            objects = find_objects(box)
+            for i, label in enumerate(labels):
+                rows, cols = objects[label - 1]
+                inside = box[rows, cols] == label
+                Z_fit[rows, cols][inside] = Fit_handling.evaluate_surface(model_func, popt[i], x_box[cols], y_box[rows])[inside]
+            self.finished.emit({"labels": labels, "param_names": param_names, "popt": popt, "perr": perr,
+                                "pixels": self.regions.sizes[np.array(labels) - 1], "Z_fit": Z_fit, **info})
+        except Exception as e:
+            self.error.emit(e)
+
+class RegionResultsWindow(QMainWindow):
+    """Window to display results of every region of a selection, one row per region."""
+    def __init__(self, parent, title, labels, columns):
+        super().__init__()
+        self.parent = parent
+        self.title = title
+        self.labels = labels
+        self.columns = columns # (header, values, uncertainties or None) of every column
+        helpers.setStyleSheet_from_file(self, self.parent.current_dir + "/GUI/stylesheet.qss")
+        self.init_ui()
+
+    def init_ui(self): # Set up the RegionResultsWindow UI
+        # Set window properties
+        self.setGeometry(self.parent.geometry().x(), self.parent.geometry().y(), 900, 450)
+        self.setWindowFlags(Qt.WindowType.Window | Qt.WindowType.FramelessWindowHint)
+
+        # Create the main layout
+        central_widget = QWidget()
+        layout = QVBoxLayout(central_widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        self.setCentralWidget(central_widget)
+        title_bar = helpers.create_title_bar(self, self.title, "child")
+        layout.addWidget(title_bar, alignment=Qt.AlignmentFlag.AlignTop)
+
+        # One row per region
+        plain = lambda p: p.replace("<sub>", "").replace("</sub>", "") # Headers are not rendered as HTML
+        self.table = QTableWidget()
+        self.table.setObjectName("results_table")
+        self.table.setColumnCount(len(self.columns) + 1)
+        self.table.setRowCount(len(self.labels))
+        for j, header in enumerate(["Region"] + [plain(header) for header, _, _ in self.columns]):
+            self.table.setHorizontalHeaderItem(j, QTableWidgetItem(header))
+        for i, label in enumerate(self.labels):
+            self.table.setItem(i, 0, QTableWidgetItem(str(label)))
+            for j, (_, values, errors) in enumerate(self.columns):
+                text = f"{values[i]:.3f} ± {errors[i]:.1e}" if errors is not None else f"{values[i]:.4g}"
+                self.table.setItem(i, j + 1, QTableWidgetItem(text))
+            self.table.setRowHeight(i, 40)
+        self.table.setItemDelegate(HTMLDelegate())
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setAlternatingRowColors(True)
+        layout.addWidget(self.table)
+
+        export_button = QPushButton("Export table")
+        export_button.setObjectName("main_button")
+        export_button.clicked.connect(self.export_table)
+        layout.addWidget(export_button)
+
+    def export_table(self): # Export the results as a tab separated text file
+        selection = helpers.export_dialog(self.title, "Text files (*.txt)")
+        if selection is None:
+            return
+        file_path = selection[0] if selection[0].endswith('.txt') else selection[0] + '.txt'
+        plain = lambda p: p.replace("<sub>", "").replace("</sub>", "")
+        headers = "\t".join(f"{plain(h)}\td{plain(h)}" if errors is not None else plain(h) for h, _, errors in self.columns)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(f"# Region\t{headers}\n")
+            for i, label in enumerate(self.labels):
+                values = "\t".join(f"{values[i]:.6e}\t{errors[i]:.6e}" if errors is not None else f"{values[i]:.6e}" for _, values, errors in self.columns)
+                f.write(f"{label}\t{values}\n")
+
+"""Regions.on_apply - Used when fitting a selection of several regions"""
+def on_apply(self):
+    # Disable UI during fitting
+    self.scroll_area.setEnabled(False)
+    self.show_loading_overlay()
+
+    # Prepare parameters for worker
+    params = {
+        'param_edits': self.param_edits,
+        'FITTINGPARAMETERS': Fit_handling.FITTINGPARAMETERS,
+        'function_name': self.function_name
+    }
+
+    # Setup thread and worker
+    self.fit_thread = QThread()
+    self.fit_worker = RegionFitWorker(self.parent, self.parent.regions, params)
+    self.fit_worker.moveToThread(self.fit_thread)
+
+    # Connect signals
+    self.fit_thread.started.connect(self.fit_worker.run)
+    self.fit_worker.finished.connect(lambda results: on_regions_complete(self, results))
+    self.fit_worker.error.connect(self.on_fit_error)
+    self.fit_worker.finished.connect(self.fit_thread.quit)
+    self.fit_worker.error.connect(self.fit_thread.quit)
+
+    self.fit_thread.start()
+
+"""Show the fits of the regions and their parameters"""
+def on_regions_complete(self, results):
+    self.hide_loading_overlay()
+    self.scroll_area.setEnabled(True)
+    self.show_fit_plots(np.flip(results["Z_fit"], axis=0))
+
+    popt = results["popt"]
+    if self.function_name == "Gaussian": # As for a single fit
+        popt[:, Fit_handling.FITTINGPARAMETERS.index('µ_y')] = max(self.parent.Raw_y) - popt[:, Fit_handling.FITTINGPARAMETERS.index('µ_y')]
+    columns = [(p, popt[:, j], results["perr"][:, j]) for j, p in enumerate(results["param_names"])]
+    columns += [("RMSE (nm)", results["rmse"], None), ("Pixels", results["pixels"], None)]
+    self.parent.region_results = RegionResultsWindow(self.parent, "Region fitting results", results["labels"], columns)
+    self.parent.region_results.show()
+    self.close()
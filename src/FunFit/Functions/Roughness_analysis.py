@@ -1,7 +1,6 @@
 """External modules"""
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.path import Path
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from PyQt6.QtCore import Qt, QPointF
@@ -12,10 +11,14 @@ from PyQt6.QtGui import QPolygonF, QPixmap
 try:
     from FunFit.Functions.helpers import create_title_bar, setStyleSheet_from_file, add_export_button, export_plot
     from FunFit.Functions.Find_structs import FindStructWindow
+    from FunFit.Functions.Selection import label_map, RegionLabels
+    from FunFit.Functions.Regions import RegionResultsWindow, region_planes, region_statistics
     import FunFit.Functions.Fit_plotting as Fit_plotting
 except:
     from Functions.helpers import create_title_bar, setStyleSheet_from_file, add_export_button, export_plot
     from Functions.Find_structs import FindStructWindow
+    from Functions.Selection import label_map, RegionLabels
+    from Functions.Regions import RegionResultsWindow, region_planes, region_statistics
     import Functions.Fit_plotting as Fit_plotting
 
 LINE_CUT_FACE_COLOR = "#232036"
@@ -25,32 +28,48 @@ class Roughness_analysis_window(FindStructWindow):
     """Window for selecting a flat area to calculate roughness. Inherits from FindStructWindow."""
     def apply_selection(self): # Apply the selection to the data
         # If no selection, use entire image
-        if self.selection_polygon.isEmpty():
+        if self.selection_polygon.isEmpty() and not self.regions:
             self.corners = [QPointF(0, 0), 
                             QPointF(self.parent.img_scale_x, 0), 
                             QPointF(self.parent.img_scale_x, self.parent.img_scale_y), 
                             QPointF(0, self.parent.img_scale_y)]
             self.selection_polygon = QPolygonF(self.corners)
 
-        # Create a Path object from the selection polygon
-        polygon_path = Path([(point.x() * self.Raw_Z.shape[1] / self.parent.img_scale_x, 
-                              point.y() * self.Raw_Z.shape[0] / self.parent.img_scale_y) 
-                              for point in self.selection_polygon])
-
-        # Create a mask for the selection polygon
-        mask = np.zeros(self.Raw_Z.shape, dtype=bool)
-        x_coords, y_coords = np.meshgrid(np.arange(self.Raw_Z.shape[1]), np.arange(self.Raw_Z.shape[0]))
-        points = np.vstack((x_coords.flatten(), y_coords.flatten())).T
-        mask = polygon_path.contains_points(points).reshape(self.Raw_Z.shape)
+        # Rasterize the polygons into a label map, scaled from image to data pixels
+        to_data = self.data_transform()
+        self.labels = RegionLabels(label_map([[(point.x(), point.y()) for point in to_data.map(polygon)]
+                                              for polygon in self.selected_polygons()], self.Raw_Z.shape))
+        self.selection = self.labels.selection
+        if self.labels.count > 1:
+            self.calc_regions()
+        else:
+            self.calc()
+
+    def calc_regions(self): # Calculate the roughness of every region, each around its own plane
+        labels, count = self.labels.labels, self.labels.count
+        Z = np.where(labels > 0, self.Raw_Z[self.labels.rows, self.labels.cols], np.nan)
+        plane = region_planes(labels, Z, count)
+        stats = region_statistics(labels, Z - plane, count)
+
+        # Residual of all regions on the scan, NaN outside the regions
+        Z_full, plane_full = np.full(self.Raw_Z.shape, np.nan), np.full(self.Raw_Z.shape, np.nan)
+        Z_full[self.labels.rows, self.labels.cols], plane_full[self.labels.rows, self.labels.cols] = Z, plane
+        self.residuals = Z_full - plane_full
+        self.plot_window = PlotWindow(self.parent, self.parent.Raw_x, self.parent.Raw_y, Z_full, plane_full)
+        self.plot_window.show()
 
-        # Create images with NaNs for outside points
-        self.inside_image = np.where(mask, self.Raw_Z, np.nan)
-        self.outside_image = np.where(~mask, self.Raw_Z, np.nan)
-        self.calc()
+        pixel_area = abs(self.parent.Raw_x[1] - self.parent.Raw_x[0]) * abs(self.parent.Raw_y[1] - self.parent.Raw_y[0])
+        present = np.flatnonzero(stats["pixels"] > 0)
+        columns = [("Rq (nm)", stats["Rq"][present], None), ("Ra (nm)", stats["Ra"][present], None),
+                   ("Rz (nm)", stats["Rz"][present], None), ("Area (µm²)", stats["pixels"][present] * pixel_area, None),
+                   ("Pixels", stats["pixels"][present], None)]
+        self.parent.region_results = RegionResultsWindow(self.parent, "Roughness of the regions", [int(label) for label in present + 1], columns)
+        self.parent.region_results.show()
+        self.close()
 
     def calc(self): # Calculate the roughness of the flat area
-        if hasattr(self, 'inside_image') and hasattr(self, 'outside_image'):
-            Z = self.inside_image
+        if hasattr(self, 'selection'): # Selected data with NaN outside, as shown in the plots
+            Z = np.where(self.selection.full(), self.Raw_Z, np.nan)
         else:
             Z = self.Raw_Z
         # Fit a plane to the data
@@ -128,24 +147,7 @@ class PlotWindow(QMainWindow):
         self.export_button.clicked.connect(lambda _, idx=2: self.export_roughness(idx))
 
     def export_roughness(self, idx): # Export the roughness plot
-        # Set the plot window style
-        plt.rcParams.update({
-                            'font.size': 14,
-                            'figure.facecolor': 'white',
-                            'figure.edgecolor': 'black',
-                            'axes.facecolor': 'white',
-                            'axes.edgecolor': 'black',
-                            'axes.labelcolor': 'black',
-                            'xtick.color': 'black',
-                            'ytick.color': 'black',
-                            'text.color': 'black',
-                            'axes.titlesize': 16,
-                            'xtick.labelsize': 14,
-                            'ytick.labelsize': 14,
-                            })
-        self.plot_window = Fit_plotting.PlotWindow(self, self.x, self.y, np.flipud(self.Z_data), np.flipud(self.Z_fit), None, None, None, None)
-        self.plot_window.ax6.set_title('')
-        export_plot(self.plot_window, idx)
+        export_plot(Fit_plotting.FitResults(self.x, self.y, np.flipud(self.Z_data), np.flipud(self.Z_fit)), idx)
 
     def calculations(self): # Calculate the roughness
         # Remove NaN values from x, y, and Z_data
@@ -0,0 +1,220 @@
+"""Built-in modules"""
+import math
+from collections import OrderedDict
+
+"""External modules"""
+import numpy as np
+from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsObject, QFrame, QApplication
+from PyQt6.QtCore import Qt, QObject, QThread, QRectF, QPropertyAnimation, pyqtSignal
+from PyQt6.QtGui import QPixmap, QPainter, QPainterPath, QColor
+
+"""Internal modules"""
+try:
+    from FunFit.Functions.helpers import decimate, argb_image, colormap_lut, image_size
+    from FunFit.Functions.Contrast import histogram, CONTRAST_CLIP, CONTRAST_CLIP_STEPS
+    from FunFit.Functions.Find_structs import OPACITY_ANIMATION_DURATION, draw_selection_border, draw_region_labels
+except:
+    from Functions.helpers import decimate, argb_image, colormap_lut, image_size
+    from Functions.Contrast import histogram, CONTRAST_CLIP, CONTRAST_CLIP_STEPS
+    from Functions.Find_structs import OPACITY_ANIMATION_DURATION, draw_selection_border, draw_region_labels
+
+"""Constants"""
+TILE_SIZE = 256 # Tile edge in pixels of its pyramid level
+TILE_CACHE_SIZE = 256 # Rendered tiles kept in memory, 256 tiles of 256x256 ARGB32 is 64 MB
+ZOOM_STEP = 1.25 # Zoom factor per wheel step
+MAX_PIXEL_ZOOM = 16 # Largest zoom in screen pixels per data pixel
+
+"""Halve the resolution of 2D data by averaging 2x2 blocks, NaN values are ignored"""
+def downsample(Z, has_nan=True):
+    # Repeat the last row/column of odd sizes so level pixels stay aligned with the data grid
+    if Z.shape[0] % 2 or Z.shape[1] % 2:
+        Z = np.pad(Z, ((0, Z.shape[0] % 2), (0, Z.shape[1] % 2)), mode='edge')
+    # Strided quarter views add up faster than a reshaped mean
+    quarters = (Z[0::2, 0::2], Z[1::2, 0::2], Z[0::2, 1::2], Z[1::2, 1::2])
+    if not has_nan:
+        return ((quarters[0] + quarters[1] + quarters[2] + quarters[3]) * 0.25).astype(np.float32)
+    total = sum(np.nan_to_num(quarter) for quarter in quarters)
+    count = sum((~np.isnan(quarter)).astype(np.uint8) for quarter in quarters)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total / count).astype(np.float32) # All-NaN blocks stay NaN
+
+"""Build the mipmap pyramid, level k has 2**k data pixels per level pixel"""
+def build_pyramid(Z):
+    levels = [Z]
+    has_nan = bool(np.isnan(Z).any())
+    while max(levels[-1].shape) > TILE_SIZE:
+        levels.append(downsample(levels[-1], has_nan))
+    return levels
+
+class PyramidWorker(QObject): # Builds the pyramid off the GUI thread
+    finished = pyqtSignal(object) # List of levels
+
+    def __init__(self, Z):
+        super().__init__()
+        self.Z = Z
+
+    def run(self):
+        self.finished.emit(build_pyramid(self.Z))
+
+class SelectionItem(QGraphicsObject): # Selection overlay of one or more regions in data coordinates, follows zoom and pan
+    def __init__(self, polygons, scene_rect):
+        super().__init__()
+        self.polygons = polygons
+        self.scene_rect = scene_rect
+        self.setOpacity(0.0)
+        self.animation = QPropertyAnimation(self, b"opacity")
+        self.animation.setDuration(OPACITY_ANIMATION_DURATION)
+        self.animation.setEndValue(1.0)
+        self.animation.start()
+
+    def boundingRect(self): # The overlay dims the whole scan
+        return self.scene_rect
+
+    def paint(self, painter, option, widget=None): # Dim outside the polygons and draw the borders, several regions are numbered
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        outside = QPainterPath()
+        outside.addRect(self.scene_rect)
+        inside = QPainterPath()
+        for polygon in self.polygons:
+            inside.addPolygon(polygon)
+            inside.closeSubpath()
+        inside.setFillRule(Qt.FillRule.WindingFill)
+        painter.fillPath(outside.subtracted(inside.simplified()), QColor(0, 0, 0, 140))
+
+        for polygon in self.polygons:
+            draw_selection_border(painter, polygon, cosmetic=True) # Border width in screen pixels at any zoom
+        if len(self.polygons) > 1:
+            draw_region_labels(painter, self.polygons)
+
+class ScanView(QGraphicsView): # Zoomable scan view, draws only the visible tiles of the matching pyramid level
+    def __init__(self, Z, width, height):
+        super().__init__()
+        self.setScene(QGraphicsScene(0, 0, Z.shape[1], Z.shape[0], self))
+        self.setFixedSize(width, height)
+        self.setFrameShape(QFrame.Shape.NoFrame)
+        self.setStyleSheet("background: transparent;")
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+        self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
+        self.tiles = OrderedDict() # LRU cache of rendered tiles, keyed by (level, row, column)
+        self.tile_bins = OrderedDict() # LRU cache of the histogram bins of the tiles, same keys
+        self.clip = CONTRAST_CLIP
+        self.levels = None
+        self.set_data(Z)
+
+    """Data handling"""
+    def set_data(self, Z): # Show new data with the same shape, e.g. after a correction
+        # The histogram of the shown data is updated when a correction only changed a region
+        self.histogram = histogram(Z, previous=self.levels[0] if self.levels else None)
+        self.levels = [Z]
+        self.tile_bins.clear()
+        self.overview_bins = self.histogram.bin(decimate(Z, self.width(), self.height()))
+        self.set_contrast(self.clip)
+        self.fit_to_view()
+
+        # The thread belongs to the application so a replaced view does not destroy it while running
+        thread = QThread(QApplication.instance())
+        thread.worker = PyramidWorker(Z)
+        thread.worker.moveToThread(thread)
+        thread.started.connect(thread.worker.run)
+        thread.worker.finished.connect(self.set_levels)
+        thread.worker.finished.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        QApplication.instance().aboutToQuit.connect(thread.wait)
+        thread.start()
+
+    def set_levels(self, levels): # Slot for the finished pyramid
+        if levels[0] is not self.levels[0]: # Data changed while building
+            return
+        self.levels = levels
+        self.viewport().update()
+
+    def set_contrast(self, clip): # Saturate clip percent of the values at each end, the data is not touched
+        self.clip = clip
+        self.lut = self.histogram.lut(colormap_lut('gray'), *self.histogram.limits(clip))
+        self.overview = QPixmap.fromImage(argb_image(self.lut[self.overview_bins], self.width(), self.height()))
+        self.tiles.clear()
+        self.viewport().update()
+
+    def tile(self, level, row, column): # Rendered tile from the cache
+        key = (level, row, column)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if key in self.tile_bins:
+            self.tile_bins.move_to_end(key)
+        else:
+            block = self.levels[level][row*TILE_SIZE:(row+1)*TILE_SIZE, column*TILE_SIZE:(column+1)*TILE_SIZE]
+            self.tile_bins[key] = self.histogram.bin(block)
+            if len(self.tile_bins) > TILE_CACHE_SIZE:
+                self.tile_bins.popitem(last=False)
+        bins = self.tile_bins[key]
+        pixmap = QPixmap.fromImage(argb_image(self.lut[bins], bins.shape[1], bins.shape[0]))
+        self.tiles[key] = pixmap
+        if len(self.tiles) > TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        return pixmap
+
+    """Drawing"""
+    def drawBackground(self, painter, rect): # Draw the tiles intersecting the exposed rectangle
+        zoom = max(self.transform().m11(), self.transform().m22()) # Screen pixels per data pixel
+        level = max(0, int(math.floor(math.log2(1 / zoom))))
+        if level >= len(self.levels): # Pyramid not built yet or zoomed out to the overview
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawPixmap(self.sceneRect(), self.overview, QRectF(self.overview.rect()))
+            return
+
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, zoom * 2**level < 1)
+        span = TILE_SIZE * 2**level # Tile edge in data pixels
+        rect = rect.intersected(self.sceneRect())
+        rows = self.levels[level].shape[0]
+        columns = self.levels[level].shape[1]
+        for row in range(int(rect.top() // span), min(int(math.ceil(rect.bottom() / span)), math.ceil(rows / TILE_SIZE))):
+            for column in range(int(rect.left() // span), min(int(math.ceil(rect.right() / span)), math.ceil(columns / TILE_SIZE))):
+                pixmap = self.tile(level, row, column)
+                target = QRectF(column * span, row * span, pixmap.width() * 2**level, pixmap.height() * 2**level)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+    def show_selection(self, polygons): # Add a selection overlay, list of polygons in data coordinates
+        item = SelectionItem(polygons, self.sceneRect())
+        self.scene().addItem(item)
+        return item
+
+    """Zoom and pan"""
+    def fit_to_view(self): # Show the whole scan
+        self.resetTransform()
+        self.scale(self.width() / self.sceneRect().width(), self.height() / self.sceneRect().height())
+
+    def wheelEvent(self, event): # Zoom around the cursor, never beyond the whole scan. Shift adjusts the contrast
+        if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+            delta = event.angleDelta().y() or event.angleDelta().x() # Some platforms turn shifted wheel events horizontal
+            step = CONTRAST_CLIP_STEPS.index(self.clip) + (1 if delta > 0 else -1)
+            step = min(max(step, 0), len(CONTRAST_CLIP_STEPS) - 1)
+            self.set_contrast(CONTRAST_CLIP_STEPS[step])
+            event.accept()
+            return
+        fit = self.width() / self.sceneRect().width()
+        zoom = self.transform().m11() * ZOOM_STEP ** (event.angleDelta().y() / 120)
+        zoom = min(max(zoom, fit), max(fit, MAX_PIXEL_ZOOM))
+        factor = zoom / self.transform().m11()
+        self.scale(factor, factor)
+        event.accept()
+
+    def mouseDoubleClickEvent(self, event): # Reset the zoom
+        self.fit_to_view()
+        event.accept()
+
+"""Display the data as a zoomable scan view in the main window"""
+def display_scan(self=None):
+    # Set the image scale as for the static image
+    self.img_scale = image_size()
+    ratio = self.x_scale / self.y_scale
+    self.img_scale_x, self.img_scale_y = self.img_scale, int(self.img_scale / ratio)
+    self.image = ScanView(self.Raw_Z, self.img_scale_x, self.img_scale_y)
+
+    # Add column stretch to ensure image column expands
+    layout = self.centralWidget().layout()
+    layout.setColumnStretch(0, 0)
+    layout.setColumnStretch(1, 1)
+    return self.image
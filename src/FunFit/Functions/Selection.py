@@ -0,0 +1,251 @@
+"""Built-in modules"""
+import hashlib
+import math
+from collections import OrderedDict
+
+"""External modules"""
+import numpy as np
+from scipy import ndimage
+
+"""Constants"""
+VALID_BOX_CACHE_SIZE = 16 # Masks whose largest valid boxes are kept, the fit, data and residual of a result share one
+FRAME_BLOCK_ROWS = 256 # Rows of a rotated frame interpolated together, bounds the memory of the sample coordinates
+
+"""Bounding box of a boolean mask as (row, column) slices, so arrays can be cropped with views"""
+def bounding_box(mask):
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0: # Empty mask
+        return slice(0, 0), slice(0, 0)
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+"""Pixels of an array of the given shape whose centers lie inside a polygon, given by its vertices as (x, y) pixel coordinates"""
+def polygon_mask(vertices, shape):
+    mask = np.zeros(shape, dtype=bool)
+    fill_polygon(mask, vertices, True)
+    return mask
+
+"""Set the pixels of an array whose centers lie inside a polygon to a value.
+Filled row by row between the crossings of the polygon edges, only the rows of its bounding box are visited."""
+def fill_polygon(target, vertices, value):
+    shape = target.shape
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+    if len(vertices) < 3:
+        return
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    first, last = max(0, math.ceil(y0.min())), min(shape[0] - 1, math.floor(y0.max()))
+    if first > last:
+        return
+
+    # Column where every edge crosses every row, the lower end of an edge counts and the upper does not so a vertex is crossed once
+    rows = np.arange(first, last + 1, dtype=float)[:, None]
+    crossing = (rows >= np.minimum(y0, y1)) & (rows < np.maximum(y0, y1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(crossing, x0 + (rows - y0) * (x1 - x0) / (y1 - y0), np.inf)
+    if x.shape[1] % 2: # Pair every crossing, rows always have an even number of them
+        x = np.column_stack((x, np.full(len(x), np.inf)))
+    x = np.clip(np.ceil(np.sort(x, axis=1)), 0, shape[1]).astype(np.intp) # First pixel at or right of each crossing
+
+    # Pixels from each entering crossing up to the next leaving crossing
+    for row, row_crossings in zip(range(first, last + 1), x):
+        for start, stop in zip(row_crossings[0::2], row_crossings[1::2]):
+            if start >= shape[1]:
+                break
+            target[row, start:stop] = value
+
+"""Label map of numbered polygons, pixels inside the i-th polygon are labelled i + 1 and all others 0.
+Every polygon is rasterized once, a polygon drawn later covers the earlier ones where they overlap."""
+def label_map(polygons, shape):
+    labels = np.zeros(shape, dtype=np.min_scalar_type(len(polygons)))
+    for label, vertices in enumerate(polygons, start=1):
+        fill_polygon(labels, vertices, label)
+    return labels
+
+class SelectionMask:
+    """Selected pixels of a scan, one bit per pixel of the bounding box of the selection.
+    Tools read the selected or the other values of the data as masked arrays, the data itself is not copied."""
+    def __init__(self, mask):
+        self.shape = mask.shape
+        self.rows, self.cols = bounding_box(mask)
+        box = mask[self.rows, self.cols]
+        self.box_shape = box.shape
+        self.packed = np.packbits(box, axis=None)
+
+    def box(self): # Boolean mask of the bounding box, True for selected pixels
+        return np.unpackbits(self.packed, count=self.box_shape[0] * self.box_shape[1]).reshape(self.box_shape).view(bool)
+
+    def full(self): # Boolean mask of the scan, True for selected pixels
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[self.rows, self.cols] = self.box()
+        return mask
+
+    def inside(self, Z): # Selected values of data of the scan shape, a masked view of its bounding box
+        return np.ma.masked_array(Z[self.rows, self.cols], mask=~self.box())
+
+    def outside(self, Z): # Values of data of the scan shape outside the selection, a masked view
+        return np.ma.masked_array(Z, mask=self.full())
+
+class RegionLabels:
+    """Numbered regions of a scan, held as a label map of the bounding box of all regions with 0 outside the regions.
+    The selection is the union of the regions, statistics of every region are taken in one pass over the labels."""
+    def __init__(self, labels):
+        self.shape = labels.shape
+        self.selection = SelectionMask(labels > 0)
+        self.rows, self.cols = self.selection.rows, self.selection.cols
+        self.labels = np.ascontiguousarray(labels[self.rows, self.cols])
+        self.count = int(self.labels.max()) if self.labels.size else 0
+        self.sizes = np.bincount(self.labels.ravel(), minlength=self.count + 1)[1:] # Pixels of every region
+
+    def full(self): # Label map of the scan
+        labels = np.zeros(self.shape, dtype=self.labels.dtype)
+        labels[self.rows, self.cols] = self.labels
+        return labels
+
+    def region(self, label): # Selection of a single region
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[self.rows, self.cols] = self.labels == label
+        return SelectionMask(mask)
+
+    def label_at(self, rows, cols): # Labels of scan pixels given by their indices, 0 outside the regions
+        rows, cols = np.asarray(rows) - self.rows.start, np.asarray(cols) - self.cols.start
+        inside = (rows >= 0) & (rows < self.labels.shape[0]) & (cols >= 0) & (cols < self.labels.shape[1])
+        labels = np.zeros(rows.shape, dtype=self.labels.dtype)
+        labels[inside] = self.labels[rows[inside], cols[inside]]
+        return labels
+
+"""Largest axis-aligned rectangle inside a rotated rectangle, given by its corners in order, as (x0, y0, x1, y1)"""
+def inscribed_rectangle(corners):
+    corners = np.asarray(corners, dtype=float)
+    center = corners.mean(axis=0)
+    width, height = np.linalg.norm(corners[1] - corners[0]), np.linalg.norm(corners[3] - corners[0])
+    angle = math.atan2(corners[1][1] - corners[0][1], corners[1][0] - corners[0][0])
+    if width <= 0 or height <= 0:
+        return center[0], center[1], center[0], center[1]
+    sin_a, cos_a = abs(math.sin(angle)), abs(math.cos(angle))
+    long_side, short_side = max(width, height), min(width, height)
+    if short_side <= 2 * sin_a * cos_a * long_side or abs(sin_a - cos_a) < 1e-10: # Two corners touch the long sides
+        half = 0.5 * short_side
+        inner_w, inner_h = (half / sin_a, half / cos_a) if width >= height else (half / cos_a, half / sin_a)
+    else: # All four corners touch the sides
+        cos_2a = cos_a**2 - sin_a**2
+        inner_w, inner_h = (width * cos_a - height * sin_a) / cos_2a, (height * cos_a - width * sin_a) / cos_2a
+    return center[0] - inner_w / 2, center[1] - inner_h / 2, center[0] + inner_w / 2, center[1] + inner_h / 2
+
+"""Pixels (row, column slices) of an array of the given shape whose centers lie in the rectangle (x0, y0, x1, y1)"""
+def pixel_box(x0, y0, x1, y1, shape):
+    rows = slice(max(0, math.ceil(y0 - 1e-9)), min(shape[0], math.floor(y1 + 1e-9) + 1))
+    cols = slice(max(0, math.ceil(x0 - 1e-9)), min(shape[1], math.floor(x1 + 1e-9) + 1))
+    return rows, cols
+
+class RotatedFrame:
+    """Axis-aligned frame of a rotated rectangle, given by its corners in order as (x, y) pixel coordinates of a scan with axes x and y.
+    The frame is sampled at the finer pixel spacing of the scan, columns run along the first side and rows at +90° from it,
+    so data resampled into the frame is dense and the angle (radians, from x towards y) relates its directions to the scan."""
+    def __init__(self, corners, x, y):
+        self.scan_shape = (len(y), len(x))
+        self.origin = np.array([x[0], y[0]], dtype=float)
+        self.spacing = np.array([x[1] - x[0] if len(x) > 1 else 1.0, y[1] - y[0] if len(y) > 1 else 1.0], dtype=float)
+        corners = self.origin + np.asarray(corners, dtype=float) * self.spacing # Scan coordinates
+        side, other = corners[1] - corners[0], corners[3] - corners[0]
+        cross = side[0] * other[1] - side[1] * other[0]
+        if cross < 0: # Second side at -90°, the frame starts at the fourth corner so its rows keep to +90°
+            corners = corners[::-1]
+            side = corners[1] - corners[0]
+        width = float(np.hypot(*side))
+        self.step = float(np.min(np.abs(self.spacing)))
+        self.shape = (int(abs(cross) / max(width, 1e-300) // self.step), int(width // self.step))
+        self.angle = math.atan2(side[1], side[0])
+        self.start = corners[0]
+        self.unit_u = np.array([math.cos(self.angle), math.sin(self.angle)])
+        self.unit_v = np.array([-self.unit_u[1], self.unit_u[0]])
+
+    def rotated(self): # Whether the frame is rotated against the scan axes, an aligned frame is a box of scan pixels
+        return abs(math.sin(2 * self.angle)) > 1e-9
+
+    def axes(self): # Axes of the frame from its first corner, centers of the samples
+        return (np.arange(self.shape[1]) + 0.5) * self.step, (np.arange(self.shape[0]) + 0.5) * self.step
+
+    def coordinates(self, rows=slice(None)): # Scan coordinates (x, y) of the samples of the given rows of the frame
+        u, v = self.axes()
+        u, v = u[None, :], v[rows][:, None]
+        return (self.start[0] + u * self.unit_u[0] + v * self.unit_v[0],
+                self.start[1] + u * self.unit_u[1] + v * self.unit_v[1])
+
+    def resample(self, Z): # Data of the scan bilinearly interpolated at the samples of the frame in blocks of rows, NaN outside the scan
+        frame = np.empty(self.shape)
+        for start in range(0, self.shape[0], FRAME_BLOCK_ROWS):
+            x, y = self.coordinates(slice(start, start + FRAME_BLOCK_ROWS))
+            pixels = ((y - self.origin[1]) / self.spacing[1], (x - self.origin[0]) / self.spacing[0])
+            ndimage.map_coordinates(Z, pixels, output=frame[start:start + FRAME_BLOCK_ROWS], order=1, mode='constant', cval=np.nan)
+        return frame
+
+    def resample_valid(self, Z): # Resampled data and its axes, cropped to the largest box of samples inside the scan for spectra
+        frame, (u, v) = self.resample(Z), self.axes()
+        valid = np.isfinite(frame)
+        if valid.all():
+            return frame, u, v
+        rows, cols = largest_box(valid)
+        return frame[rows, cols], u[cols], v[rows]
+
+"""Largest boxes of recently used masks, keyed by the mask content and the hint"""
+VALID_BOXES = OrderedDict()
+
+"""Largest axis-aligned box of True values in a boolean mask as (row, column) slices.
+A hint, e.g. from the selection geometry, is used when it holds only True values. Memoized by the mask content and the hint."""
+def largest_box(mask, hint=None):
+    hint_key = None if hint is None else tuple((int(box.start), int(box.stop)) for box in hint) # Slices are not hashable
+    key = (mask.shape, hashlib.blake2b(np.packbits(mask)).digest(), hint_key)
+    cached = VALID_BOXES.get(key)
+    if cached is not None:
+        VALID_BOXES.move_to_end(key)
+        return cached
+
+    if hint is not None and mask[hint].size and mask[hint].all():
+        result = grown_box(mask, *hint)
+    else:
+        result = maximal_rectangle(mask)
+    VALID_BOXES[key] = result
+    while len(VALID_BOXES) > VALID_BOX_CACHE_SIZE:
+        VALID_BOXES.popitem(last=False)
+    return result
+
+"""Grow a box of True values one row or column at a time while the added edge holds only True values"""
+def grown_box(mask, rows, cols):
+    top, bottom, left, right = rows.start, rows.stop, cols.start, cols.stop
+    grown = True
+    while grown:
+        grown = False
+        if top > 0 and mask[top - 1, left:right].all():
+            top, grown = top - 1, True
+        if bottom < mask.shape[0] and mask[bottom, left:right].all():
+            bottom, grown = bottom + 1, True
+        if left > 0 and mask[top:bottom, left - 1].all():
+            left, grown = left - 1, True
+        if right < mask.shape[1] and mask[top:bottom, right].all():
+            right, grown = right + 1, True
+    return slice(top, bottom), slice(left, right)
+
+"""Largest rectangle of True values, row by row with the heights and the left and right bounds of every column vectorized"""
+def maximal_rectangle(mask):
+    rows, cols = bounding_box(mask)
+    mask = mask[rows, cols]
+    n_cols = mask.shape[1]
+    index = np.arange(n_cols)
+    height = np.zeros(n_cols, dtype=np.intp)
+    left = np.zeros(n_cols, dtype=np.intp)
+    right = np.full(n_cols, n_cols, dtype=np.intp)
+    best_area, best = 0, (slice(0, 0), slice(0, 0))
+    for i, row in enumerate(mask):
+        height = np.where(row, height + 1, 0)
+        # Bounds of the run of True values each column is in, narrowed to the bounds of the rows above while the column stays True
+        run_left = np.maximum.accumulate(np.where(row, 0, index + 1))
+        run_right = np.minimum.accumulate(np.where(row, n_cols, index)[::-1])[::-1]
+        left = np.where(row, np.maximum(left, run_left), 0)
+        right = np.where(row, np.minimum(right, run_right), n_cols)
+        area = (right - left) * height
+        j = int(np.argmax(area))
+        if area[j] > best_area:
+            best_area = area[j]
+            best = (slice(rows.start + i - height[j] + 1, rows.start + i + 1), slice(cols.start + left[j], cols.start + right[j]))
+    return best
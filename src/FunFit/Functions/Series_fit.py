@@ -0,0 +1,341 @@
+"""Built-in modules"""
+import os
+import re
+import time
+
+"""External modules"""
+import numpy as np
+from scipy.optimize import least_squares, curve_fit
+from scipy.sparse import csr_matrix
+from PyQt6.QtCore import QThread, QObject, pyqtSignal, Qt
+from PyQt6.QtWidgets import (
+    QMainWindow, QWidget, QVBoxLayout, QComboBox, QFileDialog, QPushButton,
+    QTableWidget, QTableWidgetItem, QHeaderView
+)
+
+"""Internal modules"""
+try:
+    from FunFit.Functions import helpers, Load, Fit_handling, Fit_selection
+    from FunFit.Functions.Fit_plotting import HTMLDelegate
+except:
+    from Functions import helpers, Load, Fit_handling, Fit_selection
+    from Functions.Fit_plotting import HTMLDelegate
+
+"""Constants"""
+SHARED_BASES = ("λ", "θ") # Parameters fitted jointly across all scans (wavelengths and angle)
+SERIES_MODES = ["Global fit (shared λ, θ)", "Sequential fit (warm start)"]
+COST_TOLERANCE = 1.25 # Relative RMSE increase that triggers a refit from the FFT guess
+
+"""Split the parameters of a model into shared and per-scan parameters"""
+def shared_parameters(param_names):
+    return [p for p in param_names if p.split("<sub>")[0] in SHARED_BASES]
+
+"""Simultaneous fit of several scans with shared parameters"""
+def global_fit(model_func, datasets, param_names, shared, p0_scans, jacobian=None):
+    # datasets: list of flattened (x, y, Z) samples, p0_scans: initial guesses for every scan in param_names order
+    n_scans, n_params = len(datasets), len(param_names)
+    shared_idx = np.array([i for i, p in enumerate(param_names) if p in shared], dtype=int)
+    local_idx = np.array([i for i, p in enumerate(param_names) if p not in shared], dtype=int)
+    n_shared, n_local = shared_idx.size, local_idx.size
+    p0_scans = np.asarray(p0_scans, dtype=float).reshape(n_scans, n_params)
+
+    # Parameter vector: [shared parameters, locals of scan 0, locals of scan 1, ...]
+    theta0 = np.concatenate([np.median(p0_scans[:, shared_idx], axis=0), p0_scans[:, local_idx].ravel()])
+    sizes = np.array([Z.size for _, _, Z in datasets])
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+    def scan_parameters(theta, i): # Full parameter vector of scan i
+        p = np.empty(n_params)
+        p[shared_idx] = theta[:n_shared]
+        p[local_idx] = theta[n_shared + i*n_local:n_shared + (i + 1)*n_local]
+        return p
+
+    def residuals(theta): # Stacked residual of all scans
+        res = np.empty(offsets[-1])
+        for i, (x, y, Z) in enumerate(datasets):
+            res[offsets[i]:offsets[i + 1]] = model_func((x, y), *scan_parameters(theta, i)) - Z
+        return res
+
+    # Block-sparse Jacobian structure: rows of scan i only depend on the shared and their own parameters
+    cols = [np.concatenate([np.arange(n_shared), n_shared + i*n_local + np.arange(n_local)]) for i in range(n_scans)]
+    indices = np.concatenate([np.tile(cols[i], sizes[i]) for i in range(n_scans)])
+    indptr = np.arange(offsets[-1] + 1) * (n_shared + n_local)
+    sparsity = csr_matrix((np.ones(indices.size), indices, indptr), shape=(offsets[-1], theta0.size))
+
+    def stacked_jacobian(theta): # Analytic Jacobian with the same block-sparse structure
+        data = np.empty((offsets[-1], n_shared + n_local))
+        for i, (x, y, Z) in enumerate(datasets):
+            J = jacobian((x, y), *scan_parameters(theta, i))
+            data[offsets[i]:offsets[i + 1]] = J[:, np.concatenate([shared_idx, local_idx])]
+        return csr_matrix((data.ravel(), indices, indptr), shape=sparsity.shape)
+
+    if jacobian is not None:
+        result = least_squares(residuals, theta0, jac=stacked_jacobian, tr_solver='lsmr', x_scale='jac', method='trf')
+    else:
+        result = least_squares(residuals, theta0, jac_sparsity=sparsity, tr_solver='lsmr', x_scale='jac', method='trf')
+
+    # Uncertainties from the (small, dense) normal matrix
+    J = csr_matrix(result.jac)
+    dof = max(1, offsets[-1] - theta0.size)
+    cov = np.linalg.pinv((J.T @ J).toarray()) * 2 * result.cost / dof
+    err = np.sqrt(np.abs(np.diag(cov)))
+
+    popt = np.array([scan_parameters(result.x, i) for i in range(n_scans)])
+    perr = np.array([scan_parameters(err, i) for i in range(n_scans)])
+    rmse = [np.sqrt(np.mean(result.fun[offsets[i]:offsets[i + 1]]**2)) for i in range(n_scans)]
+    return popt, perr, {"rmse": rmse, "nfev": result.nfev, "cost": result.cost}
+
+"""Order the scans of a series by name, with numbers compared by value"""
+def series_order(files):
+    natural_key = lambda path: [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', os.path.basename(path))]
+    return sorted(files, key=natural_key)
+
+"""Load the scans of a series, the scan shown in the main window is given with its corrections"""
+def load_scans(files, first_scan=None):
+    scans = [first_scan] if first_scan is not None else []
+    scans += [Load.read_file(file_path)[:3] for file_path in files[len(scans):]]
+    return scans
+
+"""Files of the scans whose data does not have the shape of the selection"""
+def mismatched_scans(files, scans, selection):
+    if selection is None:
+        return []
+    return [os.path.basename(file_path) for file_path, scan in zip(files, scans) if scan[2].shape != selection.shape]
+
+"""Flatten the data points of a scan inside the selection mask, or resampled in the frame of a rotated selection"""
+def scan_samples(scan, selection, frame=None):
+    return Fit_handling.selected_samples(*scan, selection, frame)
+
+"""Initial guesses of a scan from the parameter widgets and the FFT heuristic"""
+def initial_guess(scan, samples, params):
+    fitting_parameters, param_edits = params['FITTINGPARAMETERS'], params['param_edits']
+    initial_guesses = Fit_handling.read_initial_guesses(fitting_parameters, param_edits)
+    initial_guesses = Fit_handling.estimate_initial_guesses(params['function_name'], fitting_parameters, param_edits, initial_guesses,
+                                                            *scan, *samples)
+    return [initial_guesses[p] for p in fitting_parameters if p != "N"]
+
+"""Fit a single scan, returns None if the fit does not converge"""
+def fit_scan(model_func, samples, p0, jacobian=None):
+    x_flat, y_flat, Z = samples
+    try:
+        popt, pcov, infodict, _, _ = curve_fit(model_func, (x_flat, y_flat), Z, p0=p0, jac=jacobian, full_output=True)
+    except RuntimeError:
+        return None
+    perr = np.sqrt(np.diag(pcov)) if pcov is not None else np.full_like(popt, np.nan)
+    rmse = np.sqrt(np.mean(infodict['fvec']**2))
+    return popt, perr, rmse, infodict['nfev']
+
+"""Fit the scans one at a time, each fit is seeded with the result of the previous scan"""
+def sequential_fit(model_func, files, scans, selection, params, jacobian=None):
+    popt, perr, rmse, stats = [], [], [], []
+    previous, previous_rmse = None, None
+    for file_path, scan in zip(files, scans):
+        start = time.perf_counter()
+        samples = scan_samples(scan, selection, params.get('frame'))
+        fit_samples = Fit_handling.subsample(*samples)
+
+        # Warm start from the previous scan, fall back to the FFT guess only if the cost gets worse
+        fit, nfev, source = None, 0, "warm start"
+        if previous is not None:
+            fit = fit_scan(model_func, fit_samples, previous, jacobian)
+            nfev += fit[3] if fit is not None else 0
+        if fit is None or fit[2] > COST_TOLERANCE * previous_rmse:
+            fft_fit = fit_scan(model_func, fit_samples, initial_guess(scan, samples, params), jacobian)
+            nfev += fft_fit[3] if fft_fit is not None else 0
+            if fft_fit is not None and (fit is None or fft_fit[2] < fit[2]):
+                fit, source = fft_fit, "FFT guess"
+        if fit is None:
+            raise RuntimeError(f"Fit of {os.path.basename(file_path)} did not converge")
+
+        elapsed = time.perf_counter() - start
+        print(f"{os.path.basename(file_path)}: {nfev} function evaluations in {elapsed:.2f} s ({source})")
+        previous, previous_rmse = fit[0], fit[2]
+        popt.append(fit[0]), perr.append(fit[1]), rmse.append(fit[2]), stats.append((nfev, elapsed, source))
+    return np.array(popt), np.array(perr), {"rmse": rmse, "stats": stats}
+
+class SeriesFitWorker(QObject):
+    """Worker class for fitting a series of scans."""
+    finished = pyqtSignal(object) # Results dictionary
+    error = pyqtSignal(Exception)
+
+    def __init__(self, files, selection, params, mode=0, first_scan=None):
+        super().__init__()
+        self.files = files
+        self.selection = selection
+        self.params = params
+        self.mode = mode
+        self.first_scan = first_scan # (x, y, Z) of the first scan as corrected in the main window
+
+    def run(self): # Run the series fit
+        try:
+            scans = load_scans(self.files, self.first_scan)
+            mismatched = mismatched_scans(self.files, scans, self.selection)
+            if mismatched: # The selection is drawn on the first scan, its pixels only apply to scans of the same size
+                raise ValueError(f"The selection does not fit the size of {', '.join(mismatched)}")
+            param_names = [p for p in self.params['FITTINGPARAMETERS'] if p != "N"]
+            model_func = Fit_handling.model_function_builder(self.params['function_name'], self.params['param_edits'])
+            jacobian = Fit_handling.jacobian_builder(self.params['function_name'], self.params['param_edits'])
+            if self.mode == 0: # Global fit
+                datasets, p0_scans = [], []
+                for scan in scans:
+                    samples = scan_samples(scan, self.selection, self.params.get('frame'))
+                    p0_scans.append(initial_guess(scan, samples, self.params))
+                    datasets.append(Fit_handling.subsample(*samples))
+                shared = shared_parameters(param_names)
+                popt, perr, info = global_fit(model_func, datasets, param_names, shared, p0_scans, jacobian)
+            else: # Sequential fit
+                shared = []
+                popt, perr, info = sequential_fit(model_func, self.files, scans, self.selection, self.params, jacobian)
+            self.finished.emit({"files": self.files, "param_names": param_names, "shared": shared,
+                                "popt": popt, "perr": perr, **info})
+        except Exception as e:
+            self.error.emit(e)
+
+class SeriesResultsWindow(QMainWindow):
+    """Window to display the fitted parameters of every scan in a series."""
+    def __init__(self, parent, results):
+        super().__init__()
+        self.parent = parent
+        self.results = results
+        helpers.setStyleSheet_from_file(self, self.parent.parent.current_dir + "/GUI/stylesheet.qss")
+        self.init_ui()
+
+    def init_ui(self): # Set up the SeriesResultsWindow UI
+        # Set window properties
+        self.setGeometry(self.parent.geometry().x(), self.parent.geometry().y(), 900, 450)
+        self.setWindowFlags(Qt.WindowType.Window | Qt.WindowType.FramelessWindowHint)
+
+        # Create the main layout
+        central_widget = QWidget()
+        layout = QVBoxLayout(central_widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        self.setCentralWidget(central_widget)
+        title_bar = helpers.create_title_bar(self, "Series fitting results", "child")
+        layout.addWidget(title_bar, alignment=Qt.AlignmentFlag.AlignTop)
+
+        # One row per scan, shared parameters are marked in the header
+        names, shared = self.results["param_names"], self.results["shared"]
+        self.table = QTableWidget()
+        self.table.setObjectName("results_table")
+        stats = self.results.get("stats")
+        self.table.setColumnCount(len(names) + (5 if stats else 2))
+        self.table.setRowCount(len(self.results["files"]))
+        plain = lambda p: p.replace("<sub>", "").replace("</sub>", "") # Headers are not rendered as HTML
+        headers = ["Scan"] + [f"{plain(p)} (shared)" if p in shared else plain(p) for p in names] + ["RMSE (nm)"]
+        if stats:
+            headers += ["Evaluations", "Time (s)", "Start"]
+        for j, header in enumerate(headers):
+            self.table.setHorizontalHeaderItem(j, QTableWidgetItem(header))
+        for i, file_path in enumerate(self.results["files"]):
+            self.table.setItem(i, 0, QTableWidgetItem(os.path.basename(file_path)))
+            for j in range(len(names)):
+                value, err = self.results["popt"][i, j], self.results["perr"][i, j]
+                self.table.setItem(i, j + 1, QTableWidgetItem(f"{value:.3f} ± {err:.1e}"))
+            self.table.setItem(i, len(names) + 1, QTableWidgetItem(f"{self.results['rmse'][i]:.4f}"))
+            if stats:
+                nfev, elapsed, source = stats[i]
+                self.table.setItem(i, len(names) + 2, QTableWidgetItem(str(nfev)))
+                self.table.setItem(i, len(names) + 3, QTableWidgetItem(f"{elapsed:.2f}"))
+                self.table.setItem(i, len(names) + 4, QTableWidgetItem(source))
+            self.table.setRowHeight(i, 40)
+        self.table.setItemDelegate(HTMLDelegate())
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setAlternatingRowColors(True)
+        layout.addWidget(self.table)
+
+        export_button = QPushButton("Export table")
+        export_button.setObjectName("main_button")
+        export_button.clicked.connect(self.export_table)
+        layout.addWidget(export_button)
+
+    def export_table(self): # Export the results as a tab separated text file
+        Dialog_window = QFileDialog()
+        Dialog_window.setWindowTitle("Export series results")
+        Dialog_window.setFileMode(QFileDialog.FileMode.AnyFile)
+        Dialog_window.setNameFilter("Text files (*.txt)")
+        Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
+        Dialog_window.setWindowIcon(helpers.gui_icon("icon_window.png"))
+        if Dialog_window.exec() != QFileDialog.DialogCode.Accepted:
+            return
+        file_path = Dialog_window.selectedFiles()[0]
+        if not file_path.endswith('.txt'):
+            file_path += '.txt'
+        names = [p.replace("<sub>", "").replace("</sub>", "") for p in self.results["param_names"]]
+        stats = self.results.get("stats")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("# Scan\t" + "\t".join(f"{p}\td{p}" for p in names) + "\tRMSE" + ("\tEvaluations\tTime\tStart" if stats else "") + "\n")
+            for i, file_path in enumerate(self.results["files"]):
+                values = "\t".join(f"{v:.6e}\t{e:.6e}" for v, e in zip(self.results["popt"][i], self.results["perr"][i]))
+                extra = "\t{}\t{:.3f}\t{}".format(*stats[i]) if stats else ""
+                f.write(f"{os.path.basename(file_path)}\t{values}\t{self.results['rmse'][i]:.6e}{extra}\n")
+
+"""Series_fit.add_parameter_widgets - Used when fitting a series of scans"""
+def add_parameter_widgets(self):
+    Fit_handling.add_parameter_widgets(self)
+    self.series_mode = QComboBox()
+    self.series_mode.addItems(SERIES_MODES)
+    self.centralWidget().layout().addWidget(self.series_mode, 2, 0, 1, 2)
+
+"""Series_fit.on_apply - Used when fitting a series of scans"""
+def on_apply(self):
+    # Disable UI during fitting
+    self.scroll_area.setEnabled(False)
+    self.show_loading_overlay()
+
+    # Prepare parameters for worker
+    params = {
+        'param_edits': self.param_edits,
+        'FITTINGPARAMETERS': Fit_handling.FITTINGPARAMETERS,
+        'function_name': self.function_name,
+        'frame': getattr(self.parent, 'rotated_frame', None)
+    }
+
+    # Setup thread and worker
+    self.fit_thread = QThread()
+    self.fit_worker = SeriesFitWorker(self.parent.series_files, getattr(self.parent, 'selection', None), params, self.series_mode.currentIndex(),
+                                      (self.Raw_x, self.Raw_y, self.Raw_Z))
+    self.fit_worker.moveToThread(self.fit_thread)
+
+    # Connect signals
+    self.fit_thread.started.connect(self.fit_worker.run)
+    self.fit_worker.finished.connect(lambda results: on_series_complete(self, results))
+    self.fit_worker.error.connect(self.on_fit_error)
+    self.fit_worker.finished.connect(self.fit_thread.quit)
+    self.fit_worker.error.connect(self.fit_thread.quit)
+
+    self.fit_thread.start()
+
+"""Show the results of a series fit"""
+def on_series_complete(self, results):
+    self.hide_loading_overlay()
+    self.scroll_area.setEnabled(True)
+    self.results_window = SeriesResultsWindow(self, results)
+    self.results_window.show()
+    self.close()
+
+"""Function called from main window."""
+def fit_series(self=None):
+    # Select the scans of the series
+    Dialog_window = QFileDialog()
+    Dialog_window.setWindowTitle("Select the scans of the series")
+    Dialog_window.setFileMode(QFileDialog.FileMode.ExistingFiles)
+    Dialog_window.setNameFilter("All Files (*);;NanoFrazor Files (*.top);;NanoScope Files (*.spm)")
+    Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
+    Dialog_window.setWindowIcon(helpers.gui_icon("icon_window.png"))
+    Dialog_window.setDirectory(os.path.dirname(self.current_dir) + "/tests")
+    if Dialog_window.exec() != QFileDialog.DialogCode.Accepted:
+        return
+    files = series_order(Dialog_window.selectedFiles())
+    if not files:
+        return
+
+    # Show the first scan in the main window, a selection made on it is used for all scans
+    Load.load_data(self, files[0])
+    if not hasattr(self, 'Raw_Z'):
+        return
+    self.series_files = files
+    Fit_selection.init_interface(self)
+    Fit_handling.ParameterSelectionWindow.add_parameter_widgets = add_parameter_widgets
+    Fit_handling.ParameterSelectionWindow.on_apply = on_apply
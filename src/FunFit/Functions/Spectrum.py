@@ -0,0 +1,95 @@
+"""Built-in modules"""
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+
+"""External modules"""
+import numpy as np
+import scipy.fft
+
+"""Constants"""
+SPECTRUM_CACHE_BYTES = 256 * 2**20 # Memory of the spectra kept for reuse by the guesses, plots and exports
+SPECTRUM_WINDOWS = ("Hann", "Tukey", "Blackman", "None") # Windows applied before the FFT to suppress leakage from the edges
+SPECTRUM_WINDOW = "Hann" # Window of the FFT guesses and result plots
+TUKEY_ALPHA = 0.25 # Tapered fraction of the Tukey window
+
+"""Coefficients of a window along one axis, symmetric about the center. Cached per length, read only."""
+@functools.lru_cache(maxsize=32)
+def window_coefficients(window, length):
+    if window == "Hann":
+        coefficients = np.hanning(length)
+    elif window == "Blackman":
+        coefficients = np.blackman(length)
+    elif window == "Tukey":
+        position = np.minimum(np.arange(length), np.arange(length)[::-1]) / max(length - 1, 1) # Distance to the nearest edge
+        coefficients = np.where(position < TUKEY_ALPHA / 2, 0.5 * (1 - np.cos(2 * np.pi * position / TUKEY_ALPHA)), 1.0)
+    elif window == "None":
+        coefficients = np.ones(length)
+    else:
+        raise ValueError(f"Unknown window: {window}")
+    if length < 3: # Too short to taper
+        coefficients = np.ones(length)
+    coefficients.flags.writeable = False
+    return coefficients
+
+"""Multiply data by a 2D window, the outer product of the windows along the rows and columns"""
+def apply_window(Z, window):
+    if window == "None":
+        return Z
+    Z = Z * window_coefficients(window, Z.shape[0])[:, None]
+    Z *= window_coefficients(window, Z.shape[1])
+    return Z
+
+class Spectrum:
+    """Real 2D FFT of windowed data with the mean removed, zero padded to a fast length. NaN values count as zero."""
+    def __init__(self, Z, window=SPECTRUM_WINDOW):
+        Z = np.nan_to_num(Z) if np.isnan(Z).any() else Z
+        self.window = window
+        self.shape = tuple(scipy.fft.next_fast_len(n, real=True) for n in Z.shape)
+        self.half = scipy.fft.rfft2(apply_window(Z - np.mean(Z), window), s=self.shape, workers=-1)
+
+    def full(self, values): # Complete a half-plane array to the full plane by conjugate symmetry, zero frequency centered
+        rows = -np.arange(self.shape[0]) % self.shape[0]
+        columns = self.shape[1] - np.arange(self.half.shape[1], self.shape[1])
+        mirrored = values[rows][:, columns]
+        return np.fft.fftshift(np.concatenate([values, np.conj(mirrored) if np.iscomplexobj(values) else mirrored], axis=1))
+
+    def shifted(self): # Complex spectrum with the zero frequency centered, as fftshift(fft2(...))
+        return self.full(self.half)
+
+    def magnitude(self, flipped=False): # Magnitude normalized to its maximum, flipped=True for the data flipped upside down
+        magnitude = self.full(np.abs(self.half))
+        magnitude /= np.max(magnitude)
+        if flipped: # Flipping the rows mirrors the row frequencies
+            magnitude = np.roll(magnitude[::-1], 1 - self.shape[0] % 2, axis=0)
+        return magnitude
+
+    def frequencies(self, dx, dy): # Angular frequency axes (1/µm) of the centered spectrum
+        freq_x = 2*np.pi*np.fft.fftshift(np.fft.fftfreq(self.shape[1], d=dx))
+        freq_y = 2*np.pi*np.fft.fftshift(np.fft.fftfreq(self.shape[0], d=dy))
+        return freq_x, freq_y
+
+"""Spectra of recently used arrays, keyed by the memory the array views and the window"""
+SPECTRA = OrderedDict()
+SPECTRA_LOCK = threading.Lock() # Spectra are requested from the fit and plot worker threads
+
+"""Spectrum of an array, computed once per view so the guesses, plots and exports share it"""
+def spectrum(Z, window=None):
+    window = window or SPECTRUM_WINDOW # Resolved per call, so a changed default applies to later spectra
+    owner = Z
+    while isinstance(owner.base, np.ndarray): # Views of the same data share the owner
+        owner = owner.base
+    key = (Z.__array_interface__['data'][0], Z.shape, Z.strides, Z.dtype.str, window)
+    with SPECTRA_LOCK:
+        cached = SPECTRA.get(key)
+        if cached is not None and cached[0]() is owner:
+            SPECTRA.move_to_end(key)
+            return cached[1]
+
+    result = Spectrum(Z, window)
+    with SPECTRA_LOCK:
+        SPECTRA[key] = (weakref.ref(owner), result)
+        while len(SPECTRA) > 1 and sum(entry[1].half.nbytes for entry in SPECTRA.values()) > SPECTRUM_CACHE_BYTES:
+            SPECTRA.popitem(last=False)
+    return result
@@ -1,5 +1,4 @@
 """Built-in modules"""
-import warnings
 import copy
 
 """External modules"""
@@ -25,9 +24,8 @@ class LineCorrectionWindow(QMainWindow):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        if hasattr(parent, 'inside_image') and hasattr(parent, 'outside_image'):
-            self.inside_image = parent.inside_image
-            self.outside_image = parent.outside_image
+        if hasattr(parent, 'selection'): # Raw values outside the selection, NaN values masked as well
+            self.outside_data = np.ma.masked_invalid(parent.selection.outside(parent.Raw_Z))
         self.Raw_Z = parent.corrected_data if hasattr(parent, "corrected_data") else parent.Raw_Z
         self.original_Raw_Z = np.copy(parent.Raw_Z) # Preserve the original raw data
         self.x_scale, self.y_scale = parent.x_scale, parent.y_scale
@@ -131,12 +129,8 @@ class LineCorrectionWindow(QMainWindow):
 
     def median_alignment(self, data): # Perform median alignment
         # Use the outside of the highlighted rectangle for median alignment
-        if hasattr(self.parent, 'inside_image') and hasattr(self.parent, 'outside_image'):
-            outside_data = self.outside_image
-            warnings.filterwarnings('ignore')
-            median_values = np.nanmedian(outside_data, axis=1)
-            warnings.filterwarnings('default')
-            median_values[np.isnan(median_values)] = 0
+        if hasattr(self, 'outside_data'):
+            median_values = np.ma.median(self.outside_data, axis=1).filled(0) # Rows without values outside are not shifted
             return data - median_values[:, np.newaxis]
         else:
             # Fallback to median alignment on the entire dataset if no rectangle is defined
@@ -145,18 +139,14 @@ class LineCorrectionWindow(QMainWindow):
     def median_difference(self, data): # Perform median difference alignment
         diff_data = copy.deepcopy(data)
         # Use the outside of the highlighted rectangle for median diff
-        if hasattr(self.parent, 'inside_image') and hasattr(self.parent, 'outside_image'):
-            outside_data = copy.deepcopy(self.outside_image)
-            diff_data = outside_data
+        if hasattr(self, 'outside_data'):
+            diff_data = self.outside_data.copy()
             median_diff = np.zeros(len(diff_data))
             for i in range(len(diff_data)-1):
                 differences = diff_data[i] - diff_data[i+1]
-                warnings.filterwarnings('ignore')
-                median_diff[i+1] = np.median(differences[np.where(~np.isnan(differences))])
-                warnings.filterwarnings('default')
-                median_diff[np.isnan(median_diff)] = 0
-                diff_data[i+1, :] = diff_data[i+1, :] + median_diff[i+1]
-            return data + median_diff[:, np.newaxis] - np.nanmedian(diff_data[0])
+                median_diff[i+1] = np.ma.median(differences) if differences.count() else 0
+                diff_data[i+1, :] += median_diff[i+1]
+            return data + median_diff[:, np.newaxis] - (np.ma.median(diff_data[0]) if diff_data[0].count() else 0)
         else:
             # Fallback to median diff alignment on the entire dataset if no rectangle is defined
             median_diff = np.zeros(len(diff_data))
@@ -171,15 +161,15 @@ class LineCorrectionWindow(QMainWindow):
             return self.median_alignment(data)
         poly_data = copy.deepcopy(data)
         # Use the outside of the highlighted rectangle for polynomial fit
-        if hasattr(self.parent, 'inside_image') and hasattr(self.parent, 'outside_image'):
-            outside_data = self.outside_image
+        if hasattr(self, 'outside_data'):
+            outside_data = self.outside_data
             x = np.arange(len(outside_data[0]))
             for i in range(len(outside_data)):
                 y = outside_data[i]
-                idx = np.isfinite(y)
+                idx = ~np.ma.getmaskarray(y)
                 if len(x[idx]) < 2:
                     continue
-                p = np.polyfit(x[idx], y[idx], degree)
+                p = np.polyfit(x[idx], y.data[idx], degree)
                 poly_data[i] = poly_data[i] - np.polyval(p, x)
             return poly_data
         else:
@@ -207,8 +197,7 @@ class LineCorrectionWindow(QMainWindow):
         else:    
             self.parent.corrected_data = self.corrected_data
         self.Raw_Z = self.parent.corrected_data
-        image = display_data(self)
-        self.parent.image.setPixmap(image.pixmap())
+        self.parent.image.set_data(self.Raw_Z)
         self.close()
 
 """Function called from main window."""
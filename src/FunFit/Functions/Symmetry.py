@@ -0,0 +1,106 @@
+"""External modules"""
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+"""Internal modules"""
+try:
+    from FunFit.Functions.Spectrum import spectrum, window_coefficients
+except:
+    from Functions.Spectrum import spectrum, window_coefficients
+
+"""Constants"""
+MAX_ORDER = 12 # Largest number of wave directions detected
+MAX_COMPONENTS = 8 # Largest number of components along one direction
+PEAK_THRESHOLD = 0.1 # Smallest peak amplitude relative to the strongest, weaker peaks count as noise
+MAX_PEAKS = 64 # Strongest peaks considered
+ORDER_COHERENCE = 0.8 # Circular coherence of the peak directions from which an order is accepted
+DIRECTION_TOLERANCE = 3.0 # Degrees within which peaks count as one direction, widened for peaks close to the center
+DC_RADIUS = 2 # Frequency bins around zero excluded from the peak search, leakage of the removed mean
+MIN_PERIODS = 4 # Fewest periods across the data for a component, longer waves are mostly the outline of the structure
+ANGLE_BINS = 180 # Bins of the angular histogram over 0-180°, the spectrum of real data is point symmetric
+
+class SpectralStructure:
+    """Periodic components of data found from the peaks of its spectrum: the number of wave directions (rotational order),
+    the angle of the first direction and the wavelengths and amplitudes along each direction. Angles in degrees from x towards y.
+    Data resampled in a rotated frame gives its rotation (degrees), the frequencies and angles are then on the axes of the scan."""
+    def __init__(self, Z, dx, dy, window=None, rotation=0.0):
+        self.spectrum = result = spectrum(Z, window)
+        magnitude = result.full(np.abs(result.half)) # Zero frequency at the center, as Spectrum.shifted
+        rows, cols = magnitude.shape
+        offset_y, offset_x = np.arange(rows) - rows // 2, np.arange(cols) - cols // 2
+
+        # Local maxima in the half plane of positive y frequencies (and positive x on the x axis), away from zero frequency
+        half_plane = (offset_y[:, None] > 0) | ((offset_y[:, None] == 0) & (offset_x[None, :] > 0))
+        near_dc = (np.abs(offset_y)[:, None] <= DC_RADIUS) & (np.abs(offset_x)[None, :] <= DC_RADIUS)
+        near_dc |= np.hypot(offset_y[:, None] * Z.shape[0] / rows, offset_x[None, :] * Z.shape[1] / cols) < MIN_PERIODS
+        candidates = half_plane & ~near_dc & (magnitude == maximum_filter(magnitude, size=3, mode='wrap'))
+        strongest = magnitude[candidates].max() if candidates.any() else 0.0
+        peak_rows, peak_cols = np.nonzero(candidates & (magnitude >= PEAK_THRESHOLD * strongest) & (magnitude > 0))
+        order = np.argsort(magnitude[peak_rows, peak_cols])[::-1][:MAX_PEAKS]
+        self.rows, self.cols = peak_rows, peak_cols = peak_rows[order], peak_cols[order]
+
+        # Amplitude (nm) of a cosine giving the peak, the window weights the sum over the data
+        window_sum = np.sum(window_coefficients(result.window, Z.shape[0])) * np.sum(window_coefficients(result.window, Z.shape[1]))
+        self.amplitudes = 2 * magnitude[peak_rows, peak_cols] / window_sum
+        bins_y = offset_y[peak_rows] + interpolated_offset(magnitude, peak_rows, peak_cols, axis=0)
+        bins_x = offset_x[peak_cols] + interpolated_offset(magnitude, peak_rows, peak_cols, axis=1)
+        fx, fy = bins_x / (cols * dx), bins_y / (rows * dy)
+        if rotation:
+            cos, sin = np.cos(np.radians(rotation)), np.sin(np.radians(rotation))
+            fx, fy = fx * cos - fy * sin, fx * sin + fy * cos
+        self.freq_x, self.freq_y = fx, fy
+        self.wavelengths = 1 / np.hypot(fx, fy)
+        self.angles = np.degrees(np.arctan2(fy, fx)) % 180
+        # Angle resolution of every peak from its distance to the center in frequency bins
+        self.tolerances = np.maximum(DIRECTION_TOLERANCE, np.degrees(1.5 / np.hypot(bins_x, bins_y)))
+
+        self.histogram = np.bincount((self.angles * ANGLE_BINS / 180).astype(int) % ANGLE_BINS,
+                                     weights=self.amplitudes**2, minlength=ANGLE_BINS)
+        self.order, self.angle = self.rotational_order()
+
+    def rotational_order(self): # Smallest number of equally spaced directions the peak energy is coherent with, and the first direction
+        if not self.histogram.any():
+            return 0, 0.0
+        angles = (np.arange(ANGLE_BINS) + 0.5) * 180 / ANGLE_BINS
+        for order in range(1, MAX_ORDER + 1):
+            # Directions spaced by 180°/order add up in phase in the order-th circular harmonic
+            harmonic = np.sum(self.histogram * np.exp(2j * np.pi * order * angles / 180))
+            if abs(harmonic) >= ORDER_COHERENCE * self.histogram.sum():
+                angle = np.angle(harmonic) * 180 / (2 * np.pi * order)
+                return order, self.snapped_angle(angle, order)
+        return 1, self.snapped_angle(self.angles[0], 1)
+
+    def snapped_angle(self, angle, order): # Angle of the strongest peak along a direction, the smallest of the equivalent angles
+        close = self.direction(angle)
+        angle = self.angles[close[0]] if close.size else angle
+        spacing = 180 / order
+        return float((angle + spacing / 2) % spacing - spacing / 2)
+
+    def direction(self, angle): # Peaks along a direction, strongest first
+        distance = np.abs((self.angles - angle + 90) % 180 - 90)
+        return np.flatnonzero(distance <= self.tolerances)
+
+    def direction_peaks(self): # Strongest peak along each of the detected directions, in the order of the directions
+        peaks = [self.direction(self.angle + i * 180 / self.order) for i in range(self.order)]
+        return [int(close[0]) for close in peaks if close.size]
+
+    def component_peaks(self): # Peaks along the strongest direction, longest wavelength first
+        peaks = self.direction(self.angle)[:MAX_COMPONENTS]
+        return [int(i) for i in peaks[np.argsort(self.wavelengths[peaks], kind='stable')[::-1]]]
+
+"""Offset of peaks from their bin along an axis, from a parabola through the logarithm of the peak and its neighbours"""
+def interpolated_offset(magnitude, rows, cols, axis):
+    step = (1, 0) if axis == 0 else (0, 1)
+    shape = magnitude.shape
+    log = lambda r, c: np.log(np.maximum(magnitude[r % shape[0], c % shape[1]], np.finfo(float).tiny))
+    before, peak, after = log(rows - step[0], cols - step[1]), log(rows, cols), log(rows + step[0], cols + step[1])
+    curvature = before - 2 * peak + after
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (before - after) / curvature, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+"""Spectral structure of data on the axes of the scan, or of data resampled in a rotated frame with its axes"""
+def spectral_structure(Z, x, y, window=None, rotation=0.0):
+    dx = x[1] - x[0] if len(x) > 1 else 1.0
+    dy = y[1] - y[0] if len(y) > 1 else 1.0
+    return SpectralStructure(Z, dx, dy, window, rotation)
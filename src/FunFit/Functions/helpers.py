@@ -1,41 +1,63 @@
 """Built-in modules"""
 import os
+import functools
+import threading
 import platform
-import subprocess
-import ctypes
 
 """External modules"""
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.transforms import Bbox
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from PyQt6.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QLabel, QPushButton, QMessageBox, QApplication, QFileDialog
+from PyQt6.QtWidgets import QWidget, QMainWindow, QHBoxLayout, QVBoxLayout, QLabel, QPushButton, QMessageBox, QApplication, QFileDialog
 from PyQt6.QtCore import Qt, QPoint
-from PyQt6.QtGui import QIcon, QPixmap, QColor, QImage
+from PyQt6.QtGui import QIcon, QPixmap, QImage, QGuiApplication
 
 """Internal modules"""
 try:
-    from FunFit.Functions.Fit_plotting import PlotWindow
+    from FunFit.Functions import Contrast
 except:
-    from Functions.Fit_plotting import PlotWindow
+    from Functions import Contrast
+
+SCREEN_SIZE = None # Cached (width, height) of the primary screen in pixels
+HEADLESS_SCREEN_SIZE = (1920, 1080) # Used when no screen is available, e.g. in batch mode
+WATCHED_SCREEN = None # Screen whose change signals reset the cached size
+GUI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "GUI") # Stylesheet and icons
+APP_STYLESHEET = None # Stylesheet applied to the whole application
+EXPORT_FILTERS = "Text files (*.txt);;PNG images (*.png);;PDF files (*.pdf);;SVG images (*.svg)" # File types of the exports
+RENDER_LOCK = threading.Lock() # Matplotlib text layout is not thread safe, held while figures are drawn
+
+"""Get the size of the primary screen, read once and refreshed when the screen changes"""
+def screen_size():
+    global SCREEN_SIZE
+    if SCREEN_SIZE is None:
+        app = QGuiApplication.instance()
+        screen = app.primaryScreen() if app is not None else None
+        if screen is None: # Headless
+            SCREEN_SIZE = HEADLESS_SCREEN_SIZE
+        else:
+            # Device pixels, except on macOS where the logical size is scaled by 3/2
+            scale = 3/2 if platform.system() == "Darwin" else screen.devicePixelRatio()
+            SCREEN_SIZE = (int(screen.size().width()*scale), int(screen.size().height()*scale))
+            watch_screen(app, screen)
+    return SCREEN_SIZE
+
+"""Clear the cached screen size when the primary screen or its geometry changes"""
+def watch_screen(app, screen):
+    global WATCHED_SCREEN
+    if screen is WATCHED_SCREEN:
+        return
+    if WATCHED_SCREEN is None:
+        app.primaryScreenChanged.connect(reset_screen_size)
+    screen.geometryChanged.connect(reset_screen_size)
+    screen.physicalDotsPerInchChanged.connect(reset_screen_size)
+    WATCHED_SCREEN = screen
+
+def reset_screen_size(*args): # Slot for screen change signals
+    global SCREEN_SIZE
+    SCREEN_SIZE = None
 
 """Get application size from system"""
 def image_size():
     # Set the scale of the image to width of the main display monitor
-    if platform.system() == "Windows":
-        user32 = ctypes.windll.user32
-        screensize = user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
-    elif platform.system() == "Darwin":
-        from AppKit import NSScreen
-        screensize = [int(NSScreen.mainScreen().frame().size.width*3/2), int(NSScreen.mainScreen().frame().size.height*3/2)]
-    elif platform.system() == "Linux":
-        output = subprocess.check_output("xrandr | grep '*' | awk '{print $1}'", shell=True).decode().strip().split('\n')[0]
-        screensize = output.split('x')
-        screensize = [int(screensize[0]), int(screensize[1])]
-
-    image_size = min(screensize) // 3
-    return image_size
+    return min(screen_size()) // 3
 
 """Create a title bar for the provided parent window"""
 def create_title_bar(parent, title="Window Title", type="category"):
@@ -96,7 +118,7 @@ class DraggableTitleBar(QWidget):
         if type != "child":
             # Title icon
             self.title_icon = QLabel()
-            pixmap = QPixmap(os.path.join(self.current_dir, "GUI", "icon.png"))
+            pixmap = gui_pixmap("icon.png")
             self.title_icon.setPixmap(pixmap.scaled(100, 80, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
             title_bar_layout_inner.addWidget(self.title_icon)
         
@@ -117,7 +139,7 @@ class DraggableTitleBar(QWidget):
     def create_close_button(self, parent, type): # Create close button widget and return
         close_button = QPushButton()
         close_button.setFixedSize(40, 30 if type != "child" else 25)
-        close_button.setIcon(QIcon(QPixmap(os.path.join(self.current_dir, "GUI", "icon_close.png"))))
+        close_button.setIcon(gui_icon("icon_close.png"))
         close_button.setObjectName("close_button")
         setStyleSheet_from_file(close_button, self.current_dir + "/GUI/stylesheet.qss")
         close_button.setCursor(Qt.CursorShape.PointingHandCursor)
@@ -133,7 +155,7 @@ class DraggableTitleBar(QWidget):
         # Info button
         info_button = QPushButton()
         info_button.setFixedSize(30, 30)
-        info_button.setIcon(QIcon(self.current_dir + "/GUI/icon_info.png"))
+        info_button.setIcon(gui_icon("icon_info.png"))
         info_button.setObjectName("info_button")
         setStyleSheet_from_file(info_button, self.current_dir + "/GUI/stylesheet.qss")
         info_button.clicked.connect(self.info_button_action)  # Define the action for the info button
@@ -179,13 +201,9 @@ def display_data(self=None):
     ratio = self.x_scale / self.y_scale
     self.img_scale_x, self.img_scale_y = self.img_scale, int(self.img_scale / ratio)
     
-    # Create a figure and canvas for the image
-    figure = Figure(facecolor=None, edgecolor=None, frameon=False, figsize=(self.img_scale_x/100, self.img_scale_y/100), dpi=100)
-    canvas = FigureCanvasQTAgg(figure)
-    ax = figure.add_axes([0, 0, 1, 1])
-    ax.imshow(self.Raw_Z, cmap='gray', aspect=self.Raw_Z.shape[1]/self.Raw_Z.shape[0]/ratio)
+    # Render the data directly to an image
     self.image = QLabel()
-    self.image.setPixmap(canvas.grab())
+    self.image.setPixmap(QPixmap.fromImage(render_image(self.Raw_Z, self.img_scale_x, self.img_scale_y)))
     self.image.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
     # Add column stretch to ensure image column expands
@@ -203,12 +221,55 @@ def display_data(self=None):
         pass
     return self.image
 
+"""Colormap as a lookup table of 256 ARGB32 colors"""
+@functools.lru_cache(maxsize=None)
+def colormap_lut(cmap='gray'):
+    import matplotlib # Deferred, matplotlib is not needed to show the main window
+    rgba = np.round(matplotlib.colormaps[cmap](np.linspace(0, 1, 256)) * 255).astype(np.uint32)
+    return (rgba[:, 3] << 24) | (rgba[:, 0] << 16) | (rgba[:, 1] << 8) | rgba[:, 2]
+
+"""Decimate large data with strided views, Qt does the final resampling of the rendered image"""
+def decimate(Z, width, height):
+    Z = np.asarray(Z)
+    return Z[::max(1, Z.shape[0] // max(1, height)), ::max(1, Z.shape[1] // max(1, width))]
+
+"""Render 2D data as a QImage of the given size, NaN values are transparent"""
+def render_image(Z, width, height, cmap='gray', vmin=None, vmax=None):
+    Z = np.asarray(Z)
+    levels = decimate(Z, width, height)
+
+    if vmin is None and vmax is None: # Percentile contrast, the colors are looked up per histogram bin
+        histogram = Contrast.histogram(Z)
+        return argb_image(histogram.lut(colormap_lut(cmap), *histogram.limits())[histogram.bin(levels)], width, height)
+
+    # Normalize to 256 levels and look up the colors in one pass
+    vmin = np.nanmin(levels) if vmin is None else vmin
+    vmax = np.nanmax(levels) if vmax is None else vmax
+    scale = 255.999 / (vmax - vmin) if vmax > vmin else 0.0
+    levels = np.clip((levels - vmin) * scale, 0, 255)
+    nan_mask = np.isnan(levels)
+    if nan_mask.any():
+        levels[nan_mask] = 0
+    argb = colormap_lut(cmap)[levels.astype(np.uint8)]
+    argb[nan_mask] = 0
+    return argb_image(argb, width, height)
+
+"""Wrap ARGB32 values as a QImage of the given size"""
+def argb_image(argb, width, height):
+    # Wrap the buffer without copying, the array is kept alive by the image
+    image = QImage(argb.data, argb.shape[1], argb.shape[0], 4*argb.shape[1], QImage.Format.Format_ARGB32)
+    image.buffer = argb
+    if (argb.shape[1], argb.shape[0]) == (width, height):
+        return image
+    mode = Qt.TransformationMode.SmoothTransformation if argb.shape[1] > width else Qt.TransformationMode.FastTransformation
+    return image.scaled(width, height, Qt.AspectRatioMode.IgnoreAspectRatio, mode)
+
 """Add an export button to the main window"""
 def add_export_button(self):
     # Create the export button graphic
     btn = QPushButton(self.image)
     btn.setFixedSize(30, 30)
-    btn.setIcon(QIcon(self.current_dir + "/GUI/icon_export.png"))
+    btn.setIcon(gui_icon("icon_export.png"))
     btn.setObjectName("export_button")
     setStyleSheet_from_file(btn, self.current_dir + "/GUI/stylesheet.qss")
     btn.clicked.connect(lambda _, idx=1: export_main(self, idx))
@@ -223,58 +284,56 @@ def add_export_button(self):
     self.export_button.show()
 
     def export_main(self, idx):
-        # Set the plot window style
-        plt.rcParams.update({
-                            'font.size': 14,
-                            'figure.facecolor': 'white',
-                            'figure.edgecolor': 'black',
-                            'axes.facecolor': 'white',
-                            'axes.edgecolor': 'black',
-                            'axes.labelcolor': 'black',
-                            'xtick.color': 'black',
-                            'ytick.color': 'black',
-                            'text.color': 'black',
-                            'axes.titlesize': 16,
-                            'xtick.labelsize': 14,
-                            'ytick.labelsize': 14,
-                            })
+        # Deferred import, the plotting module is only needed for exports
+        try:
+            from FunFit.Functions.Fit_plotting import FitResults
+        except:
+            from Functions.Fit_plotting import FitResults
+
         Z_data = self.corrected_data if hasattr(self, 'corrected_data') else self.Raw_Z
-        self.plot_window = PlotWindow(self, self.Raw_x, self.Raw_y, Z_data, self.Raw_Z-1, None, None, None, None)
-        self.plot_window.ax5.set_title('')
-        export_plot(self.plot_window, idx)
+        export_plot(FitResults(self.Raw_x, self.Raw_y, Z_data, self.Raw_Z-1, flipped=False), idx)
+
+"""File dialog of the exports, returns the selected file path and name filter or None when cancelled"""
+def export_dialog(title, name_filter=EXPORT_FILTERS):
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    if current_dir.endswith('Functions'):
+        current_dir = os.path.dirname(current_dir)
+    Dialog_window = QFileDialog()
+    Dialog_window.setWindowTitle(f"Export {title}")
+    Dialog_window.setFileMode(QFileDialog.FileMode.AnyFile)
+    Dialog_window.setNameFilter(name_filter)
+    Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
+    Dialog_window.setWindowIcon(gui_icon("icon_window.png"))
+    Dialog_window.setDirectory(os.path.dirname(current_dir) + "/tests")
+    if Dialog_window.exec() == QFileDialog.DialogCode.Accepted:
+        return Dialog_window.selectedFiles()[0], Dialog_window.selectedNameFilter()
+    return None
 
 """Export data to a file"""
-def export_plot(self, index):
+def export_plot(results, index):
     data_map = {
-        0: (self.Z_fit_export, 'Fit', 'Purples_r'),
-        1: (self.Z_data_export, 'Data', 'Purples_r'),
-        2: (self.Z_residual_export, 'Residual', 'RdBu_r'),
-        3: (self.fft_fit_norm, 'FFT_Fit', self.fft_cmap),
-        4: (self.fft_data_norm, 'FFT_Data', self.fft_cmap),
-        5: (self.fft_residual_norm, 'FFT_Residual', self.fft_cmap)
+        0: ('Z_fit_export', 'Fit'),
+        1: ('Z_data_export', 'Data'),
+        2: ('Z_residual_export', 'Residual'),
+        3: ('fft_fit_norm', 'FFT_Fit'),
+        4: ('fft_data_norm', 'FFT_Data'),
+        5: ('fft_residual_norm', 'FFT_Residual')
     }
-    data, title, cmap = data_map.get(index, (None, None, None))
-    if data is None:
+    attribute, title = data_map.get(index, (None, None))
+    if attribute is None:
         return
+    if not hasattr(results, attribute): # The FFTs are only computed when needed
+        results.data_processing_FFT()
+    data = getattr(results, attribute)
     
-    if self.parent.__class__.__name__ != 'MainWindow':
+    if results.flipped:
         data = np.flipud(data)
 
     # Open a file dialog to select the file to plot
-    self.current_dir = os.path.dirname(os.path.realpath(__file__))
-    if self.current_dir.endswith('Functions'):
-        self.current_dir = os.path.dirname(self.current_dir)
-    Dialog_window = QFileDialog()
-    Dialog_window.setWindowTitle(f"Export {title}")
-    Dialog_window.setFileMode(QFileDialog.FileMode.AnyFile)
-    Dialog_window.setNameFilter("Text files (*.txt);;PNG images (*.png);;PDF files (*.pdf);;SVG images (*.svg)")
-    Dialog_window.setOption(QFileDialog.Option.DontUseNativeDialog)
-    Dialog_window.setWindowIcon(QIcon(os.path.join(self.current_dir, "GUI", "icon_window.png")))
-    Dialog_window.setDirectory(os.path.dirname(self.current_dir) + "/tests")
-    if Dialog_window.exec() == QFileDialog.DialogCode.Accepted:
-        file_path, selected_filter = Dialog_window.selectedFiles()[0], Dialog_window.selectedNameFilter()
-    else:
+    selection = export_dialog(title)
+    if selection is None:
         return
+    file_path, selected_filter = selection
     
     # Handle file extension based on selected filter
     if selected_filter == "Text files (*.txt)": # Write the data to a text file
@@ -285,8 +344,8 @@ def export_plot(self, index):
         if index <= 2:
             f.writelines([
                           f"# Channel: ZSensor\n", 
-                          f"# Width: {self.x[-1] - self.x[0]:.3f} µm\n",
-                          f"# Height: {self.y[-1] - self.y[0]:.3f} µm\n",
+                          f"# Width: {results.x[-1] - results.x[0]:.3f} µm\n",
+                          f"# Height: {results.y[-1] - results.y[0]:.3f} µm\n",
                           "# Value units: m\n"
                           ])
             np.savetxt(f, data*1e-9, fmt='%.4e', delimiter='\t')
@@ -294,6 +353,7 @@ def export_plot(self, index):
         else:
             f.writelines([
                           "# Channel: FFT\n",
+                          f"# Window: {results.window}\n",
                           "# X,Y units: 1/µm\n",
                           "# Value units: relative intensity\n"
                           ])
@@ -306,67 +366,50 @@ def export_plot(self, index):
         elif selected_filter == "SVG images (*.svg)" and not file_path.endswith('.svg'):
             file_path += '.svg'
         
-        # Get plot items
-        plot = self.figure
-        ax, cbar = plot.get_axes()[index], plot.get_axes()[index+6]
-        ax.figure.canvas.draw(), cbar.figure.canvas.draw()
-        
-        # Setup the plot extent
-        pad=0.02
-        items = ax.get_xticklabels() + ax.get_yticklabels() 
-        items += [ax, ax.title, ax.xaxis.label, ax.yaxis.label]
-        items += [cbar, cbar.yaxis.label]
-        bbox = Bbox.union([item.get_window_extent() for item in items])
-        full_extent = bbox.expanded(1.0 + pad, 1.0 + pad)
-        extent = full_extent.transformed(plot.dpi_scale_trans.inverted())
-        plot.savefig(file_path, bbox_inches=extent)
-
-"""Generate a bitmap from an equation"""
-def generate_bitmap_from_equation(equation_type):
-    # Set parameters for the image
+        # Render only the exported panel
+        results.save_panel(index, file_path)
+
+"""Generate a bitmap from the preview function of a model, rendered once per process"""
+@functools.lru_cache(maxsize=None)
+def generate_bitmap_from_equation(preview):
+    # Evaluate the preview function of the model on the whole pixel grid at once
     size = 100
-    image = QImage(size, size, QImage.Format.Format_RGB32)
-    image.fill(QColor("white"))
-
-    # Generate the image based on the equation type
-    for x in range(size):
-        for y in range(size):
-            if equation_type == "fourierseries":
-                N = 2
-                value = int((100 * np.sin(N * x / size * 2 * np.pi - np.pi/2) + 
-                              50 * np.sin(2 * N * x / size * 2 * np.pi + np.pi/2)) + 120)
-            elif equation_type == "polynomial":
-                value = int(0.0005*(x-size/2)**2 * 2*size + 10)
-            elif equation_type == "exponential":
-                value = int(np.exp(0.06*x) + 10)
-            elif equation_type == "quasicrystal":
-                N = 6
-                value = int(sum(50*np.cos(2 * np.pi / 7 * ((x - size/2) * np.cos((i * 180 / N) * np.pi / 180) + 
-                                                           (y - size/2) * np.sin((i * 180 / N) * np.pi / 180))) + 10 
-                                                           for i in range(N)))
-            elif equation_type == "gaussian":
-                value = int((np.exp(-((x - size / 2) ** 2 + (y - size / 2) ** 2) / (2 * (size / 5) ** 2))) * 255)
-            elif equation_type == "custom":
-                zx, zy = x * 3.0 / size - 2.0, y * 3.0 / size - 1.5
-                c = complex(zx, zy)
-                z = complex(0, 0)
-                for i in range(256):
-                    if abs(z) > 2.0: break
-                    z = z * z + c
-                value = 240 - int(i * 240 / 256) 
-            else:
-                value = 128
-            
-            # Ensure the value is within the range 0-255
-            value = max(0, min(255, value))
-            color = QColor(value, value, value)
-            image.setPixelColor(x, y, color)
+    x, y = np.arange(size)[np.newaxis, :], np.arange(size)[:, np.newaxis]
+    values = np.broadcast_to(preview(x, y, size), (size, size))
+
+    # Ensure the values are within the range 0-255
+    gray = np.ascontiguousarray(np.clip(np.trunc(values), 0, 255), dtype=np.uint8)
+    image = QImage(gray.data, size, size, size, QImage.Format.Format_Grayscale8)
     return QPixmap.fromImage(image)
 
+"""Read a stylesheet file once per process"""
+@functools.lru_cache(maxsize=None)
+def read_stylesheet(filepath):
+    with open(os.path.normpath(filepath), "r") as f:
+        return f.read()
+
+"""Apply a stylesheet to the whole application"""
+def setAppStyleSheet_from_file(filepath):
+    global APP_STYLESHEET
+    APP_STYLESHEET = read_stylesheet(filepath)
+    QApplication.instance().setStyleSheet(APP_STYLESHEET)
+
 """Set the stylesheet from a file"""
 def setStyleSheet_from_file(self, filepath): # Set the stylesheet from a file
-    with open(filepath, "r") as f:
-        self.setStyleSheet(f.read())
+    stylesheet = read_stylesheet(filepath)
+    # Windows inherit the application stylesheet. Child widgets keep their own copy, as it takes precedence over inline styles of their parents
+    if isinstance(self, QMainWindow) and stylesheet is APP_STYLESHEET:
+        return
+    self.setStyleSheet(stylesheet)
+
+"""Icons and pixmaps of the GUI folder, loaded once per process"""
+@functools.lru_cache(maxsize=None)
+def gui_pixmap(name):
+    return QPixmap(os.path.join(GUI_DIR, name))
+
+@functools.lru_cache(maxsize=None)
+def gui_icon(name):
+    return QIcon(os.path.join(GUI_DIR, name))
 
 """Show an error message"""
 def error_message(message):
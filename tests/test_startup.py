@@ -0,0 +1,21 @@
+"""Built-in modules"""
+import os
+import subprocess
+import sys
+
+"""Constants"""
+MAIN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "src", "FunFit", "FunFit_main.py"))
+
+"""Run the startup benchmark of the main window offscreen"""
+def run_startup_benchmark():
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    return subprocess.run([sys.executable, MAIN_SCRIPT, "--startup-time"], cwd=os.path.dirname(MAIN_SCRIPT), env=env, capture_output=True, text=True, timeout=60)
+
+def test_startup_within_budget():
+    result = run_startup_benchmark()
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Startup:" in result.stdout
+
+def test_startup_defers_heavy_modules(): # matplotlib, scipy and sklearn are imported by the tools on first use
+    result = run_startup_benchmark()
+    assert "Deferred modules imported: none" in result.stdout, result.stdout